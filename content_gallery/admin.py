@@ -3,13 +3,19 @@ import json
 from django.contrib import admin
 from django.contrib.contenttypes.admin import GenericInlineModelAdmin
 from django.conf.urls import url
+from django.core.urlresolvers import reverse
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
-from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.contenttypes.models import ContentType
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_http_methods
 
 from . import models
 from . import forms
 from . import utils
+from . import settings
 
 class ImageAdminInline(GenericInlineModelAdmin):
     """
@@ -18,6 +24,7 @@ class ImageAdminInline(GenericInlineModelAdmin):
     """
     model = models.Image
     form = forms.ImageAdminInlineForm
+    formset = forms.ImageAdminInlineFormSet
     template = "content_gallery/admin/image_admin_inline.html"
     extra = 0
 
@@ -59,11 +66,26 @@ class ImageAdminInline(GenericInlineModelAdmin):
         """
         Adds 'preview_url_pattern' attribute to the formset object.
         The attribute contains the pattern of URL used by JavaScript code
-        to get data of new added image to show its preview.
+        to get data of new added image to show its preview. Also adds
+        the URL and sizes used by JavaScript code to upload images.
         """
         formset = super().get_formset(request, obj, **kwargs)
         url = utils.get_admin_new_image_preview_url_pattern()
         setattr(formset, 'preview_url_pattern', url)
+        url = reverse('admin:gallery_image_upload')
+        setattr(formset, 'upload_url', url)
+        url = reverse('admin:gallery_image_bulk_upload')
+        setattr(formset, 'bulk_upload_url', url)
+        setattr(
+            formset,
+            'upload_chunk_threshold',
+            settings.CONF['upload_chunk_threshold']
+        )
+        setattr(
+            formset,
+            'upload_chunk_size',
+            settings.CONF['upload_chunk_size']
+        )
         return formset
 
 
@@ -76,8 +98,8 @@ class ImageAdmin(admin.ModelAdmin):
 
     def get_urls(self):
         """
-        Adds extra URL pattern for getting data of images. Used by
-        JavaScript code in inline admin for new added images.
+        Adds extra URL patterns for getting data of images and uploading
+        images. Used by JavaScript code in inline admin for new added images.
         """
         urls = super().get_urls()
         extra_urls = [
@@ -86,6 +108,18 @@ class ImageAdmin(admin.ModelAdmin):
                 self.preview,
                 name='gallery_new_image_preview'
             ),
+            url(
+                r'^ajax/upload/$',
+                # the view requires the logged in staff user
+                # and the CSRF token for POST requests
+                self.admin_site.admin_view(self.upload),
+                name='gallery_image_upload'
+            ),
+            url(
+                r'^ajax/bulk-upload/$',
+                self.admin_site.admin_view(self.bulk_upload),
+                name='gallery_image_bulk_upload'
+            ),
         ]
         return extra_urls + urls
 
@@ -111,6 +145,147 @@ class ImageAdmin(admin.ModelAdmin):
             content_type='application/json'
         )
 
+    @staticmethod
+    def _upload_response(data, status=200):
+        """
+        Returns the JSON response of the upload view
+        """
+        return HttpResponse(
+            json.dumps(data),
+            content_type='application/json',
+            status=status
+        )
+
+    @staticmethod
+    def _complete_upload(request, upload):
+        """
+        Creates the image using received data of the chunked upload
+        and the related object specified in the request. The image is
+        validated and saved by the ImageAdminForm like usual uploads.
+        Returns the result of the upload.
+        """
+        image_file = upload.open(request.POST.get('name', ''))
+        try:
+            form = forms.ImageAdminForm(request.POST, {'image': image_file})
+            if not form.is_valid():
+                errors = [
+                    str(error)
+                    for field_errors in form.errors.values()
+                    for error in field_errors
+                ]
+                return {'received': upload.received, 'errors': errors}
+            image = form.save()
+        finally:
+            image_file.close()
+        return {'received': image_file.size, 'pk': image.pk}
+
+    @method_decorator(require_http_methods(['GET', 'POST']))
+    def upload(self, request):
+        """
+        A view that receives an image uploaded by chunks. GET requests
+        return the number of received bytes to resume the upload. POST
+        requests contain the chunk and its offset, the chunk sent again
+        after a failed request does not change received data. The image
+        is created when the last chunk has been received, the result
+        is kept and returned to repeated requests.
+        """
+        # allow only AJAX requests
+        if not request.is_ajax():
+            raise PermissionDenied
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        params = request.POST if request.method == 'POST' else request.GET
+        try:
+            upload = utils.ChunkedUpload(params.get('upload_id', ''))
+        except ValueError:
+            return HttpResponseBadRequest()
+        if request.method == 'GET':
+            result = upload.get_result() or {'received': upload.received}
+            return self._upload_response(result)
+        try:
+            offset = int(params['offset'])
+            total = int(params['total'])
+            chunk = request.FILES['chunk']
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest()
+        max_bytes = settings.CONF['max_upload_bytes']
+        if offset < 0 or offset + chunk.size > total or \
+                max_bytes is not None and total > max_bytes:
+            return HttpResponseBadRequest()
+        # chunks of the upload are written one by one,
+        # so the image is never created twice
+        with utils.lock_file(upload.path):
+            result = upload.get_result()
+            if result is None:
+                if not upload.received:
+                    # the new upload is started
+                    utils.delete_expired_uploads()
+                try:
+                    received = upload.write(offset, chunk.chunks())
+                except ValueError:
+                    # a previous chunk has been lost, the client
+                    # should continue sending from the received size
+                    return self._upload_response(
+                        {'received': upload.received},
+                        status=409
+                    )
+                if received > total:
+                    return HttpResponseBadRequest()
+                if received < total:
+                    return self._upload_response({'received': received})
+                result = self._complete_upload(request, upload)
+                upload.set_result(result)
+        return self._upload_response(result)
+
+    @method_decorator(require_http_methods(['POST']))
+    def bulk_upload(self, request):
+        """
+        A view that creates images of many uploaded files related to
+        the same object at once. Files are validated one by one, then
+        images of valid files are created by Image.objects.create_bulk.
+        Returns the pk of the created image or a list of errors for each
+        file in the order of files.
+        """
+        # allow only AJAX requests
+        if not request.is_ajax():
+            raise PermissionDenied
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        try:
+            ctype = ContentType.objects.get_for_id(
+                int(request.POST['content_type'])
+            )
+            content_object = ctype.get_object_for_this_type(
+                pk=int(request.POST['object_id'])
+            )
+        except (KeyError, ValueError, ObjectDoesNotExist):
+            return HttpResponseBadRequest()
+        uploads = request.FILES.getlist('images')
+        field = models.Image._meta.get_field('image').formfield()
+        results = []
+        # valid uploads and their results
+        valid = []
+        for upload in uploads:
+            result = {'name': upload.name}
+            try:
+                field.clean(upload)
+                utils.check_image_limits(upload)
+            except ValidationError as e:
+                result['errors'] = e.messages
+            else:
+                valid.append((upload, result))
+            results.append(result)
+        created = models.Image.objects.create_bulk(
+            content_object,
+            [upload for upload, result in valid]
+        )
+        for (upload, result), (image, error) in zip(valid, created):
+            if image is None:
+                result['errors'] = [error]
+            else:
+                result['pk'] = image.pk
+        return self._upload_response({'results': results})
+
     class Media:
         js = (
             utils.create_static_url(
@@ -1,16 +1,20 @@
-import os
+import io
+import json
+import collections
+from concurrent import futures
 
 from django.db import models
 from django.db.models.fields import files
-from django.conf import settings as django_settings
 
 from . import settings
 from . import image_data
+from . import utils
 
 class GalleryImageFieldFile(files.ImageFieldFile):
     """
     A file wrapper of the field for image files used in the Image model.
-    Contains and manages 5 image files with different sizes.
+    Contains and manages the full-size image file and files of all variants
+    specified in the settings.
     """
 
     def __init__(self, *args, **kwargs):
@@ -21,62 +25,323 @@ class GalleryImageFieldFile(files.ImageFieldFile):
             settings.CONF['image_width'],
             settings.CONF['image_height'],
         )
-        # a small image for displays with low resolution
-        self.small_image = image_data.ImageFile(
-            self,
-            settings.CONF['small_image_width'],
-            settings.CONF['small_image_height'],
-            'small'
-        )
-        # a large preview, it's meant to be used on detail views
-        self.preview = image_data.ImageFile(
-            self,
-            settings.CONF['preview_width'],
-            settings.CONF['preview_height'],
-            'preview'
-        )
-        # a small preview, it's meant to be used on list views
-        self.small_preview = image_data.ImageFile(
-            self,
-            settings.CONF['small_preview_width'],
-            settings.CONF['small_preview_height'],
-            'small_preview'
-        )
-        # a thumbnail, used in the list of available images
-        self.thumbnail = image_data.ImageFile(
-            self,
-            settings.CONF['thumbnail_width'],
-            settings.CONF['thumbnail_height'],
-            'thumbnail'
-        )
+        # the uploaded image file, created in the 'keep_original' mode only
+        self.original = image_data.OriginalImageFile(self)
+        # image files of variants (by default a small image, a preview,
+        # a small preview and a thumbnail) ordered as in the settings
+        self.variants = collections.OrderedDict()
+        for variant in utils.get_variants():
+            self.variants[variant['name']] = image_data.ImageFile(
+                self,
+                variant['width'],
+                variant['height'],
+                variant['suffix'],
+                format=variant['format'],
+                quality=variant['quality'],
+                lazy=variant['lazy'],
+                variant=variant['name']
+            )
+        if settings.CONF['hashed_names']:
+            # immutable file names contain fingerprints of settings
+            # the files have been created with
+            self.set_versions(self._get_stored_fingerprints())
+        # the uploaded data spooled once for hashing and saving files
+        self._spooled = None
+
+    def __getattr__(self, name):
+        """
+        Allows to access image files of variants as attributes
+        (e.g. 'thumbnail' or 'preview').
+        """
+        # use __dict__ to avoid recursion if variants are not created yet
+        variants = self.__dict__.get('variants', {})
+        try:
+            return variants[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @classmethod
+    def from_row(cls, field, name, fingerprints=None):
+        """
+        Returns the field file of the image with given name without the
+        Image object, e.g. to manipulate with files of images read by
+        values_list(). Fingerprints are stored in the JSON string (probably
+        empty) or already decoded to the dict, they are used to build
+        immutable names of files of variants.
+        """
+        field_file = cls(None, field, name)
+        if settings.CONF['hashed_names']:
+            if isinstance(fingerprints, str):
+                fingerprints = json.loads(fingerprints) if fingerprints else {}
+            field_file.set_versions(fingerprints or {})
+        return field_file
+
+    def _is_uploaded(self):
+        """
+        Checks whether the image file has just been uploaded. Uploaded
+        files have no path in the name, the ImageField adds the path
+        while saving the name to the database.
+        """
+        return '/' not in self.name
+
+    def _get_stored_fingerprints(self):
+        """
+        Returns fingerprints stored in the related Image object
+        or an empty dict if there is no such object
+        """
+        get_fingerprints = getattr(self.instance, 'get_fingerprints', None)
+        if get_fingerprints is None:
+            return {}
+        return get_fingerprints()
+
+    def get_content_hash(self):
+        """
+        Returns the whole hash of the content of the uploaded image file
+        or None if the file has not been uploaded. The hash is calculated
+        while spooling the upload, so saving files does not read it again.
+        """
+        upload = self._spool_uploaded()
+        if upload is None:
+            return None
+        return upload.content_hash
+
+    def check_limits(self):
+        """
+        Checks whether the uploaded image file does not exceed limits
+        of the size and the number of pixels. Raises the ValidationError
+        if it does. Stored files are not checked.
+        """
+        if self._is_uploaded():
+            utils.check_image_limits(self.file)
+
+    def get_dhash(self):
+        """
+        Returns the perceptual hash of the full-size image using
+        the resized image data if it's saved or the file otherwise
+        """
+        data = self.image_data.data
+        if data is None:
+            with self.image_data.open() as f:
+                return utils.create_dhash(f)
+        data.seek(0)
+        value = utils.create_dhash(data)
+        data.seek(0)
+        return value
+
+    def set_versions(self, fingerprints):
+        """
+        Sets versions added to immutable names of files of variants using
+        stored fingerprints. Fingerprints of actual settings are used
+        for variants absent in the 'fingerprints' dict.
+        """
+        for name, variant in self.variants.items():
+            variant.version = fingerprints.get(name, variant.fingerprint)
+
+    def get_storage_names(self):
+        """
+        Returns names of all image files of the image in the storage
+        """
+        image_files = [self.image_data, self.original]
+        image_files.extend(self.variants.values())
+        return [image_file.storage_name for image_file in image_files]
+
+    def get_file_sizes(self, variants):
+        """
+        Returns a dict of sizes in bytes of existing files of the
+        full-size image ('image' name), the original image ('original'
+        name) and given variants. The size of the full-size image that
+        has not been saved yet is taken from its data in the memory.
+        """
+        image_files = [('image', self.image_data)]
+        # the original image is stored in the 'keep_original' mode only
+        if self.has_original():
+            image_files.append(('original', self.original))
+        image_files.extend((name, self.variants[name]) for name in variants)
+        sizes = {}
+        for name, image_file in image_files:
+            if image_file is self.image_data and self.image_data.data:
+                sizes[name] = self.image_data.data.size
+                continue
+            try:
+                sizes[name] = self.storage.size(image_file.storage_name)
+            except OSError:
+                # the file has been lost
+                pass
+        return sizes
+
+    def _spool_uploaded(self):
+        """
+        Returns the SpooledUpload object containing the data of the
+        uploaded image file or None if the file has not been uploaded.
+        The file is spooled once until the upload is released.
+        """
+        if not self._is_uploaded():
+            return None
+        if self._spooled is None:
+            self._spooled = utils.SpooledUpload(
+                self.file,
+                self.name,
+                settings.CONF['spool_max_memory_size']
+            )
+        return self._spooled
+
+    def release_upload(self):
+        """
+        Deletes the temporary file of the spooled upload if it exists
+        """
+        if self._spooled is not None:
+            self._spooled.close()
+            self._spooled = None
+
+    def _get_sources(self, upload, count):
+        """
+        Returns a list of 'count' file objects containing the uploaded
+        image data, so image files could be created concurrently. The data
+        is read once and shared. If the file has not been uploaded, the
+        field file itself is used since the data is not read.
+        """
+        if upload is None:
+            return [self] * count
+        return [upload.open() for i in range(count)]
 
-    @staticmethod
-    def _check_dir():
+    def _group_tasks(self, upload, tasks):
+        """
+        Returns a list of groups of (image_file, create) tasks. Files
+        of variants in the same group are pixel-identical (e.g. the source
+        is smaller than all of them), so the image is encoded once. Each
+        of other tasks makes up its own group.
         """
-        Creates a directory for image files if it does not exist.
+        if upload is None:
+            return [[task] for task in tasks]
+        try:
+            with upload.open() as f:
+                size, format = utils.get_image_info(f)
+        except OSError:
+            # the broken image is reported while creating files
+            return [[task] for task in tasks]
+        groups = collections.OrderedDict()
+        for i, (image_file, create) in enumerate(tasks):
+            if image_file is self.original or not create or image_file.lazy:
+                key = i
+            else:
+                key = image_file.get_render_key(size, format)
+            groups.setdefault(key, []).append((image_file, create))
+        return list(groups.values())
+
+    def _save_group(self, group, source, slug, name, shard):
         """
-        path = os.path.join(django_settings.MEDIA_ROOT, settings.CONF['path'])
-        if not os.path.isdir(path):
-            os.mkdir(path)
+        Saves image files of the group of tasks. The first file of the
+        group is created by resizing the source, other files are hard
+        links or copies of it.
+        """
+        if len(group) == 1:
+            image_file, create = group[0]
+            image_file.save(source, slug, name, create, shard)
+            return
+        # set names of all files without creating them
+        for image_file, create in group:
+            image_file.save(source, slug, name, False, shard)
+        first = group[0][0]
+        output = first._render(source)
+        utils.storage_save(self.storage, first.storage_name, output)
+        for image_file, create in group[1:]:
+            utils.storage_link(
+                self.storage,
+                first.storage_name,
+                image_file.storage_name,
+                output
+            )
+
+    def _create_hashed_slug(self, slug, name, upload):
+        """
+        Returns the slug of immutable file names for the uploaded image
+        or an empty string if the image has not been uploaded, so existing
+        files are never renamed.
+        """
+        if upload is None:
+            return ''
+        # new files are created using actual settings
+        self.set_versions({})
+        return '{}-{}'.format(
+            slug or utils.get_slug(name),
+            upload.content_hash[:12]
+        )
 
-    def save_files(self, slug, name):
+    def save_files(self, slug, name, variants=None):
         """
         Saves image data to the files or renames existing files if the related
         object has been changed and the image file has not been uploaded.
         Since the full-size image is stored in the memory, it is not saved
         into the file but prepared (resized) for saving by parent 'save' method.
+        The 'variants' is a list of names of variants required by the related
+        object, only these variants are created (all variants if it's None).
+        Files of variants and the original image are saved to the storage
+        concurrently, pixel-identical files of variants are encoded once.
+        Limits of the uploaded image are checked before decoding it.
         """
-        # create the directory first if it does not exist
-        self._check_dir()
-        self.image_data.save(self, slug, name)
-        self.thumbnail.save(self, slug, name)
-        self.small_image.save(self, slug, name)
-        self.preview.save(self, slug, name)
-        self.small_preview.save(self, slug, name)
+        self.check_limits()
+        upload = self._spool_uploaded()
+        try:
+            self._save_files(upload, slug, name, variants)
+        finally:
+            self.release_upload()
         # if no image has been uploaded, get the name directly
         if not self.image_data.data:
             self.name = self.image_data.name_in_db
 
+    def _save_files(self, upload, slug, name, variants):
+        """
+        Saves image files using the spooled upload, see 'save_files'
+        """
+        former_names = []
+        if settings.CONF['hashed_names']:
+            if upload is not None and name:
+                # files of the former image are deleted when
+                # the new one is saved to the database
+                former_names = GalleryImageFieldFile(
+                    self.instance,
+                    self.field,
+                    name
+                ).get_storage_names()
+            slug = self._create_hashed_slug(slug, name, upload)
+        # all files of the image are stored in the same subdirectory
+        shard = utils.create_shard(slug) if slug else None
+        self.image_data.save(self, slug, name, shard=shard)
+        # existing original image is renamed even if the mode is disabled
+        tasks = [(self.original, settings.CONF['keep_original'])]
+        for variant_name, variant in self.variants.items():
+            create = variants is None or variant_name in variants
+            tasks.append((variant, create))
+        groups = self._group_tasks(upload, tasks)
+        sources = self._get_sources(upload, len(groups))
+        workers = settings.CONF['storage_workers']
+        try:
+            with futures.ThreadPoolExecutor(workers) as executor:
+                results = [
+                    executor.submit(
+                        self._save_group,
+                        group,
+                        source,
+                        slug,
+                        name,
+                        shard
+                    )
+                    for group, source in zip(groups, sources)
+                ]
+                # raise the first error if any
+                for result in results:
+                    result.result()
+        finally:
+            if upload is not None:
+                for source in sources:
+                    source.close()
+        # the same image could be uploaded again
+        new_names = set(self.get_storage_names())
+        utils.delete_on_commit(
+            self.storage,
+            [name for name in former_names if name not in new_names]
+        )
+
     def save(self, name, content, save=True):
         """
         Saves full-size image data to the file and writes data to database
@@ -84,47 +349,200 @@ class GalleryImageFieldFile(files.ImageFieldFile):
         """
         # get resized image data
         content = self.image_data.data
-        # get generated file name
-        name = self.image_data.data.name
+        # get generated file name including the subdirectory
+        name = self.image_data.location
+        if settings.CONF['hashed_names']:
+            # the image with the same content is replaced,
+            # otherwise the storage would change the name
+            self.storage.delete(self.image_data.name_in_db)
         super().save(name, content, save)
 
     def delete_files(self):
         """
         Deletes all image files related to the Image object.
         """
-        self.thumbnail.delete()
         self.image_data.delete()
-        self.small_image.delete()
-        self.preview.delete()
-        self.small_preview.delete()
+        self.original.delete()
+        for variant in self.variants.values():
+            variant.delete()
+
+    def move_files(self, shard):
+        """
+        Moves all image files to another subdirectory of the gallery folder
+        and returns the new name of the full-size image in the database.
+        The full-size image is moved last and skipped if it has been moved
+        already, so interrupted moving could be continued.
+        """
+        for image_file in [self.original] + list(self.variants.values()):
+            image_file.move(shard)
+        new_name = utils.name_in_db(self.image_data.filename, shard)
+        if self.image_data.exists() or not self.storage.exists(new_name):
+            self.image_data.move(shard)
+        else:
+            self.image_data.shard = shard
+        self.name = self.image_data.name_in_db
+        return self.name
+
+    def has_original(self):
+        """
+        Checks whether the original image file exists
+        """
+        return self.original.exists()
+
+    def open_source(self):
+        """
+        Opens the file used as the source to create files of variants:
+        the original image if it's stored, the full-size image otherwise
+        """
+        if self.has_original():
+            return self.original.open()
+        return self.image_data.open()
+
+    def create_variant_file(self, name):
+        """
+        Creates the file of the variant using the original image file
+        as the source or the full-size image file if the original one
+        does not exist. The full-size image ('image' name) could be
+        created using the original image only.
+        """
+        if name == 'image':
+            if not self.has_original():
+                raise FileNotFoundError(
+                    "The original image file does not exist"
+                )
+            output = io.BytesIO()
+            with self.original.open() as source:
+                utils.image_resize(source, output, self.image_data.size)
+            output.seek(0)
+            utils.storage_save(
+                self.storage,
+                self.image_data.storage_name,
+                output
+            )
+            return
+        with self.open_source() as source:
+            self.variants[name]._create_image(source)
+
+    def regenerate_files(self, variants=None, obsolete=None):
+        """
+        Creates image files of given variants again using the original
+        image file or the full-size image file as the source. All variants
+        are created if 'variants' is not specified. The full-size image
+        ('image' name) is created only if the original image exists.
+        Files of lazy variants are deleted to be created on demand.
+        Returns a list of names of regenerated variants. Immutable files
+        are created with new names, names of replaced files are appended
+        to the 'obsolete' list or the files are deleted on commit if
+        it's None.
+        """
+        if variants is None:
+            variants = ['image'] + list(self.variants.keys())
+        hashed_names = settings.CONF['hashed_names']
+        replaced = []
+        regenerated = []
+        for variant in variants:
+            if variant == 'image':
+                # the full-size image can't be created from itself
+                # and immutable files are never overwritten
+                if not self.has_original() or hashed_names:
+                    continue
+                self.create_variant_file(variant)
+                regenerated.append(variant)
+                continue
+            image_file = self.variants[variant]
+            if image_file.lazy:
+                image_file.delete()
+            else:
+                former_name = image_file.storage_name
+                if hashed_names:
+                    image_file.version = image_file.fingerprint
+                self.create_variant_file(variant)
+                if image_file.storage_name != former_name:
+                    replaced.append(former_name)
+            if hashed_names:
+                image_file.version = image_file.fingerprint
+            regenerated.append(variant)
+        if obsolete is None:
+            utils.delete_on_commit(self.storage, replaced)
+        else:
+            obsolete.extend(replaced)
+        return regenerated
+
+    def get_fingerprints(self, variants=None):
+        """
+        Returns a dict containing fingerprints of settings used to create
+        the full-size image file and files of given variants (all variants
+        if 'variants' is None).
+        """
+        if variants is None:
+            variants = self.variants.keys()
+        fingerprints = {'image': self.image_data.fingerprint}
+        for variant in variants:
+            fingerprints[variant] = self.variants[variant].fingerprint
+        return fingerprints
+
+    def get_stale_variants(self, fingerprints):
+        """
+        Returns a list of variants created with settings that differ
+        from actual ones. The 'fingerprints' is a dict of fingerprints
+        stored while creating image files. Lazy variants that have
+        not been created yet are not stale. The full-size image ('image'
+        name) is stale only in the 'keep_original' mode since it could
+        not be created again without the original image. It's never
+        stale if file names are immutable.
+        """
+        actual = self.get_fingerprints()
+        stale = []
+        if settings.CONF['keep_original'] and \
+                not settings.CONF['hashed_names']:
+            if fingerprints.get('image') != actual['image']:
+                stale.append('image')
+        for name, variant in self.variants.items():
+            if variant.lazy and name not in fingerprints:
+                continue
+            if fingerprints.get(name) != actual[name]:
+                stale.append(name)
+        return stale
+
+    def get_variant_url(self, name):
+        """
+        Returns URL to the file of the variant with given name,
+        'image' is the name of the full-size image and 'original'
+        is the name of the original image
+        """
+        if name == 'image':
+            return self.image_data.url
+        if name == 'original':
+            return self.original.url
+        return self.variants[name].url
 
     @property
     def thumbnail_url(self):
         """
         URL to the thumbnail file
         """
-        return self.thumbnail.url
+        return self.get_variant_url('thumbnail')
 
     @property
     def image_url(self):
         """
         URL to the full-size image file
         """
-        return self.image_data.url
+        return self.get_variant_url('image')
 
     @property
     def small_image_url(self):
         """
         URL to the small image file
         """
-        return self.small_image.url
+        return self.get_variant_url('small_image')
 
     @property
     def preview_url(self):
         """
         URL to the preview image file
         """
-        return self.preview.url
+        return self.get_variant_url('preview')
     # the 'url' property is used by django.forms.ClearableFileInput
     # to display the link to the uploaded image and it contains the link
     # to the full-size image. Override this property with the 'preview' url
@@ -135,7 +553,15 @@ class GalleryImageFieldFile(files.ImageFieldFile):
         """
         URL to the small preview image file
         """
-        return self.small_preview.url
+        return self.get_variant_url('small_preview')
+
+
+def validate_image_limits(value):
+    """
+    Checks whether the uploaded image does not exceed limits specified
+    in the settings, so forms reject huge images before decoding them
+    """
+    value.check_limits()
 
 
 class GalleryImageField(models.ImageField):
@@ -143,3 +569,6 @@ class GalleryImageField(models.ImageField):
     A field for image files used in the Image model.
     """
     attr_class = GalleryImageFieldFile
+    default_validators = models.ImageField.default_validators + [
+        validate_image_limits
+    ]
@@ -1,4 +1,6 @@
 from django import forms
+from django.contrib.contenttypes.forms import BaseGenericInlineFormSet
+from django.contrib.contenttypes.models import ContentType
 
 from . import models
 from . import widgets
@@ -80,3 +82,21 @@ class ImageAdminInlineForm(forms.ModelForm):
             ),
             'image': widgets.ImageInlineWidget()
         }
+
+
+class ImageAdminInlineFormSet(BaseGenericInlineFormSet):
+    """
+    A formset for the Image admin inline. Images are saved and deleted
+    without refreshing the summary of the related object, which is
+    refreshed once when all images have been saved and reordered.
+    """
+
+    def save(self, commit=True):
+        if not commit:
+            return super().save(commit)
+        for form in self.forms:
+            form.instance.defer_summary = True
+        instances = super().save(commit)
+        ctype = ContentType.objects.get_for_model(self.instance)
+        models.GallerySummary.objects.refresh([(ctype.pk, self.instance.pk)])
+        return instances
@@ -1,7 +1,9 @@
+import io
 import os
 from abc import ABCMeta, abstractmethod
 
 from . import utils
+from . import settings
 
 class BaseImageData(metaclass=ABCMeta):
     """
@@ -9,16 +11,27 @@ class BaseImageData(metaclass=ABCMeta):
     stored image data. Implements common methods.
     """
 
+    # the format and the quality of the image file,
+    # the format of uploaded image and default quality are used if None
+    format = None
+    quality = None
+    # lazy images are not created while uploading the image
+    lazy = False
+
     def __init__(self, image, width, height):
         # save the name and the size of the image
         self._set_name(image.name)
         self.size = (width, height)
+        # all files are saved in the storage of the image field
+        self.storage = image.storage
 
     def _set_name(self, name):
         """
         Sets the name of the image file excluding the path
+        and the subdirectory of the gallery folder containing it
         """
         self.name = os.path.basename(name)
+        self.shard = utils.get_shard(name)
 
     @property
     def filename(self):
@@ -27,19 +40,55 @@ class BaseImageData(metaclass=ABCMeta):
         """
         return self._create_filename(self.name)
 
+    @property
+    def location(self):
+        """
+        Returns the file name of the image including
+        the subdirectory of the gallery folder
+        """
+        if self.shard:
+            return '/'.join([self.shard, self.filename])
+        return self.filename
+
+    @property
+    def storage_name(self):
+        """
+        Returns the name of the image file in the storage
+        """
+        return utils.name_in_db(self.filename, self.shard)
+
     @property
     def path(self):
         """
-        Returns the path to the image
+        Returns the path to the image in the local file system
         """
-        return utils.create_path(self.filename)
+        return utils.create_path(self.filename, self.shard)
 
     @property
     def url(self):
         """
         Returns the URL to the image
         """
-        return utils.create_url(self.filename)
+        return self.storage.url(self.storage_name)
+
+    def exists(self):
+        """
+        Checks whether the image file exists in the storage
+        """
+        return self.storage.exists(self.storage_name)
+
+    def open(self):
+        """
+        Opens the image file for reading
+        """
+        return self.storage.open(self.storage_name, 'rb')
+
+    @property
+    def fingerprint(self):
+        """
+        Returns the fingerprint of settings used to create the image
+        """
+        return utils.create_fingerprint(self.size, self.format, self.quality)
 
     @abstractmethod
     def _create_image(self, image):
@@ -58,7 +107,7 @@ class BaseImageData(metaclass=ABCMeta):
         ext = utils.get_ext(filename)
         self.name = name + ext
 
-    def save(self, image, slug, name):
+    def save(self, image, slug, name, create=True, shard=None):
         """
         Saves changes of the Image object: saves new image data
         and/or renames the file. 'image' contains the image
@@ -66,7 +115,11 @@ class BaseImageData(metaclass=ABCMeta):
         'slug' is a new name of the image or empty string if
         the related object has not changed. 'name' is the former
         name of the image and used when the related object has not
-        changed but a new image file has been uploaded.
+        changed but a new image file has been uploaded. If 'create'
+        is False, the new image data is not saved (the image is not
+        required by the related object). 'shard' is the subdirectory
+        of the gallery folder for the new name, it's created using
+        the slug if None.
         """
         # check whether there is a new uploaded image
         # uploaded files have not '/' in the file name
@@ -78,20 +131,24 @@ class BaseImageData(metaclass=ABCMeta):
         # it will be overwritten if slug specified, it happens when
         # a new image object is created or the related object changed
         self._set_name(name)
-        if is_uploaded and name:
+        if is_uploaded and name and not settings.CONF['hashed_names']:
             # delete the old file if it exists
-            # and a new image has been uploaded
+            # and a new image has been uploaded,
+            # immutable files are deleted by the field file
             self.delete()
         if slug:
             # if new name required create it using
             # the slug and the ext of actual image file
             new_name = slug + utils.get_ext(image.name)
+            if shard is None:
+                shard = utils.create_shard(slug)
             if self.name and not is_uploaded:
                 # no new file has been uploaded
                 # so just rename existing file
-                self._rename_file(new_name)
+                self._rename_file(new_name, shard)
             # set a new name
             self.name = new_name
+            self.shard = shard
         # when a new file has been uploaded
         if is_uploaded:
             # if the slug is specified the file name is already correct
@@ -99,27 +156,37 @@ class BaseImageData(metaclass=ABCMeta):
                 # change the ext of existing file name
                 # if the related object has not changed
                 self._change_ext(image.name)
-            # resize and save the image data
-            self._create_image(image)
+            # resize and save the image data unless it's created later
+            if create and not self.lazy:
+                self._create_image(image)
 
-    def _rename_file(self, name):
+    def _rename_file(self, name, shard=None):
         """
-        Renames the image file
+        Renames the image file, 'shard' is the new subdirectory
+        of the gallery folder (the file is not moved if None)
         """
+        if shard is None:
+            shard = self.shard
         # create a filename depending of implementation
         new_filename = self._create_filename(name)
-        # get the path
-        new_path = utils.create_path(new_filename)
-        os.rename(self.path, new_path)
+        utils.storage_rename(
+            self.storage,
+            self.storage_name,
+            utils.name_in_db(new_filename, shard)
+        )
+
+    def move(self, shard):
+        """
+        Moves the image file to another subdirectory of the gallery folder
+        """
+        self._rename_file(self.name, shard)
+        self.shard = shard
 
     def delete(self):
         """
         Deletes the iamge file if it exists
         """
-        try:
-            os.remove(self.path)
-        except FileNotFoundError:
-            pass
+        self.storage.delete(self.storage_name)
 
 
 class ImageFile(BaseImageData):
@@ -129,24 +196,123 @@ class ImageFile(BaseImageData):
     into the files directly.
     """
 
-    def __init__(self, image, width, height, suffix):
+    # the fingerprint of settings added to immutable file names
+    version = None
+
+    def __init__(self, image, width, height, suffix,
+                 format=None, quality=None, lazy=False, variant=None):
         # store the suffix word used in the file name
         self.suffix = suffix
+        # the name of the variant, used in URLs of lazy images
+        self.variant = variant or suffix
+        self.format = format
+        self.quality = quality
+        self.lazy = lazy
         super().__init__(image, width, height)
 
     def _create_filename(self, filename):
         """
         Inserts the suffix word separated with underscore 
-        in the end of the file name and returns it.
+        in the end of the file name and returns it. The ext
+        is replaced if the format of the image is specified.
+        The version is added after the suffix if it's set.
         """
         name, ext = os.path.splitext(filename)
+        if self.format:
+            ext = utils.get_format_ext(self.format)
+        if self.version:
+            return "{}_{}-{}{}".format(name, self.suffix, self.version, ext)
         return "{}_{}{}".format(name, self.suffix, ext)
 
+    @property
+    def url(self):
+        """
+        Returns the URL to the image. Lazy images are served by
+        the view that creates the file on the first request.
+        """
+        if self.lazy:
+            return utils.create_variant_url(self.variant, self.location)
+        return super().url
+
+    def _rename_file(self, name, shard=None):
+        """
+        Renames the image file if it exists. Files of lazy variants
+        and variants not required by the related object could be absent.
+        """
+        try:
+            super()._rename_file(name, shard)
+        except FileNotFoundError:
+            pass
+
+    def get_render_key(self, source_size, source_format):
+        """
+        Returns a key of the image created using the source image of
+        given size and format. Files of variants with equal keys are
+        pixel-identical: the source smaller than the size of the variant
+        is not resized, so its size is used instead.
+        """
+        width, height = source_size
+        if width <= self.size[0] and height <= self.size[1]:
+            size = source_size
+        else:
+            size = self.size
+        return size, self.format or source_format, self.quality
+
+    def _render(self, image):
+        """
+        Resizes the image and returns the io object with encoded data
+        """
+        output = io.BytesIO()
+        utils.image_resize(
+            image,
+            output,
+            self.size,
+            self.format,
+            self.quality
+        )
+        output.seek(0)
+        return output
+
     def _create_image(self, image):
         """
         Resizes the image and saves it into the file.
         """
-        utils.image_resize(image, self.path, self.size)
+        output = self._render(image)
+        utils.storage_save(self.storage, self.storage_name, output)
+
+
+class OriginalImageFile(ImageFile):
+    """
+    The uploaded image file stored without any changes. Used
+    as the source to create the full-size image and files
+    of variants again with other settings.
+    """
+
+    def __init__(self, image):
+        # the original image is not resized
+        super().__init__(image, None, None, 'original')
+
+    @property
+    def url(self):
+        """
+        Returns the URL to the original image file
+        """
+        return self.storage.url(self.storage_name)
+
+    @property
+    def fingerprint(self):
+        """
+        The original image does not depend on settings
+        """
+        return None
+
+    def _create_image(self, image):
+        """
+        Copies the data of uploaded file into the file.
+        """
+        image.seek(0)
+        utils.storage_save(self.storage, self.storage_name, image)
+        image.seek(0)
 
 
 class InMemoryImageData(BaseImageData):
@@ -182,4 +348,4 @@ class InMemoryImageData(BaseImageData):
         after saving the image object into the database.
         The transformation is adding the path.
         """
-        return utils.name_in_db(self.name)
+        return utils.name_in_db(self.name, self.shard)
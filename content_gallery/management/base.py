@@ -0,0 +1,75 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class ChunkedCommand(BaseCommand):
+    """
+    A base class of management commands that process images or files
+    by chunks, probably in a pool of workers. Adds the '--chunk-size'
+    and '--workers' options and checks their values before handling.
+    Also reads and writes the checkpoint file that keeps the progress
+    to resume interrupted commands.
+    """
+
+    @staticmethod
+    def add_chunk_size_argument(parser, help):
+        """
+        Adds the '--chunk-size' option with the default of 500
+        """
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help=help
+        )
+
+    @staticmethod
+    def add_workers_argument(parser, default, help):
+        """
+        Adds the '--workers' option, the default is the number
+        of threads or os.cpu_count() for processes
+        """
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=default,
+            help=help
+        )
+
+    def execute(self, *args, **options):
+        """
+        Checks whether the number of workers and the chunk
+        size are positive if the command has these options
+        """
+        if options.get('workers', 1) < 1:
+            raise CommandError("The number of workers should be positive")
+        if options.get('chunk_size', 1) < 1:
+            raise CommandError("The chunk size should be positive")
+        return super().execute(*args, **options)
+
+    @staticmethod
+    def read_checkpoint(path):
+        """
+        Returns the number stored in the checkpoint file
+        or None if the file does not exist
+        """
+        try:
+            with open(path) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            raise CommandError("Broken checkpoint file '{}'".format(path))
+
+    @staticmethod
+    def write_checkpoint(path, value):
+        """
+        Stores the number in the checkpoint file
+        """
+        # write a temporary file first to avoid a broken checkpoint
+        # if the process has been interrupted while writing
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(value))
+        os.replace(tmp_path, path)
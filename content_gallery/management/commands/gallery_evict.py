@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import models
+from ... import settings
+
+class Command(BaseCommand):
+    """
+    Deletes least recently used files of variants created on demand
+    until their total size does not exceed the limit.
+    """
+    help = "Deletes least recently used files of lazy variants"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-bytes',
+            type=int,
+            default=settings.CONF['cache_max_bytes'],
+            help="The maximum total size of files, "
+                 "the 'cache_max_bytes' setting by default"
+        )
+
+    def handle(self, *args, **options):
+        max_bytes = options['max_bytes']
+        if max_bytes is None:
+            raise CommandError(
+                "The limit is not specified, use the --max-bytes option"
+            )
+        files, size = models.CachedVariant.objects.evict(max_bytes)
+        self.stdout.write(
+            "Deleted {} files ({} bytes)".format(files, size)
+        )
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import itertools
+import multiprocessing
+
+from django import db
+from django.core.management.base import CommandError
+from django.contrib.contenttypes.models import ContentType
+
+from ..base import ChunkedCommand
+from ... import models
+from ... import fields
+from ... import utils
+from ... import settings
+from .gallery_regenerate import regenerate, Command as RegenerateCommand
+
+def scan(root):
+    """
+    Yields names of files in the directory and its subdirectories
+    relative to the directory using '/' as the separator. Each directory
+    is read by a single os.scandir call, which knows types of entries
+    without calling stat for each file.
+    """
+    if not hasattr(os, 'scandir'):
+        # Python 3.4 has no os.scandir
+        for path, dirs, files in os.walk(root):
+            directory = os.path.relpath(path, root).replace(os.sep, '/')
+            for name in files:
+                yield name if directory == '.' else directory + '/' + name
+        return
+    directories = ['']
+    while directories:
+        directory = directories.pop()
+        for entry in os.scandir(os.path.join(root, directory)):
+            name = directory + '/' + entry.name if directory else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(name)
+            else:
+                yield name
+
+
+class Command(ChunkedCommand):
+    """
+    Finds image files in the gallery folder that belong to no image
+    (orphaned files) and images whose files are missing. Names of files
+    are read into a set by a single pass over the folder, images are read
+    from the database by chunks and names of their files are removed from
+    the set, so the set contains orphaned files in the end. The memory
+    used by the command depends on the number of files only. Missing files
+    of lazy variants and variants not required by the related object are
+    not reported. Orphaned files could be deleted and missing files of
+    variants could be regenerated.
+    """
+    help = "Finds orphaned image files and images with missing files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete-orphans',
+            action='store_true',
+            help="Delete orphaned files"
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help="Orphaned files modified within this number of seconds "
+                 "are not deleted since they could belong to images being "
+            "uploaded (3600 by default)"
+        )
+        parser.add_argument(
+            '--regenerate',
+            action='store_true',
+            help="Create missing files of variants again"
+        )
+        self.add_chunk_size_argument(
+            parser,
+            "The number of images read from the database at once"
+        )
+        self.add_workers_argument(
+            parser,
+            os.cpu_count(),
+            "The number of worker processes regenerating files, "
+            "all cores by default"
+        )
+
+    @staticmethod
+    def _read_files():
+        """
+        Returns a set of names in the storage of all files
+        in the gallery folder
+        """
+        storage = models.Image._meta.get_field('image').storage
+        try:
+            root = storage.path(settings.CONF['path'])
+        except NotImplementedError:
+            raise CommandError("The storage does not support paths")
+        if not os.path.isdir(root):
+            return set()
+        return {utils.name_in_db(name) for name in scan(root)}
+
+    @staticmethod
+    def _check_image(row, files, claimed):
+        """
+        Removes names of files of the image from the set of files. Names
+        of files that could be shared with other images are added to the
+        'claimed' set. Returns a list of variants whose files are missing
+        ('image' if the full-size image is missing).
+        """
+        pk, name, fingerprints, content_type_id, content_hash = row
+        field = models.Image._meta.get_field('image')
+        field_file = fields.GalleryImageFieldFile.from_row(
+            field,
+            name,
+            fingerprints
+        )
+        # the ContentType manager caches content types
+        ctype = ContentType.objects.get_for_id(content_type_id)
+        required = models.get_variant_names(ctype)
+        image_files = [('image', field_file.image_data)]
+        image_files.extend(field_file.variants.items())
+        # the original file is optional
+        image_files.append((None, field_file.original))
+        missing = []
+        for variant, image_file in image_files:
+            storage_name = image_file.storage_name
+            if storage_name in files:
+                files.discard(storage_name)
+                # only images with known content could share files
+                if content_hash:
+                    claimed.add(storage_name)
+            elif storage_name in claimed or variant is None:
+                continue
+            elif variant == 'image' or (
+                variant in required and not image_file.lazy
+            ):
+                missing.append(variant)
+        return missing
+
+    def _regenerate(self, pool, tasks, actual, lazy):
+        """
+        Creates missing files of images of the chunk and stores
+        fingerprints of regenerated variants. Returns the number of
+        images whose files have been created and the number of failed
+        images. Images whose files could not be created (e.g. the
+        missing full-size image without the original) are not counted.
+        """
+        fingerprints = {task[0]: dict(task[3]) for task in tasks}
+        sizes = {}
+        obsolete = []
+        created = 0
+        failed = 0
+        for pk, error, regenerated, replaced, value in pool.imap_unordered(
+            regenerate,
+            tasks
+        ):
+            if error:
+                failed += 1
+                del fingerprints[pk]
+                self.stderr.write("Image #{}: {}".format(pk, error))
+                continue
+            if regenerated:
+                created += 1
+            obsolete.extend(replaced)
+            sizes[pk] = value
+            RegenerateCommand._set_fingerprints(
+                fingerprints[pk],
+                regenerated,
+                actual,
+                lazy
+            )
+        RegenerateCommand._update_fingerprints(fingerprints, obsolete, sizes)
+        return created, failed
+
+    def _delete_orphans(self, orphans, min_age, chunk_size):
+        """
+        Deletes orphaned files modified before 'min_age' seconds ago.
+        Returns the number of deleted files.
+        """
+        storage = models.Image._meta.get_field('image').storage
+        deadline = time.time() - min_age
+        deleted = 0
+        orphans = iter(orphans)
+        while True:
+            chunk = list(itertools.islice(orphans, chunk_size))
+            if not chunk:
+                break
+            names = []
+            for name in chunk:
+                try:
+                    if os.stat(storage.path(name)).st_mtime <= deadline:
+                        names.append(name)
+                except FileNotFoundError:
+                    # the file has been deleted since the scan
+                    pass
+            deleted += utils.storage_delete_many(storage, names)
+        return deleted
+
+    def handle(self, *args, **options):
+        if options['min_age'] < 0:
+            raise CommandError("The age should not be negative")
+        start = time.time()
+        pool = None
+        if options['regenerate']:
+            actual, lazy = RegenerateCommand._get_actual_fingerprints()
+            # forked processes must not share database connections,
+            # the pool is created before reading names of files
+            db.connections.close_all()
+            pool = multiprocessing.Pool(options['workers'])
+        try:
+            files = self._read_files()
+            total = len(files)
+            # files of images with the same content found already
+            claimed = set()
+            rows = models.Image.objects.order_by('pk').values_list(
+                'pk',
+                'image',
+                'fingerprints',
+                'content_type',
+                'content_hash'
+            ).iterator()
+            checked = 0
+            damaged = 0
+            regenerated = 0
+            failed = 0
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                tasks = []
+                for row in chunk:
+                    fingerprints = json.loads(row[2]) if row[2] else {}
+                    row = (row[0], row[1], fingerprints) + row[3:]
+                    missing = self._check_image(row, files, claimed)
+                    if not missing:
+                        continue
+                    damaged += 1
+                    self.stdout.write("Image #{}: missing {}".format(
+                        row[0],
+                        ', '.join(missing)
+                    ))
+                    tasks.append((row[0], row[1], missing, fingerprints))
+                checked += len(chunk)
+                if pool is not None and tasks:
+                    created, errors = self._regenerate(
+                        pool,
+                        tasks,
+                        actual,
+                        lazy
+                    )
+                    regenerated += created
+                    failed += errors
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        orphans = sorted(files)
+        for name in orphans:
+            self.stdout.write("Orphaned file '{}'".format(name))
+        deleted = 0
+        if options['delete_orphans']:
+            deleted = self._delete_orphans(
+                orphans,
+                options['min_age'],
+                options['chunk_size']
+            )
+        self.stdout.write(
+            "Checked {} images and {} files: {} orphaned files ({} deleted), "
+            "{} images with missing files ({} regenerated, {} failed) "
+            "in {:.1f}s".format(
+                checked,
+                total,
+                len(orphans),
+                deleted,
+                damaged,
+                regenerated,
+                failed,
+                time.time() - start
+            )
+        )
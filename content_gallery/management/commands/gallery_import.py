@@ -0,0 +1,366 @@
+import os
+import re
+import csv
+import time
+import shutil
+import zipfile
+import tempfile
+import itertools
+import multiprocessing
+from collections import OrderedDict
+
+from django import db
+from django.db import transaction
+from django.db.models import Max
+from django.core.files.base import File
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+
+from ..base import ChunkedCommand
+from ... import models
+from ... import utils
+from ... import settings
+
+# zip archives opened by the worker process, the list of members
+# of the archive is read once per process
+_archives = {}
+
+def open_member(source, member):
+    """
+    Returns a seekable file object containing the data of the file in
+    the directory or the member of the zip archive. The member is read
+    as a stream and copied by chunks to a spooled temporary file, so
+    large members are not kept in the memory.
+    """
+    if os.path.isdir(source):
+        return open(os.path.join(source, member), 'rb')
+    archive = _archives.get(source)
+    if archive is None:
+        archive = _archives[source] = zipfile.ZipFile(source)
+    spooled = tempfile.SpooledTemporaryFile(
+        settings.CONF['spool_max_memory_size']
+    )
+    with archive.open(member) as f:
+        shutil.copyfileobj(f, spooled)
+    spooled.seek(0)
+    return spooled
+
+def create_files(task):
+    """
+    Creates image files of the imported file. Called in worker processes,
+    so it does not touch the database. Returns the index of the file,
+    a dict of values of fields of the image or None and an error message
+    or None if files have been created successfully.
+    """
+    index, source, member, slug, variants = task
+    try:
+        with open_member(source, member) as f:
+            # the image is not related to any object,
+            # so it does not read the content type
+            image = models.Image()
+            image.image = File(f, os.path.basename(member))
+            field_file = image.image
+            image._create_files(
+                slug,
+                '',
+                variants,
+                field_file.get_content_hash()
+            )
+            # the full-size image is saved by the model field usually,
+            # the existing file of the interrupted import is replaced
+            image_data = field_file.image_data
+            utils.storage_save(
+                field_file.storage,
+                image_data.storage_name,
+                image_data.data
+            )
+    except ValidationError as e:
+        return index, None, ' '.join(e.messages)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        # a missing or broken image file
+        return index, None, str(e)
+    values = {
+        'image': image_data.name_in_db,
+        'fingerprints': image.fingerprints,
+        'content_hash': image.content_hash,
+        'file_sizes': image.file_sizes,
+        'total_bytes': image.total_bytes,
+    }
+    for i in range(utils.DHASH_CHUNKS):
+        name = 'dhash_{}'.format(i)
+        values[name] = getattr(image, name)
+    return index, values, None
+
+
+class Command(ChunkedCommand):
+    """
+    Imports image files from a directory or a zip archive. Each file is
+    related to an object using a CSV file or a pattern of file names.
+    Slugs and positions of images are allocated for each object once per
+    chunk of files, image files are created in a pool of worker processes
+    and images are inserted into the database by a single query per chunk.
+    The number of processed files is stored in the checkpoint file, so
+    interrupted import could be resumed.
+    """
+    help = "Imports images from a directory or a zip archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source',
+            help="A directory or a zip archive containing image files"
+        )
+        parser.add_argument(
+            '--csv',
+            help="A CSV file of rows containing the name of the file "
+                 "in the source, the 'app_label.model' label and the pk "
+            "of the related object"
+        )
+        parser.add_argument(
+            '--pattern',
+            help="A regular expression that finds the pk of the related "
+                 "object in names of files (the 'pk' group or the first "
+            "group), requires the '--model' option"
+        )
+        parser.add_argument(
+            '--model',
+            metavar='APP_LABEL.MODEL',
+            help="The model of related objects found by the pattern"
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help="A file that keeps the number of processed files to "
+                 "resume interrupted import"
+        )
+        self.add_chunk_size_argument(
+            parser,
+            "The number of files imported at once"
+        )
+        self.add_workers_argument(
+            parser,
+            os.cpu_count(),
+            "The number of worker processes, all cores by default"
+        )
+
+    @staticmethod
+    def _get_members(source):
+        """
+        Returns a sorted list of names of files in the directory
+        or members of the zip archive
+        """
+        if os.path.isdir(source):
+            members = []
+            for root, dirs, files in os.walk(source):
+                for name in files:
+                    path = os.path.relpath(os.path.join(root, name), source)
+                    members.append(path.replace(os.sep, '/'))
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as archive:
+                members = [
+                    name for name in archive.namelist()
+                    if not name.endswith('/')
+                ]
+        else:
+            raise CommandError(
+                "'{}' is not a directory or a zip archive".format(source)
+            )
+        return sorted(members)
+
+    def _read_mapping(self, options):
+        """
+        Returns a function that returns the (content_type, pk) tuple
+        of the related object for the name of the file or None if
+        the file is not related to any object
+        """
+        if bool(options['csv']) == bool(options['pattern']):
+            raise CommandError("Specify either '--csv' or '--pattern'")
+        if options['csv']:
+            mapping = {}
+            ctypes = {}
+            with open(options['csv'], newline='') as f:
+                for row in csv.reader(f):
+                    try:
+                        name, label, pk = row
+                        pk = int(pk)
+                    except ValueError:
+                        # a header or an empty row
+                        continue
+                    if label not in ctypes:
+                        ctypes[label] = utils.get_content_type(label)
+                    mapping[name] = (ctypes[label], pk)
+            return mapping.get
+        if not options['model']:
+            raise CommandError("The '--pattern' option requires '--model'")
+        ctype = utils.get_content_type(options['model'])
+        try:
+            pattern = re.compile(options['pattern'])
+        except re.error as e:
+            raise CommandError("Invalid pattern: {}".format(e))
+
+        def get_object(name):
+            match = pattern.search(name)
+            if match is None:
+                return None
+            groups = match.groupdict()
+            try:
+                value = groups['pk'] if 'pk' in groups else match.group(1)
+                return ctype, int(value)
+            except (IndexError, TypeError, ValueError):
+                # the pattern has no groups or the pk is not a number
+                return None
+        return get_object
+
+    @staticmethod
+    def _get_objects(groups):
+        """
+        Returns a dict of related objects by (content_type, pk) tuples
+        using a single query per model
+        """
+        pks = {}
+        for ctype, pk in groups:
+            pks.setdefault(ctype, []).append(pk)
+        objects = {}
+        for ctype, values in pks.items():
+            model = ctype.model_class()
+            for pk, obj in model._default_manager.in_bulk(values).items():
+                objects[(ctype, pk)] = obj
+        return objects
+
+    @staticmethod
+    def _get_positions(groups):
+        """
+        Returns a dict of positions of the next image of objects
+        by (content_type, pk) tuples using a single query per model
+        """
+        pks = {}
+        for ctype, pk in groups:
+            pks.setdefault(ctype, []).append(pk)
+        positions = {}
+        for ctype, values in pks.items():
+            rows = models.Image.objects.filter(
+                content_type=ctype,
+                object_id__in=values
+            ).values('object_id').annotate(last=Max('position'))
+            for row in rows:
+                positions[(ctype, row['object_id'])] = row['last'] + 1
+        return positions
+
+    def _create_tasks(self, source, chunk, get_object):
+        """
+        Returns tasks for worker processes and related objects of files
+        of the chunk. Slugs are allocated for each object at once.
+        """
+        groups = OrderedDict()
+        for index, member in chunk:
+            key = get_object(member)
+            if key is None:
+                self.stderr.write("No object for '{}'".format(member))
+                continue
+            groups.setdefault(key, []).append((index, member))
+        objects = self._get_objects(groups)
+        tasks = []
+        related = {}
+        # slugs allocated for images of the chunk
+        taken = set()
+        for key, members in groups.items():
+            obj = objects.get(key)
+            if obj is None:
+                for index, member in members:
+                    self.stderr.write(
+                        "'{}': the {} #{} does not exist".format(
+                            member,
+                            key[0].model,
+                            key[1]
+                        )
+                    )
+                continue
+            variants = models.get_variant_names(key[0])
+            slugs = models.create_unique_slugs(
+                str(obj),
+                len(members),
+                taken
+            )
+            taken.update(slugs)
+            for (index, member), slug in zip(members, slugs):
+                tasks.append((index, source, member, slug, variants))
+                related[index] = key
+        return tasks, related
+
+    @staticmethod
+    def _create_images(results, related):
+        """
+        Inserts images of successfully imported files into the database.
+        Images get positions after existing images of the object
+        in the order of files. Summaries of objects are refreshed once.
+        """
+        positions = Command._get_positions(set(related.values()))
+        images = []
+        for index in sorted(results):
+            ctype, pk = related[index]
+            position = positions.get((ctype, pk), 0)
+            positions[(ctype, pk)] = position + 1
+            images.append(models.Image(
+                content_type=ctype,
+                object_id=pk,
+                position=position,
+                **results[index]
+            ))
+        with transaction.atomic():
+            models.Image.objects.bulk_create(images)
+            models.GallerySummary.objects.refresh(
+                {(ctype.pk, pk) for ctype, pk in related.values()}
+            )
+
+    def handle(self, *args, **options):
+        get_object = self._read_mapping(options)
+        source = options['source']
+        members = self._get_members(source)
+        processed = 0
+        if options['checkpoint']:
+            # skip files processed before the interruption
+            processed = self.read_checkpoint(options['checkpoint']) or 0
+        rows = enumerate(members)
+        rows = itertools.islice(rows, processed, None)
+        imported = 0
+        skipped = 0
+        failed = 0
+        start = time.time()
+        # forked processes must not share database connections
+        db.connections.close_all()
+        with multiprocessing.Pool(options['workers']) as pool:
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                tasks, related = self._create_tasks(source, chunk, get_object)
+                skipped += len(chunk) - len(tasks)
+                # split the chunk between workers evenly
+                chunksize = max(1, len(tasks) // (options['workers'] * 4))
+                results = {}
+                for index, values, error in pool.imap_unordered(
+                    create_files,
+                    tasks,
+                    chunksize
+                ):
+                    if error:
+                        failed += 1
+                        self.stderr.write(
+                            "'{}': {}".format(members[index], error)
+                        )
+                        continue
+                    results[index] = values
+                self._create_images(results, related)
+                imported += len(results)
+                processed = chunk[-1][0] + 1
+                if options['checkpoint']:
+                    self.write_checkpoint(options['checkpoint'], processed)
+                self.stdout.write(
+                    "Processed {} of {} files".format(processed, len(members))
+                )
+        self.stdout.write(
+            "Imported {} images ({} skipped, {} failed) in {:.1f}s".format(
+                imported,
+                skipped,
+                failed,
+                time.time() - start
+            )
+        )
@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import itertools
+import multiprocessing
+from collections import defaultdict
+
+from django import db
+from django.db import transaction
+from django.contrib.contenttypes.models import ContentType
+
+from ..base import ChunkedCommand
+from ... import models
+from ... import fields
+from ... import utils
+from ... import settings
+
+def regenerate(task):
+    """
+    Creates image files of the image again. Called in worker processes,
+    so it does not touch the database and uses just the name of the
+    full-size image. Returns the pk of the image, an error message
+    or None if image files have been created successfully, a list
+    of regenerated variants, a list of names of replaced immutable
+    files that should be deleted after storing new fingerprints and
+    a dict of sizes of stored files of the image.
+    """
+    pk, name, variants, fingerprints = task
+    field = models.Image._meta.get_field('image')
+    # the field file does not require the model instance
+    # to manipulate with image files
+    field_file = fields.GalleryImageFieldFile.from_row(
+        field,
+        name,
+        fingerprints
+    )
+    obsolete = []
+    try:
+        regenerated = field_file.regenerate_files(variants, obsolete)
+    except (OSError, ValueError) as e:
+        # a missing or broken source image file
+        return pk, str(e), [], [], {}
+    # files of lazy variants are a cache and they are not counted
+    stored = [
+        variant for variant, image_file in field_file.variants.items()
+        if not image_file.lazy
+    ]
+    return pk, None, regenerated, obsolete, field_file.get_file_sizes(stored)
+
+
+class Command(ChunkedCommand):
+    """
+    Creates image files of variants again using original images if they
+    are stored or full-size images otherwise. The full-size image itself
+    ('image' variant) is created again only if the original image exists.
+    It's meant to be used after changing sizes in the settings.
+    Only variants created with outdated settings are regenerated
+    unless the '--force' option is specified. Variants not required
+    by related objects are skipped.
+    """
+    help = "Regenerates image files of variants using full-size images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variants',
+            nargs='+',
+            choices=self._get_variant_names(),
+            help="Variants to regenerate, all variants by default"
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help="Regenerate variants created with actual settings as well"
+        )
+        parser.add_argument(
+            '--content-type',
+            action='append',
+            dest='content_types',
+            metavar='APP_LABEL.MODEL',
+            help="Regenerate images related to objects of the model only"
+        )
+        parser.add_argument(
+            '--min-pk',
+            type=int,
+            help="The smallest pk of images to regenerate"
+        )
+        parser.add_argument(
+            '--max-pk',
+            type=int,
+            help="The largest pk of images to regenerate"
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help="A file that keeps the last processed pk to resume "
+                 "interrupted regeneration"
+        )
+        self.add_chunk_size_argument(
+            parser,
+            "The number of images read from the database at once"
+        )
+        self.add_workers_argument(
+            parser,
+            os.cpu_count(),
+            "The number of worker processes, all cores by default"
+        )
+
+    @staticmethod
+    def _get_variant_names():
+        """
+        Returns names of variants which could be regenerated,
+        including the full-size image in the 'keep_original' mode
+        """
+        names = [variant['name'] for variant in utils.get_variants()]
+        # immutable full-size images are never overwritten
+        if settings.CONF['keep_original'] and \
+                not settings.CONF['hashed_names']:
+            names.insert(0, 'image')
+        return names
+
+    def _get_queryset(self, options):
+        """
+        Returns a queryset of (pk, name, fingerprints, content_type_id)
+        tuples of images to regenerate
+        """
+        qs = models.Image.objects.all()
+        if options['content_types']:
+            ctypes = [
+                utils.get_content_type(label)
+                for label in options['content_types']
+            ]
+            qs = qs.filter(content_type__in=ctypes)
+        if options['min_pk'] is not None:
+            qs = qs.filter(pk__gte=options['min_pk'])
+        if options['max_pk'] is not None:
+            qs = qs.filter(pk__lte=options['max_pk'])
+        if options['checkpoint']:
+            last_pk = self.read_checkpoint(options['checkpoint'])
+            # skip images processed before the interruption
+            if last_pk is not None:
+                qs = qs.filter(pk__gt=last_pk)
+        # the order by pk makes it possible to resume the regeneration
+        return qs.order_by('pk').values_list(
+            'pk',
+            'image',
+            'fingerprints',
+            'content_type'
+        )
+
+    @staticmethod
+    def _get_required_variants(content_type_id):
+        """
+        Returns names of variants required by objects of the content type
+        """
+        # the ContentType manager caches content types
+        ctype = ContentType.objects.get_for_id(content_type_id)
+        return models.get_variant_names(ctype)
+
+    @staticmethod
+    def _create_task(row, variants, force):
+        """
+        Returns a task for the worker process and current fingerprints
+        of the image. The task is None if the image has no variants
+        to regenerate.
+        """
+        pk, name, fingerprints, required = row
+        fingerprints = json.loads(fingerprints) if fingerprints else {}
+        field = models.Image._meta.get_field('image')
+        field_file = fields.GalleryImageFieldFile.from_row(
+            field,
+            name,
+            fingerprints
+        )
+        # skip variants not required by the related object
+        variants = [v for v in variants if v == 'image' or v in required]
+        if not force:
+            # skip variants created with actual settings
+            stale = field_file.get_stale_variants(fingerprints)
+            variants = [v for v in variants if v in stale]
+        if not variants:
+            return None, fingerprints
+        return (pk, name, variants, dict(fingerprints)), fingerprints
+
+    @staticmethod
+    def _get_actual_fingerprints():
+        """
+        Returns fingerprints of actual settings and a set of
+        names of lazy variants, the same for all images
+        """
+        field = models.Image._meta.get_field('image')
+        field_file = fields.GalleryImageFieldFile(None, field, '')
+        lazy = {
+            name for name, variant in field_file.variants.items()
+            if variant.lazy
+        }
+        return field_file.get_fingerprints(), lazy
+
+    @staticmethod
+    def _set_fingerprints(fingerprints, regenerated, actual, lazy):
+        """
+        Sets actual fingerprints of regenerated variants
+        in the dict of fingerprints of the image
+        """
+        for variant in regenerated:
+            if variant in lazy:
+                # files of lazy variants are deleted
+                # and will be created on demand
+                fingerprints.pop(variant, None)
+            else:
+                fingerprints[variant] = actual[variant]
+
+    @staticmethod
+    def _update_fingerprints(fingerprints, obsolete, sizes):
+        """
+        Stores new fingerprints and sizes of files of regenerated images.
+        The 'fingerprints' and 'sizes' are dicts where keys are primary
+        keys of images. Images with the same fingerprints and sizes are
+        updated by a single query. Summaries of objects get new
+        fingerprints of their covers. Replaced immutable files
+        are deleted when fingerprints are stored.
+        """
+        groups = defaultdict(list)
+        for pk, value in fingerprints.items():
+            key = (
+                json.dumps(value, sort_keys=True),
+                json.dumps(sizes[pk], sort_keys=True),
+                sum(sizes[pk].values())
+            )
+            groups[key].append(pk)
+        with transaction.atomic():
+            for (value, file_sizes, total_bytes), pks in groups.items():
+                models.Image.objects.filter(pk__in=pks).update(
+                    fingerprints=value,
+                    file_sizes=file_sizes,
+                    total_bytes=total_bytes
+                )
+            models.GallerySummary.objects.refresh_covers(list(fingerprints))
+            storage = models.Image._meta.get_field('image').storage
+            utils.delete_on_commit(storage, obsolete)
+
+    def handle(self, *args, **options):
+        variants = options['variants'] or self._get_variant_names()
+        actual, lazy = self._get_actual_fingerprints()
+        rows = self._get_queryset(options).iterator()
+        processed = 0
+        skipped = 0
+        failed = 0
+        start = time.time()
+        # forked processes must not share database connections
+        db.connections.close_all()
+        with multiprocessing.Pool(options['workers']) as pool:
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                tasks = []
+                fingerprints = {}
+                sizes = {}
+                obsolete = []
+                for row in chunk:
+                    required = self._get_required_variants(row[3])
+                    task, value = self._create_task(
+                        row[:3] + (required,),
+                        variants,
+                        options['force']
+                    )
+                    if task:
+                        tasks.append(task)
+                        fingerprints[task[0]] = value
+                skipped += len(chunk) - len(tasks)
+                # split the chunk between workers evenly
+                chunksize = max(1, len(tasks) // (options['workers'] * 4))
+                results = pool.imap_unordered(regenerate, tasks, chunksize)
+                for pk, error, regenerated, replaced, value in results:
+                    if error:
+                        failed += 1
+                        # keep former fingerprints of failed images
+                        del fingerprints[pk]
+                        self.stderr.write("Image #{}: {}".format(pk, error))
+                        continue
+                    obsolete.extend(replaced)
+                    sizes[pk] = value
+                    # regenerated variants get actual fingerprints
+                    self._set_fingerprints(
+                        fingerprints[pk],
+                        regenerated,
+                        actual,
+                        lazy
+                    )
+                self._update_fingerprints(fingerprints, obsolete, sizes)
+                processed += len(chunk)
+                # the whole chunk has been processed, so the regeneration
+                # could be resumed from the last pk of the chunk
+                last_pk = chunk[-1][0]
+                if options['checkpoint']:
+                    self.write_checkpoint(options['checkpoint'], last_pk)
+                elapsed = time.time() - start
+                self.stdout.write(
+                    "Processed {} images, last pk {} ({:.1f} images/s)".format(
+                        processed,
+                        last_pk,
+                        processed / elapsed if elapsed else 0
+                    )
+                )
+        elapsed = time.time() - start
+        self.stdout.write(
+            "Regenerated {} images ({} up to date, {} failed) "
+            "in {:.1f}s".format(
+                processed - skipped - failed,
+                skipped,
+                failed,
+                elapsed
+            )
+        )
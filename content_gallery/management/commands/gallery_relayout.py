@@ -0,0 +1,140 @@
+import time
+import itertools
+from concurrent import futures
+
+from django.db import transaction
+
+from ..base import ChunkedCommand
+from ... import models
+from ... import fields
+from ... import utils
+from ... import settings
+
+class Command(ChunkedCommand):
+    """
+    Moves image files to subdirectories of the gallery folder according
+    to the 'layout' setting and updates names of images in the database.
+    It's meant to be used after changing the layout. Files are moved by
+    a pool of threads since moving is limited by the storage rather than
+    the CPU. Interrupted moving could be continued by running the command
+    again, images whose files are in place are skipped.
+    """
+    help = "Moves image files to subdirectories according to the layout"
+
+    def add_arguments(self, parser):
+        self.add_chunk_size_argument(
+            parser,
+            "The number of images read from the database at once"
+        )
+        self.add_workers_argument(
+            parser,
+            8,
+            "The number of threads moving files"
+        )
+
+    @staticmethod
+    def _get_shard(field_file):
+        """
+        Returns the subdirectory the files of the image should be moved to
+        """
+        if settings.CONF['layout'] == 'date':
+            # the date of the upload is not stored, so the modification
+            # time of the full-size image is used instead
+            modified = field_file.storage.get_modified_time(field_file.name)
+            return modified.strftime('%Y/%m/%d')
+        return utils.create_shard(field_file.name)
+
+    @staticmethod
+    def _move(row):
+        """
+        Moves files of the image. Returns the pk of the image, the new
+        name of the image (None if files are in place), a list of former
+        and new locations of files of lazy variants and an error message
+        or None if files have been moved successfully.
+        """
+        pk, name, fingerprints = row
+        field = models.Image._meta.get_field('image')
+        # names of files depend on settings used to create them
+        field_file = fields.GalleryImageFieldFile.from_row(
+            field,
+            name,
+            fingerprints
+        )
+        image_data = field_file.image_data
+        try:
+            shard = Command._get_shard(field_file)
+            if shard == image_data.shard:
+                return pk, None, [], None
+            new_name = utils.name_in_db(image_data.filename, shard)
+            # never overwrite files of another image
+            if image_data.exists() and field_file.storage.exists(new_name):
+                error = "The file '{}' already exists".format(new_name)
+                return pk, None, [], error
+            lazy = [v for v in field_file.variants.values() if v.lazy]
+            locations = [v.location for v in lazy]
+            field_file.move_files(shard)
+        except OSError as e:
+            return pk, None, [], str(e)
+        locations = list(zip(locations, [v.location for v in lazy]))
+        return pk, field_file.name, locations, None
+
+    @staticmethod
+    def _update_names(results):
+        """
+        Stores new names of images and tracked files of lazy variants.
+        Summaries of objects get new names of their covers.
+        """
+        with transaction.atomic():
+            for pk, name, locations in results:
+                models.Image.objects.filter(pk=pk).update(image=name)
+                for old, new in locations:
+                    models.CachedVariant.objects.filter(name=old).update(
+                        name=new
+                    )
+            models.GallerySummary.objects.refresh_covers(
+                [pk for pk, name, locations in results]
+            )
+
+    def handle(self, *args, **options):
+        rows = models.Image.objects.order_by('pk').values_list(
+            'pk',
+            'image',
+            'fingerprints'
+        ).iterator()
+        moved = 0
+        skipped = 0
+        failed = 0
+        start = time.time()
+        with futures.ThreadPoolExecutor(options['workers']) as executor:
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                results = []
+                for pk, name, locations, error in executor.map(
+                    self._move,
+                    chunk
+                ):
+                    if error:
+                        failed += 1
+                        self.stderr.write("Image #{}: {}".format(pk, error))
+                    elif name is None:
+                        skipped += 1
+                    else:
+                        results.append((pk, name, locations))
+                self._update_names(results)
+                moved += len(results)
+                self.stdout.write(
+                    "Processed {} images, last pk {}".format(
+                        moved + skipped + failed,
+                        chunk[-1][0]
+                    )
+                )
+        self.stdout.write(
+            "Moved {} images ({} in place, {} failed) in {:.1f}s".format(
+                moved,
+                skipped,
+                failed,
+                time.time() - start
+            )
+        )
@@ -0,0 +1,143 @@
+import time
+import itertools
+from collections import defaultdict
+from concurrent import futures
+
+from django.core.management.base import CommandError
+
+from ..base import ChunkedCommand
+from ... import models
+from ... import fields
+from ... import utils
+
+class Command(ChunkedCommand):
+    """
+    Finds pairs of similar images (re-saved, resized or slightly cropped
+    copies) comparing their perceptual hashes. Hashes are put into an
+    in-memory multi-index: each hash is split into chunks and images are
+    compared only with images having a close chunk, so the command does
+    not compare every pair of images. Images without hashes (uploaded
+    before the hashes were introduced) are skipped unless the '--update'
+    option is specified.
+    """
+    help = "Finds pairs of similar images using their perceptual hashes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-distance',
+            type=int,
+            default=4,
+            help="The largest number of different bits of hashes "
+                 "of similar images"
+        )
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help="Compute missing hashes using full-size images first"
+        )
+        self.add_chunk_size_argument(
+            parser,
+            "The number of images read from the database at once"
+        )
+        self.add_workers_argument(
+            parser,
+            8,
+            "The number of threads computing hashes"
+        )
+
+    @staticmethod
+    def _compute(row):
+        """
+        Computes the hash of the image. Returns the pk of the image,
+        the hash and an error message or None if it's computed successfully.
+        """
+        pk, name = row
+        field = models.Image._meta.get_field('image')
+        field_file = fields.GalleryImageFieldFile(None, field, name)
+        try:
+            return pk, field_file.get_dhash(), None
+        except (OSError, ValueError) as e:
+            # a missing or broken image file
+            return pk, None, str(e)
+
+    def _update_hashes(self, options):
+        """
+        Computes and stores missing hashes of images
+        """
+        rows = models.Image.objects.filter(dhash_0=None).order_by(
+            'pk'
+        ).values_list('pk', 'image').iterator()
+        with futures.ThreadPoolExecutor(options['workers']) as executor:
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                for pk, value, error in executor.map(self._compute, chunk):
+                    if error:
+                        self.stderr.write("Image #{}: {}".format(pk, error))
+                        continue
+                    chunks = utils.split_dhash(value)
+                    models.Image.objects.filter(pk=pk).update(
+                        **dict(zip(self._get_fields(), chunks))
+                    )
+
+    @staticmethod
+    def _get_fields():
+        """
+        Returns names of fields containing chunks of hashes
+        """
+        return ['dhash_{}'.format(i) for i in range(utils.DHASH_CHUNKS)]
+
+    def _find_pairs(self, max_distance):
+        """
+        Yields (pk, pk, distance) tuples of similar images. Each image
+        is compared with previous ones having a chunk of the hash that
+        differs in max_distance // DHASH_CHUNKS bits at most, then
+        the image is added to the index.
+        """
+        radius = max_distance // utils.DHASH_CHUNKS
+        # pks of images by values of chunks for each position
+        index = [defaultdict(list) for i in range(utils.DHASH_CHUNKS)]
+        hashes = {}
+        rows = models.Image.objects.exclude(dhash_0=None).order_by(
+            'pk'
+        ).values_list('pk', *self._get_fields()).iterator()
+        for row in rows:
+            pk, chunks = row[0], row[1:]
+            value = utils.join_dhash(chunks)
+            candidates = set()
+            for i, chunk in enumerate(chunks):
+                for neighbour in utils.get_chunk_neighbours(chunk, radius):
+                    candidates.update(index[i].get(neighbour, ()))
+            for candidate in sorted(candidates):
+                distance = utils.hamming_distance(value, hashes[candidate])
+                if distance <= max_distance:
+                    yield candidate, pk, distance
+            for i, chunk in enumerate(chunks):
+                index[i][chunk].append(pk)
+            hashes[pk] = value
+
+    def handle(self, *args, **options):
+        if options['max_distance'] < 0:
+            raise CommandError("The distance should not be negative")
+        start = time.time()
+        if options['update']:
+            self._update_hashes(options)
+        found = 0
+        for first, second, distance in self._find_pairs(
+            options['max_distance']
+        ):
+            found += 1
+            self.stdout.write(
+                "Images #{} and #{} are similar (distance {})".format(
+                    first,
+                    second,
+                    distance
+                )
+            )
+        self.stdout.write(
+            "Found {} pairs of similar images in {:.1f}s".format(
+                found,
+                time.time() - start
+            )
+        )
@@ -0,0 +1,73 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import CommandError
+
+from ..base import ChunkedCommand
+from ... import models
+
+class Command(ChunkedCommand):
+    """
+    Rebuilds denormalized summaries of images (the cover and the number
+    of images) of all objects of models with the 'gallery_summary' flag.
+    Summaries are kept correct while images are saved and deleted, so
+    the command is required once when the flag has been set for a model
+    whose objects have images already.
+    """
+    help = "Rebuilds summaries of images of objects"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            action='append',
+            dest='models',
+            metavar='APP_LABEL.MODEL',
+            help="Rebuild summaries of objects of the model only"
+        )
+        self.add_chunk_size_argument(
+            parser,
+            "The number of objects whose summaries are rebuilt at once"
+        )
+
+    @staticmethod
+    def _get_models(labels):
+        """
+        Returns a list of models with the 'gallery_summary' flag. Models are
+        specified by their 'app_label.model' labels or all models are used.
+        """
+        if not labels:
+            return [
+                model for model in apps.get_models()
+                if issubclass(model, models.ContentGalleryMixin)
+                and model.gallery_summary
+            ]
+        result = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (ValueError, LookupError):
+                raise CommandError("Unknown model '{}'".format(label))
+            if not getattr(model, 'gallery_summary', False):
+                raise CommandError(
+                    "The model '{}' does not keep summaries".format(label)
+                )
+            result.append(model)
+        return result
+
+    def handle(self, *args, **options):
+        start = time.time()
+        total = 0
+        for model in self._get_models(options['models']):
+            count = models.GallerySummary.objects.rebuild(
+                model,
+                options['chunk_size']
+            )
+            self.stdout.write("{}: {} objects".format(
+                model._meta.label_lower,
+                count
+            ))
+            total += count
+        self.stdout.write("Rebuilt summaries of {} objects in {:.1f}s".format(
+            total,
+            time.time() - start
+        ))
@@ -0,0 +1,211 @@
+import json
+import time
+import itertools
+from concurrent import futures
+
+from django.db import transaction
+from django.db.models import Sum, Count
+from django.db.models.functions import Coalesce
+from django.core.management.base import CommandError
+from django.contrib.contenttypes.models import ContentType
+
+from ..base import ChunkedCommand
+from ... import models
+from ... import fields
+from ... import utils
+
+class Command(ChunkedCommand):
+    """
+    Reports the disk usage of images ranking content types and objects
+    by the total size of files of their images. Sizes are summed up by
+    the database using sizes stored while saving images, so files are not
+    read. Images whose sizes are unknown (uploaded before sizes were
+    introduced) are not counted unless the '--update' option is
+    specified, which reads sizes of their files first.
+    Files of lazy variants are a cache and they are not counted.
+    Sizes of content types and objects are logical sizes: files shared
+    by images with the same content are counted for each image. The
+    total size of stored files counts shared files once, but hard linked
+    files of identical variants are still counted for each name, so it
+    could exceed the disk usage of the local storage.
+    """
+    help = "Ranks content types and objects by the size of their images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help="The number of objects with the largest images to list"
+        )
+        parser.add_argument(
+            '--content-type',
+            action='append',
+            dest='content_types',
+            metavar='APP_LABEL.MODEL',
+            help="Count images related to objects of the model only"
+        )
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help="Read unknown sizes of files from the storage first"
+        )
+        self.add_chunk_size_argument(
+            parser,
+            "The number of images read from the database at once"
+        )
+        self.add_workers_argument(
+            parser,
+            8,
+            "The number of threads reading sizes of files"
+        )
+
+    @staticmethod
+    def _compute(row):
+        """
+        Returns the pk of the image and a dict of sizes of its files.
+        Files that do not exist are skipped.
+        """
+        pk, name, fingerprints = row
+        field = models.Image._meta.get_field('image')
+        field_file = fields.GalleryImageFieldFile.from_row(
+            field,
+            name,
+            fingerprints
+        )
+        variants = [
+            variant for variant, image_file in field_file.variants.items()
+            if not image_file.lazy
+        ]
+        return pk, field_file.get_file_sizes(variants)
+
+    def _update_sizes(self, queryset, options):
+        """
+        Reads and stores sizes of files of images whose sizes are unknown
+        """
+        rows = queryset.filter(total_bytes=None).order_by('pk').values_list(
+            'pk',
+            'image',
+            'fingerprints'
+        ).iterator()
+        updated = 0
+        with futures.ThreadPoolExecutor(options['workers']) as executor:
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                with transaction.atomic():
+                    for pk, sizes in executor.map(self._compute, chunk):
+                        models.Image.objects.filter(pk=pk).update(
+                            file_sizes=json.dumps(sizes, sort_keys=True),
+                            total_bytes=sum(sizes.values())
+                        )
+                updated += len(chunk)
+        return updated
+
+    @staticmethod
+    def _get_stored_bytes(queryset):
+        """
+        Returns the total size of files of images with known sizes
+        counting files shared by images with the same content once.
+        Shared files have the same names, rows are ordered by names,
+        so images sharing files are grouped without keeping all names.
+        """
+        rows = queryset.exclude(total_bytes=None).order_by(
+            'image'
+        ).values_list('image', 'file_sizes').iterator()
+        total = 0
+        for name, group in itertools.groupby(rows, lambda row: row[0]):
+            # images sharing files could require different variants,
+            # so sizes of files of all these images are merged
+            sizes = {}
+            for _, file_sizes in group:
+                sizes.update(json.loads(file_sizes) if file_sizes else {})
+            total += sum(sizes.values())
+        return total
+
+    @staticmethod
+    def _get_objects(rows):
+        """
+        Returns a dict of objects by (content_type_id, pk) tuples
+        using a single query per model
+        """
+        pks = {}
+        for row in rows:
+            pks.setdefault(row['content_type'], []).append(row['object_id'])
+        objects = {}
+        for ctype_id, values in pks.items():
+            model = ContentType.objects.get_for_id(ctype_id).model_class()
+            if model is None:
+                # the model has been removed
+                continue
+            for pk, obj in model._default_manager.in_bulk(values).items():
+                objects[(ctype_id, pk)] = obj
+        return objects
+
+    @staticmethod
+    def _get_label(ctype_id):
+        """
+        Returns the 'app_label.model' label of the content type
+        """
+        # the ContentType manager caches content types
+        ctype = ContentType.objects.get_for_id(ctype_id)
+        return '{}.{}'.format(ctype.app_label, ctype.model)
+
+    def handle(self, *args, **options):
+        if options['top'] < 0:
+            raise CommandError("The number of objects should not be negative")
+        start = time.time()
+        queryset = models.Image.objects.all()
+        if options['content_types']:
+            ctypes = [
+                utils.get_content_type(label)
+                for label in options['content_types']
+            ]
+            queryset = queryset.filter(content_type__in=ctypes)
+        if options['update']:
+            updated = self._update_sizes(queryset, options)
+            self.stdout.write("Updated sizes of {} images".format(updated))
+        usage = {
+            'size': Coalesce(Sum('total_bytes'), 0),
+            'images': Count('pk'),
+        }
+        self.stdout.write("Content types:")
+        rows = queryset.values('content_type').annotate(**usage).order_by(
+            '-size',
+            'content_type'
+        )
+        for row in rows:
+            self.stdout.write("{}: {} bytes in {} images".format(
+                self._get_label(row['content_type']),
+                row['size'],
+                row['images']
+            ))
+        if options['top']:
+            self.stdout.write("Objects:")
+            rows = queryset.values('content_type', 'object_id').annotate(
+                **usage
+            ).order_by('-size', 'content_type', 'object_id')[:options['top']]
+            rows = list(rows)
+            objects = self._get_objects(rows)
+            for row in rows:
+                obj = objects.get((row['content_type'], row['object_id']))
+                self.stdout.write("{} #{} ({}): {} bytes in {} images".format(
+                    self._get_label(row['content_type']),
+                    row['object_id'],
+                    'deleted' if obj is None else obj,
+                    row['size'],
+                    row['images']
+                ))
+        total = queryset.aggregate(**usage)
+        unknown = queryset.filter(total_bytes=None).count()
+        self.stdout.write(
+            "Total {} bytes in {} images ({} with unknown sizes), "
+            "{} bytes counting shared files once in {:.1f}s".format(
+                total['size'],
+                total['images'],
+                unknown,
+                self._get_stored_bytes(queryset),
+                time.time() - start
+            )
+        )
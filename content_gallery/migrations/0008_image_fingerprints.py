@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 10:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content_gallery', '0007_auto_20170616_1845'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='fingerprints',
+            field=models.TextField(default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content_gallery', '0011_image_dhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='file_sizes',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='total_bytes',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+    ]
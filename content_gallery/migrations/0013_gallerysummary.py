@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-19 11:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('content_gallery', '0012_image_file_sizes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GallerySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('image_count', models.PositiveIntegerField(default=0)),
+                ('cover_pk', models.PositiveIntegerField(db_index=True, null=True)),
+                ('cover_name', models.CharField(default='', max_length=100)),
+                ('cover_fingerprints', models.TextField(default='')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='gallerysummary',
+            unique_together=set([('content_type', 'object_id')]),
+        ),
+    ]
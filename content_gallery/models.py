@@ -1,9 +1,19 @@
-from django.db import models
+import json
+import itertools
+from concurrent import futures
+from collections import defaultdict
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import Sum, Max, F
+from django.db.models.functions import Coalesce
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.utils import timezone
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericRelation
 
-from slugify import UniqueSlugify
+from slugify import Slugify, UniqueSlugify
 
 from . import utils
 from . import settings
@@ -13,9 +23,34 @@ def _unique_slug_check(slug, uids):
     """
     Checks whether there is an image with given slug
     """
-    slug = utils.name_in_db(slug)
+    slug = utils.name_in_db(slug, utils.create_shard(slug))
     return not Image.objects.filter(image__startswith=slug)
 
+def get_variant_names(content_type):
+    """
+    Returns names of variants required by objects of the model
+    specified by the content type. All variants are required
+    unless the model has the 'gallery_variants' attribute.
+    """
+    names = [variant['name'] for variant in utils.get_variants()]
+    try:
+        required = content_type.model_class().gallery_variants
+    except AttributeError:
+        # the model is unknown or does not use the ContentGalleryMixin
+        required = None
+    if required is None:
+        return names
+    return [name for name in names if name in required]
+
+def has_gallery_summary(content_type):
+    """
+    Checks whether objects of the model specified by the content type
+    keep denormalized summaries of their images. Summaries are kept
+    only if the model has the 'gallery_summary' attribute set to True.
+    """
+    # the model could be unknown
+    return getattr(content_type.model_class(), 'gallery_summary', False)
+
 # the object used to create unique slugs for names of images
 # slugs contain the slugified str versions of the object and an unique number
 # except first image:
@@ -25,6 +60,41 @@ def _unique_slug_check(slug, uids):
 #     etc...
 slugify_unique = UniqueSlugify(unique_check=_unique_slug_check, to_lower=True)
 
+# the object used to create slugs without checking their uniqueness
+slugify = Slugify(to_lower=True)
+
+def create_unique_slugs(title, count, taken=()):
+    """
+    Returns a list of 'count' unique slugs for names of images related
+    to the object with given title. Slugs are numbered like slugs created
+    by the slugify_unique, but candidates are checked by a single query
+    and slugs in the list differ from each other. Slugs in the 'taken'
+    collection (allocated for images not saved yet) are skipped as well.
+    """
+    base = slugify(title)
+    slugs = []
+    number = 0
+    while len(slugs) < count:
+        candidates = [
+            '{}-{}'.format(base, n) if n else base
+            for n in range(number, number + count - len(slugs))
+        ]
+        number += len(candidates)
+        prefixes = [
+            utils.name_in_db(slug, utils.create_shard(slug))
+            for slug in candidates
+        ]
+        query = models.Q()
+        for prefix in prefixes:
+            query |= models.Q(image__startswith=prefix)
+        names = Image.objects.filter(query).values_list('image', flat=True)
+        for slug, prefix in zip(candidates, prefixes):
+            if slug in taken:
+                continue
+            if not any(name.startswith(prefix) for name in names):
+                slugs.append(slug)
+    return slugs
+
 
 class ImageQuerySet(models.QuerySet):
     """
@@ -33,11 +103,95 @@ class ImageQuerySet(models.QuerySet):
 
     def delete(self):
         """
-        Perfoms deletion of all related files
+        Perfoms deletion of all related files. Files shared by deleted
+        images only are deleted as well. Returns the number of deleted
+        images and a dict of numbers of deleted objects by the model label.
         """
-        for obj in self:
-            obj.delete_files()
-        return super().delete()
+        deleted, removed = self.delete_chunked()
+        return deleted, {self.model._meta.label: deleted}
+
+    @staticmethod
+    def _get_file_names(rows, shared):
+        """
+        Returns names of files of images in the storage. Each row is
+        a (pk, name, content_hash, fingerprints) tuple, files used by
+        images in the 'shared' set of (content_hash, name) tuples are
+        skipped. Names are built without creating Image instances.
+        """
+        field = Image._meta.get_field('image')
+        names = []
+        seen = set()
+        for pk, name, content_hash, fingerprints in rows:
+            # images with the same content could share files
+            if not name or name in seen or (content_hash, name) in shared:
+                continue
+            seen.add(name)
+            field_file = fields.GalleryImageFieldFile.from_row(
+                field,
+                name,
+                fingerprints
+            )
+            names.extend(field_file.get_storage_names())
+        return names
+
+    def _get_shared(self, rows):
+        """
+        Returns a set of (content_hash, name) tuples of files of images
+        in rows that are used by images not deleted with them as well
+        """
+        hashes = {row[2] for row in rows if row[2]}
+        if not hashes:
+            # only images with known content could share files
+            return set()
+        return set(Image.objects.using(self.db).filter(
+            content_hash__in=hashes,
+            image__in={row[1] for row in rows if row[2]}
+        ).exclude(
+            pk__in=[row[0] for row in rows]
+        ).values_list('content_hash', 'image'))
+
+    def delete_chunked(self, chunk_size=500):
+        """
+        Deletes images and their files by chunks without loading Image
+        instances. (pk, name, content_hash, fingerprints) tuples are read
+        by a single query and rows of each chunk are deleted by a single
+        query as well. Files of the chunk are removed by a pool of threads
+        once its rows have been deleted. Files shared with images that are
+        not deleted are kept. Returns the number of deleted images and
+        the number of removed files.
+        """
+        assert self.query.can_filter(), \
+            "Cannot use 'limit' or 'offset' with delete."
+        storage = Image._meta.get_field('image').storage
+        # summaries of related objects are refreshed once in the end
+        related = set(self.order_by().values_list(
+            'content_type',
+            'object_id'
+        ).distinct())
+        rows = self.order_by('pk').values_list(
+            'pk',
+            'image',
+            'content_hash',
+            'fingerprints'
+        ).iterator()
+        deleted = 0
+        removed = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic(using=self.db):
+                names = self._get_file_names(chunk, self._get_shared(chunk))
+                # the plain QuerySet deletes rows by a single query
+                count, _ = models.QuerySet(Image, using=self.db).filter(
+                    pk__in=[row[0] for row in chunk]
+                ).delete()
+            deleted += count
+            # files are removed like files of a single image are
+            # removed by Image.delete, even inside a transaction
+            removed += utils.storage_delete_many(storage, names)
+        GallerySummary.objects.db_manager(self.db).refresh(related)
+        return deleted, removed
 
 
 class ImageManager(models.Manager):
@@ -50,6 +204,95 @@ class ImageManager(models.Manager):
         Returns custom QuerySet used for Image model
         """
         return ImageQuerySet(self.model, using=self._db)
+
+    def find_similar(self, dhash, max_distance=4):
+        """
+        Returns a list of (image, distance) tuples of images whose
+        perceptual hashes differ from given one in 'max_distance' bits
+        at most ordered by the distance. Since hashes within the distance
+        have a chunk that differs in max_distance // DHASH_CHUNKS bits at
+        most, candidates are found by indexed chunks (multi-index hashing)
+        and exact distances are calculated for them only.
+        """
+        radius = max_distance // utils.DHASH_CHUNKS
+        query = models.Q()
+        for i, chunk in enumerate(utils.split_dhash(dhash)):
+            neighbours = utils.get_chunk_neighbours(chunk, radius)
+            query |= models.Q(**{'dhash_{}__in'.format(i): neighbours})
+        similar = []
+        for image in self.get_queryset().filter(query):
+            distance = utils.hamming_distance(dhash, image.get_dhash())
+            if distance <= max_distance:
+                similar.append((image, distance))
+        similar.sort(key=lambda item: (item[1], item[0].pk))
+        return similar
+
+    @staticmethod
+    def _create_files(task):
+        """
+        Creates files of the image. Called in worker threads, so it does
+        not touch the database. Returns an error message or None if files
+        have been created successfully.
+        """
+        image, data = task
+        try:
+            if data is not None:
+                image._create_files(*data)
+        except ValidationError as e:
+            return ' '.join(e.messages)
+        except (OSError, ValueError) as e:
+            # a broken image file
+            return str(e)
+        return None
+
+    def create_bulk(self, content_object, uploads):
+        """
+        Creates images of uploaded files related to the object. Positions
+        and slugs of all images are allocated at once, then files of images
+        are created by a pool of 'bulk_upload_workers' threads while the
+        database is used by the calling thread only. The summary of the
+        object is refreshed once when all images are saved. Returns a list of
+        (image, error) tuples in the order of uploads, the image is None
+        if its files have not been created.
+        """
+        content_type = ContentType.objects.get_for_model(content_object)
+        last = self.filter(
+            content_type=content_type,
+            object_id=content_object.pk
+        ).aggregate(Max('position'))['position__max']
+        slugs = create_unique_slugs(str(content_object), len(uploads))
+        images = []
+        for upload, slug in zip(uploads, slugs):
+            image = self.model(
+                image=upload,
+                content_type=content_type,
+                object_id=content_object.pk
+            )
+            image.allocated_slug = slug
+            image.defer_summary = True
+            images.append(image)
+        # sharing files of duplicates requires queries,
+        # so data of images is prepared in this thread
+        tasks = [(image, image._prepare_data()) for image in images]
+        workers = settings.CONF['bulk_upload_workers']
+        with futures.ThreadPoolExecutor(workers) as executor:
+            errors = list(executor.map(self._create_files, tasks))
+        position = 0 if last is None else last + 1
+        results = []
+        with transaction.atomic():
+            for image, error in zip(images, errors):
+                if error:
+                    results.append((None, error))
+                    continue
+                # failed images do not leave gaps between positions
+                image.position = position
+                position += 1
+                image.save()
+                results.append((image, None))
+            GallerySummary.objects.refresh(
+                [(content_type.pk, content_object.pk)]
+            )
+        return results
    
 
 class Image(models.Model):
@@ -63,6 +306,43 @@ class Image(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
+    # fingerprints of settings used to create image files in JSON format
+    fingerprints = models.TextField(default='', editable=False)
+    # chunks of the perceptual hash of the full-size image used to find
+    # similar images, the hash is split to search them by indexes
+    dhash_0 = models.PositiveIntegerField(
+        null=True,
+        db_index=True,
+        editable=False
+    )
+    dhash_1 = models.PositiveIntegerField(
+        null=True,
+        db_index=True,
+        editable=False
+    )
+    dhash_2 = models.PositiveIntegerField(
+        null=True,
+        db_index=True,
+        editable=False
+    )
+    dhash_3 = models.PositiveIntegerField(
+        null=True,
+        db_index=True,
+        editable=False
+    )
+    # the hash of the uploaded content, images with the same hash
+    # and the same name share image files (the 'deduplicate' mode)
+    content_hash = models.CharField(
+        max_length=64,
+        default='',
+        db_index=True,
+        editable=False
+    )
+    # sizes in bytes of stored files of the image in JSON format
+    # and their total size, None if sizes are unknown (the image
+    # has been uploaded before sizes were introduced)
+    file_sizes = models.TextField(default='', editable=False)
+    total_bytes = models.BigIntegerField(null=True, editable=False)
 
     #use custom manager
     objects = ImageManager()
@@ -79,6 +359,13 @@ class Image(models.Model):
         # store the name of the image to be able to keep correct filenames
         # when new images have been uploaded replacing old files
         self.image_name = self.image.name
+        # the slug allocated in advance by the bulk upload
+        self.allocated_slug = None
+        # files have been created by the bulk upload before saving
+        self.files_created = False
+        # the summary of the related object is refreshed by the bulk
+        # operation once instead of refreshing it for each image
+        self.defer_summary = False
 
     def __str__(self):
         return '{} photo #{}'.format(self.content_object, self.position + 1)
@@ -107,6 +394,16 @@ class Image(models.Model):
         return self.content_type != self.init_type \
             or self.object_id != self.init_id
 
+    def _get_related_objects(self):
+        """
+        Returns a list of (content_type_id, object_id) tuples of the related
+        object and the object the image has been related to before
+        """
+        related = [(self.content_type_id, self.object_id)]
+        if self.init_type is not None and self._object_changed():
+            related.append((self.init_type.pk, self.init_id))
+        return related
+
     def _get_slug(self):
         """
         Creates an unique slug using str version of the related object.
@@ -115,31 +412,290 @@ class Image(models.Model):
         title = str(self.content_object)
         return slugify_unique(title)
 
-    def _save_data(self):
+    def _is_shared(self, name, exclude=()):
+        """
+        Checks whether image files with given name are used by other
+        images as well. Images in the 'exclude' list of pks are ignored.
+        """
+        # only images with known content could share files
+        if not self.content_hash or not name:
+            return False
+        return Image.objects.filter(
+            content_hash=self.content_hash,
+            image=name
+        ).exclude(pk=self.pk).exclude(pk__in=exclude).exists()
+
+    def _find_duplicate(self, content_hash):
+        """
+        Returns an image with the same content whose files
+        could be shared or None if there is no such image
+        """
+        duplicate = Image.objects.filter(
+            content_hash=content_hash
+        ).exclude(pk=self.pk).order_by('pk').first()
+        # files could be lost or not created yet
+        if duplicate is None or not duplicate.image.image_data.exists():
+            return None
+        return duplicate
+
+    def _share_files(self, duplicate, variants):
+        """
+        Uses image files of the duplicate instead of creating them again.
+        Files of variants required by the related object but absent in
+        the duplicate are created from its files. Files of the former
+        image are deleted unless they are used by other images.
+        """
+        name = self.image_name
+        if name and name != duplicate.image.name and \
+                not self._is_shared(name):
+            former = fields.GalleryImageFieldFile(self, self.image.field, name)
+            utils.delete_on_commit(former.storage, former.get_storage_names())
+        # fingerprints are set first since immutable file names
+        # of variants contain them
+        fingerprints = duplicate.get_fingerprints()
+        self.set_fingerprints(fingerprints)
+        self.content_hash = duplicate.content_hash
+        self.set_dhash(duplicate.get_dhash())
+        self.image = duplicate.image.name
+        missing = [
+            variant for variant in variants
+            if variant not in fingerprints
+            and not self.image.variants[variant].lazy
+        ]
+        for variant in missing:
+            self.image.create_variant_file(variant)
+        actual = self.image.get_fingerprints(missing)
+        for variant in missing:
+            fingerprints[variant] = actual[variant]
+        self.set_fingerprints(fingerprints)
+        self.set_file_sizes(self.image.get_file_sizes(
+            self._get_stored_variants()
+        ))
+        self.files_created = True
+
+    def _prepare_data(self):
         """
-        Saves image data to files
+        Determines the slug and the name of image files to create. In the
+        'deduplicate' mode files of an image with the same content are
+        shared instead. Returns arguments of the _create_files method
+        or None if files of another image are shared.
         """
-        if not self.pk or self._object_changed():
+        if self.allocated_slug is not None:
+            # the position is allocated by the bulk upload as well
+            slug = self.allocated_slug
+        elif not self.pk or self._object_changed():
             # create new position and new slug for new image
             # or if related object has been changed
             self._get_position()
             slug = self._get_slug()
         else:
             slug = ''
-        self.image.save_files(slug, self.image_name)
+        name = self.image_name
+        variants = self.get_variant_names()
+        # the hash is stored for all uploads, so images uploaded before
+        # enabling the 'deduplicate' mode could be shared as well
+        content_hash = self.image.get_content_hash()
+        if content_hash and settings.CONF['deduplicate']:
+            duplicate = self._find_duplicate(content_hash)
+            if duplicate is not None:
+                # the upload spooled to hash it is not saved
+                self.image.release_upload()
+                self._share_files(duplicate, variants)
+                return None
+        if self._is_shared(name):
+            # shared files are never renamed or overwritten,
+            # a new upload is stored as a new image
+            if content_hash:
+                slug = slug or self._get_slug()
+                name = ''
+            else:
+                slug = ''
+        return slug, name, variants, content_hash
+
+    def _create_files(self, slug, name, variants, content_hash):
+        """
+        Saves image data to files and stores the hashes and fingerprints
+        of created files. Does not touch the database.
+        """
+        self.image.save_files(slug, name, variants)
+        if content_hash:
+            self.content_hash = content_hash
+        # new image files have been created using actual settings
+        if self.image.image_data.data:
+            # lazy variants have not been created yet
+            created = [
+                name for name in variants
+                if not self.image.variants[name].lazy
+            ]
+            self.set_fingerprints(self.image.get_fingerprints(created))
+            self.set_dhash(self.image.get_dhash())
+            self.set_file_sizes(self.image.get_file_sizes(created))
+        self.files_created = True
+
+    def _save_data(self):
+        """
+        Saves image data to files or shares files of the duplicate
+        """
+        try:
+            data = self._prepare_data()
+            if data is not None:
+                self._create_files(*data)
+        finally:
+            # the upload could be spooled even if files are not created
+            self.image.release_upload()
 
     def save(self, *args, **kwargs):
         """
         Saves the image object
         """
-        # save image data first
-        self._save_data()
+        # save image data first unless files have been
+        # created by the bulk upload
+        if not self.files_created:
+            self._save_data()
+        self.files_created = False
+        self.allocated_slug = None
         super().save(*args, **kwargs)
+        # the image could become the cover or move to another object
+        if not self.defer_summary:
+            GallerySummary.objects.refresh(self._get_related_objects())
+        self.defer_summary = False
+
+    def get_fingerprints(self):
+        """
+        Returns a dict of fingerprints of settings used to create
+        image files. The dict is empty if they are unknown.
+        """
+        if not self.fingerprints:
+            return {}
+        return json.loads(self.fingerprints)
+
+    def set_fingerprints(self, fingerprints):
+        """
+        Stores the dict of fingerprints of settings used
+        to create image files
+        """
+        self.fingerprints = json.dumps(fingerprints, sort_keys=True)
+
+    def _get_stored_variants(self):
+        """
+        Returns names of variants whose files are stored permanently,
+        files of lazy variants are a cache and they are not counted
+        """
+        return [
+            name for name in self.get_fingerprints()
+            if name in self.image.variants
+            and not self.image.variants[name].lazy
+        ]
+
+    def get_file_sizes(self):
+        """
+        Returns a dict of sizes in bytes of stored image files.
+        The dict is empty if they are unknown.
+        """
+        if not self.file_sizes:
+            return {}
+        return json.loads(self.file_sizes)
+
+    def set_file_sizes(self, sizes):
+        """
+        Stores the dict of sizes in bytes of image files
+        and their total size
+        """
+        self.file_sizes = json.dumps(sizes, sort_keys=True)
+        self.total_bytes = sum(sizes.values())
+
+    def update_fingerprints(self, variants):
+        """
+        Stores actual fingerprints of given variants in the database
+        without saving the whole object. Used when files of variants
+        have been created after saving the image.
+        """
+        actual = self.image.get_fingerprints(variants)
+        with transaction.atomic():
+            # lock the row to keep fingerprints updated concurrently
+            value = Image.objects.select_for_update().filter(
+                pk=self.pk
+            ).values_list('fingerprints', flat=True).first()
+            self.fingerprints = value or ''
+            fingerprints = self.get_fingerprints()
+            for variant in variants:
+                fingerprints[variant] = actual[variant]
+            self.set_fingerprints(fingerprints)
+            Image.objects.filter(pk=self.pk).update(
+                fingerprints=self.fingerprints
+            )
+            GallerySummary.objects.refresh_covers([self.pk])
+
+    def get_dhash(self):
+        """
+        Returns the perceptual hash of the image or None if it's unknown
+        """
+        chunks = [
+            getattr(self, 'dhash_{}'.format(i))
+            for i in range(utils.DHASH_CHUNKS)
+        ]
+        if None in chunks:
+            return None
+        return utils.join_dhash(chunks)
+
+    def set_dhash(self, value):
+        """
+        Stores the perceptual hash of the image, None if it's unknown
+        """
+        if value is None:
+            chunks = [None] * utils.DHASH_CHUNKS
+        else:
+            chunks = utils.split_dhash(value)
+        for i, chunk in enumerate(chunks):
+            setattr(self, 'dhash_{}'.format(i), chunk)
 
-    def delete_files(self):
+    def get_similar(self, max_distance=4):
         """
-        Deletes image files
+        Returns a list of (image, distance) tuples of other images
+        similar to this one ordered by the distance
         """
+        dhash = self.get_dhash()
+        if dhash is None:
+            return []
+        return [
+            (image, distance)
+            for image, distance in Image.objects.find_similar(
+                dhash,
+                max_distance
+            )
+            if image.pk != self.pk
+        ]
+
+    def get_variant_names(self):
+        """
+        Returns names of variants required by the related object
+        """
+        try:
+            content_type = self.content_type
+        except ContentType.DoesNotExist:
+            # the related object is not specified
+            content_type = None
+        return get_variant_names(content_type)
+
+    def get_stale_variants(self):
+        """
+        Returns a list of variants required by the related object
+        that have been created with settings differ from actual ones
+        or have not been created yet and should be regenerated
+        """
+        required = self.get_variant_names()
+        stale = self.image.get_stale_variants(self.get_fingerprints())
+        # the full-size image is required by all objects
+        return [name for name in stale if name == 'image' or name in required]
+
+    def delete_files(self, exclude=()):
+        """
+        Deletes image files unless they are used by other images.
+        Images in the 'exclude' list of pks are deleted as well,
+        so they do not use the files.
+        """
+        if self._is_shared(self.image.name, exclude):
+            return
         self.image.delete_files()
 
     def delete(self, *args, **kwargs):
@@ -148,7 +704,17 @@ class Image(models.Model):
         """
         # delete image data first
         self.delete_files()
-        return super().delete(*args, **kwargs)
+        related = self._get_related_objects()
+        result = super().delete(*args, **kwargs)
+        if not self.defer_summary:
+            GallerySummary.objects.refresh(related)
+        return result
+
+    def get_variant_url(self, name):
+        """
+        URL of the file of the variant with given name
+        """
+        return self.image.get_variant_url(name)
 
     @property
     def thumbnail_url(self):
@@ -186,6 +752,205 @@ class Image(models.Model):
         return self.image.small_preview_url
 
 
+class GallerySummaryManager(models.Manager):
+    """
+    A custom Manager that keeps summaries of images of objects correct.
+    Used in the GallerySummary model.
+    """
+
+    def refresh(self, related, chunk_size=500):
+        """
+        Recomputes summaries of objects specified by (content_type_id,
+        object_id) tuples. Objects of models without the 'gallery_summary'
+        flag are skipped. Summaries of objects of the same content type
+        are recomputed by chunks using a few queries per chunk, summaries
+        of objects without images are deleted.
+        """
+        object_ids = defaultdict(set)
+        for ctype_id, object_id in related:
+            # the ContentType manager caches content types
+            ctype = ContentType.objects.db_manager(self.db).get_for_id(
+                ctype_id
+            )
+            if has_gallery_summary(ctype):
+                object_ids[ctype_id].add(object_id)
+        with transaction.atomic(using=self.db):
+            for ctype_id, values in object_ids.items():
+                values = sorted(values)
+                for i in range(0, len(values), chunk_size):
+                    self._refresh_chunk(ctype_id, values[i:i + chunk_size])
+
+    def _refresh_chunk(self, ctype_id, object_ids):
+        """
+        Recomputes summaries of objects of the content type. Positions of
+        images of all objects are read by a single query, the cover of each
+        object is its first image and names and fingerprints of covers are
+        read by another query. Covers of objects differ, so summaries could
+        not be grouped by values to update them. Instead former summaries
+        are deleted by a single query and new ones are inserted by another.
+        If another process has inserted a summary of one of objects
+        meanwhile, summaries are updated or created one by one.
+        """
+        images = Image.objects.using(self.db).filter(
+            content_type_id=ctype_id,
+            object_id__in=object_ids
+        )
+        counts = {}
+        covers = {}
+        rows = images.order_by('object_id', 'position', 'pk').values_list(
+            'object_id',
+            'pk'
+        )
+        for object_id, pk in rows:
+            counts[object_id] = counts.get(object_id, 0) + 1
+            covers.setdefault(object_id, pk)
+        files = {
+            pk: (name, fingerprints)
+            for pk, name, fingerprints in images.filter(
+                pk__in=list(covers.values())
+            ).values_list('pk', 'image', 'fingerprints')
+        }
+        # summaries of objects without images are not created again
+        self.filter(
+            content_type_id=ctype_id,
+            object_id__in=object_ids
+        ).delete()
+        values = {}
+        for object_id, count in counts.items():
+            name, fingerprints = files[covers[object_id]]
+            values[object_id] = {
+                'image_count': count,
+                'cover_pk': covers[object_id],
+                'cover_name': name,
+                'cover_fingerprints': fingerprints,
+            }
+        try:
+            # the savepoint keeps the deletion if the insertion fails
+            with transaction.atomic(using=self.db):
+                self.bulk_create([
+                    self.model(
+                        content_type_id=ctype_id,
+                        object_id=object_id,
+                        **defaults
+                    )
+                    for object_id, defaults in values.items()
+                ])
+        except IntegrityError:
+            # the summary has been inserted by another transaction
+            # that has not seen the deletion, the row is locked
+            # and updated or it's created if it's missing again
+            for object_id, defaults in values.items():
+                self.update_or_create(
+                    content_type_id=ctype_id,
+                    object_id=object_id,
+                    defaults=defaults
+                )
+
+    def refresh_covers(self, pks):
+        """
+        Refreshes summaries of objects whose covers are images with given
+        primary keys. Used when names or fingerprints of images have been
+        updated without saving images.
+        """
+        self.refresh(self.filter(cover_pk__in=pks).values_list(
+            'content_type',
+            'object_id'
+        ))
+
+    def rebuild(self, model, chunk_size=500):
+        """
+        Recomputes summaries of all objects of the model by chunks.
+        Used to create summaries of objects that have had images
+        before the 'gallery_summary' flag has been set.
+        Returns the number of objects.
+        """
+        ctype = ContentType.objects.db_manager(self.db).get_for_model(model)
+        pks = model._default_manager.using(self.db).order_by(
+            'pk'
+        ).values_list('pk', flat=True).iterator()
+        count = 0
+        while True:
+            chunk = list(itertools.islice(pks, chunk_size))
+            if not chunk:
+                break
+            self.refresh([(ctype.pk, pk) for pk in chunk], chunk_size)
+            count += len(chunk)
+        return count
+
+
+class GallerySummary(models.Model):
+    """
+    A denormalized summary of images related to the object: the number
+    of images and the cover (the first image by position). List views
+    render covers of objects using summaries joined to objects instead of
+    querying images of each object. Summaries are kept only for models
+    with the 'gallery_summary' attribute set to True.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    image_count = models.PositiveIntegerField(default=0)
+    # the primary key, the name and fingerprints of the first image,
+    # the key is not a foreign key, so images are still fast deleted
+    cover_pk = models.PositiveIntegerField(null=True, db_index=True)
+    cover_name = models.CharField(max_length=100, default='')
+    cover_fingerprints = models.TextField(default='')
+
+    objects = GallerySummaryManager()
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+
+    def __str__(self):
+        return '{} images of {}'.format(self.image_count, self.content_object)
+
+
+class ContentGalleryQuerySet(models.QuerySet):
+    """
+    A QuerySet of objects of models using the ContentGalleryMixin that
+    implements accounting of the disk usage of their images and joins
+    denormalized summaries of images. Sizes are taken from the database,
+    files are not read. Use it as the manager of your model:
+    objects = ContentGalleryQuerySet.as_manager()
+    """
+
+    def with_gallery_bytes(self):
+        """
+        Annotates objects with the total size in bytes of files of their
+        images (the 'gallery_bytes' attribute). Images whose sizes are
+        unknown are not counted.
+        """
+        return self.annotate(
+            gallery_bytes=Coalesce(Sum('content_gallery__total_bytes'), 0)
+        )
+
+    def get_gallery_bytes(self):
+        """
+        Returns the total size in bytes of files of images of all objects
+        """
+        total = self.aggregate(
+            total=Sum('content_gallery__total_bytes')
+        )['total']
+        return total or 0
+
+    def with_gallery_summary(self):
+        """
+        Annotates objects with their denormalized summaries joined by the
+        same query (the 'gallery_count', 'gallery_cover_pk',
+        'gallery_cover_name' and 'gallery_cover_fingerprints' attributes),
+        so covers and numbers of images are got without extra queries.
+        Requires the 'gallery_summary' flag of the model.
+        """
+        prefix = 'content_gallery_summary__'
+        return self.annotate(
+            gallery_count=Coalesce(F(prefix + 'image_count'), 0),
+            gallery_cover_pk=F(prefix + 'cover_pk'),
+            gallery_cover_name=F(prefix + 'cover_name'),
+            gallery_cover_fingerprints=F(prefix + 'cover_fingerprints')
+        )
+
+
 class ContentGalleryMixin(models.Model):
     """
     A mixin that adds the ContentGallery features to any model
@@ -193,11 +958,218 @@ class ContentGalleryMixin(models.Model):
     the 'gallery' field. The 'gallery_visible' flag is used to hide
     your model from the list in the content_gallery.Image admin page
     by setting it to False. But you still can add images from the
-    admin pages of you models.
+    admin pages of you models. The 'gallery_variants' could be set
+    to a list of names of variants your model needs, in this case
+    files of other variants are not created for its images. The
+    'gallery_summary' flag enables denormalized summaries of images
+    (the cover and the number of images) of objects of your model.
     """
 
     content_gallery = GenericRelation(Image)  # the manager of related images
+    # the summary of related images if the 'gallery_summary' is True
+    content_gallery_summary = GenericRelation(GallerySummary)
     gallery_visible = True  # the flag of visibility in the Image admin
+    # names of variants created for related images, all variants if None
+    gallery_variants = None
+    # the flag of keeping denormalized summaries of related images
+    gallery_summary = False
 
     class Meta:
         abstract = True
+
+    def _get_gallery_summary(self):
+        """
+        Returns the number of images and the primary key, the name and
+        fingerprints of the cover using annotations of the
+        with_gallery_summary method or the summary of the object
+        """
+        if hasattr(self, 'gallery_count'):
+            return (
+                self.gallery_count,
+                self.gallery_cover_pk,
+                self.gallery_cover_name,
+                self.gallery_cover_fingerprints
+            )
+        # the summary could be prefetched
+        for summary in self.content_gallery_summary.all():
+            return (
+                summary.image_count,
+                summary.cover_pk,
+                summary.cover_name,
+                summary.cover_fingerprints
+            )
+        return 0, None, '', ''
+
+    def get_gallery_count(self):
+        """
+        Returns the number of related images using the summary
+        """
+        return self._get_gallery_summary()[0]
+
+    def get_gallery_cover(self):
+        """
+        Returns the first related image built from the summary without
+        reading images or None if there are no images. The image is
+        not read from the database, so it should not be saved.
+        """
+        count, pk, name, fingerprints = self._get_gallery_summary()
+        if pk is None:
+            return None
+        return Image(
+            pk=pk,
+            image=name,
+            fingerprints=fingerprints or '',
+            content_object=self
+        )
+
+
+def _delete_gallery_files(sender, instance, using, **kwargs):
+    """
+    Removes files of images related to the object being deleted. The
+    collector deletes rows of related images by a single query without
+    calling ImageQuerySet.delete, so rows of images are read by a single
+    query before that and their files are removed by a pool of threads
+    when the deletion is committed. Files still used by other images
+    after the commit are kept.
+    """
+    ctype = ContentType.objects.db_manager(using).get_for_model(instance)
+    rows = list(Image.objects.using(using).filter(
+        content_type=ctype,
+        object_id=instance.pk
+    ).values_list('pk', 'image', 'content_hash', 'fingerprints'))
+    if not rows:
+        return
+
+    def delete():
+        # rows using the same files could be added before the commit
+        used = set(Image.objects.using(using).filter(
+            image__in=[row[1] for row in rows]
+        ).values_list('image', flat=True))
+        shared = {(row[2], row[1]) for row in rows if row[1] in used}
+        storage = Image._meta.get_field('image').storage
+        utils.storage_delete_many(
+            storage,
+            ImageQuerySet._get_file_names(rows, shared)
+        )
+    transaction.on_commit(delete, using=using)
+
+def _connect_gallery_model(sender, **kwargs):
+    """
+    Connects the handler removing files of related images to the pre_delete
+    signal of each model using the ContentGalleryMixin. The handler is not
+    connected to all models, so other models are still fast deleted.
+    """
+    if issubclass(sender, ContentGalleryMixin):
+        models.signals.pre_delete.connect(_delete_gallery_files, sender=sender)
+
+models.signals.class_prepared.connect(_connect_gallery_model)
+
+
+class CachedVariantManager(models.Manager):
+    """
+    A custom Manager that implements tracking and eviction of files of
+    variants created on demand. Used in the CachedVariant model.
+    """
+
+    def track(self, image_file):
+        """
+        Records the image file that has just been created. Files of eager
+        variants are never tracked, since they could not be created again.
+        """
+        if not image_file.lazy:
+            return
+        self.update_or_create(
+            name=image_file.location,
+            defaults={
+                'size': image_file.storage.size(image_file.storage_name),
+                'accessed': timezone.now()
+            }
+        )
+
+    def touch(self, image_file):
+        """
+        Records the access to the image file. To keep it cheap the database
+        is updated once in the 'cache_touch_interval' per file.
+        Files of eager variants are ignored.
+        """
+        if not image_file.lazy:
+            return
+        filename = image_file.location
+        interval = settings.CONF['cache_touch_interval']
+        # the key is added only if it does not exist
+        if not cache.add('content_gallery:touch:' + filename, 1, interval):
+            return
+        now = timezone.now()
+        if not self.filter(name=filename).update(accessed=now):
+            # the file has not been tracked yet
+            size = image_file.storage.size(image_file.storage_name)
+            self.get_or_create(
+                name=filename,
+                defaults={'size': size, 'accessed': now}
+            )
+
+    def evict(self, max_bytes, chunk_size=500):
+        """
+        Deletes least recently used files until their total size
+        does not exceed 'max_bytes'. Returns the number of deleted
+        files and their total size.
+        """
+        storage = Image._meta.get_field('image').storage
+        total = self.aggregate(total=Sum('size'))['total'] or 0
+        files = 0
+        removed = 0
+        while total > max_bytes:
+            chunk = list(
+                self.order_by('accessed').values_list('pk', 'name', 'size')[
+                    :chunk_size
+                ]
+            )
+            if not chunk:
+                break
+            # never delete full-size images even if they have been tracked
+            names = [utils.name_in_db(name) for pk, name, size in chunk]
+            originals = set(
+                Image.objects.filter(image__in=names).values_list(
+                    'image',
+                    flat=True
+                )
+            )
+            pks = []
+            for pk, name, size in chunk:
+                if total <= max_bytes:
+                    break
+                pks.append(pk)
+                total -= size
+                if utils.name_in_db(name) in originals:
+                    continue
+                # only files of lazy variants could be created on demand,
+                # the name is checked in case an eager file has been tracked
+                if not utils.is_lazy_file(name):
+                    continue
+                # do not delete the file while it's being created
+                with utils.lock_file(name):
+                    if not storage.exists(utils.name_in_db(name)):
+                        continue
+                    storage.delete(utils.name_in_db(name))
+                files += 1
+                removed += size
+            self.filter(pk__in=pks).delete()
+        return files, removed
+
+
+class CachedVariant(models.Model):
+    """
+    A file of the lazy variant created on demand. These files could be
+    created again, so they are considered as a cache limited by the total
+    size. The model stores the size and the last access time of the file.
+    """
+
+    # the file name including the subdirectory of the gallery folder
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveIntegerField()
+    accessed = models.DateTimeField(db_index=True)
+
+    objects = CachedVariantManager()
+
+    def __str__(self):
+        return self.name
@@ -25,11 +25,121 @@ CONF = {
 
     # the path to image files
     'path': 'content_gallery',
+
+    # the list of variants created for each image, every variant is a dict
+    # with 'name', 'width' and 'height' items and optional 'suffix' (used
+    # in file names, the name by default), 'format' (the format of uploaded
+    # image by default), 'quality' and 'lazy' (do not create the variant
+    # while uploading the image) items. If it's None, the small image,
+    # the preview, the small preview and the thumbnail are created
+    # using the sizes specified above
+    'variants': None,
+
+    # the way files of variants created on demand are sent by the web
+    # server: 'x-accel-redirect' (nginx), 'x-sendfile' (Apache, lighttpd)
+    # or None to send files by Django
+    'sendfile': None,
+
+    # the directory of lock files used while creating files on demand,
+    # a subdirectory in the system temporary directory if None
+    'lock_dir': None,
+
+    # the maximum total size in bytes of files created on demand, least
+    # recently used files are deleted when a new file exceeds the limit,
+    # files are deleted by the 'gallery_evict' command only if None
+    'cache_max_bytes': None,
+
+    # the minimum interval in seconds between updates of the last access
+    # time of the file created on demand
+    'cache_touch_interval': 3600,
+
+    # store the uploaded image file without changes to create the full-size
+    # image and files of variants again using the original source
+    'keep_original': False,
+
+    # add hashes of the content to file names, so every URL is immutable
+    # and files could be cached forever. Files are never renamed, a new
+    # upload or new settings of the variant create files with new names
+    'hashed_names': False,
+
+    # share files of images uploaded with the same content instead of
+    # creating them again, shared files are deleted with the last image
+    'deduplicate': False,
+
+    # the layout of subdirectories of the gallery folder: 'hash' (two levels
+    # named by the hash of the image name), 'date' (year/month/day of the
+    # upload) or None to store all files in the gallery folder directly
+    'layout': None,
+
+    # the number of threads saving files of variants to the storage
+    # concurrently while uploading the image
+    'storage_workers': 4,
+
+    # the number of threads creating files of images uploaded
+    # at once by the bulk upload of the image inline admin
+    'bulk_upload_workers': 4,
+
+    # the maximum size in bytes of the uploaded image file and the maximum
+    # number of its pixels, checked before decoding the image (no limits
+    # if None)
+    'max_upload_bytes': None,
+    'max_upload_pixels': None,
+
+    # uploaded files larger than this size in bytes are spooled to
+    # a temporary file while creating files of variants
+    'spool_max_memory_size': 2621440,
+
+    # files larger than this size in bytes are uploaded by the image inline
+    # admin in chunks of 'upload_chunk_size' bytes, so an interrupted upload
+    # could be resumed instead of sending the whole file again
+    'upload_chunk_threshold': 4194304,
+    'upload_chunk_size': 1048576,
+
+    # the directory of files of unfinished chunked uploads,
+    # a subdirectory in the system temporary directory if None
+    'upload_dir': None,
 }
 
 # overwrite defaults with settings specified in project settings file
 CONF.update(getattr(settings, 'CONTENT_GALLERY', {}))
 
+if CONF['layout'] not in (None, 'hash', 'date'):
+    raise ImproperlyConfigured(
+        "Unknown layout '{}'".format(CONF['layout'])
+    )
+
+# names of variants used by views, widgets and template tags,
+# so they are required in the list of variants
+REQUIRED_VARIANTS = ('small_image', 'preview', 'small_preview', 'thumbnail')
+
+# check the list of variants if it's specified
+
+if CONF['variants'] is not None:
+    names = set()
+    for variant in CONF['variants']:
+        if not {'name', 'width', 'height'}.issubset(variant):
+            raise ImproperlyConfigured(
+                "Each variant requires 'name', 'width' and 'height' items"
+            )
+        # 'image' is the name of the full-size image
+        if variant['name'] == 'image' or variant['name'] in names:
+            raise ImproperlyConfigured(
+                "Duplicate variant name '{}'".format(variant['name'])
+            )
+        names.add(variant['name'])
+        # the suffix of the stored original image file
+        if variant.get('suffix', variant['name']) == 'original':
+            raise ImproperlyConfigured(
+                "The 'original' suffix is reserved for original images"
+            )
+    missing = [name for name in REQUIRED_VARIANTS if name not in names]
+    if missing:
+        raise ImproperlyConfigured(
+            "Required variants are missing: {}. Declare unused variants "
+            "with 'lazy': True, so their files are never created unless "
+            "they are requested".format(', '.join(missing))
+        )
+
 # the ContentGallery requires the MEDIA_ROOT and MEDIA_URL settings
 
 if getattr(settings, 'MEDIA_ROOT', None) is None:
@@ -4,6 +4,163 @@
 
     galleryAdminView = ContentGallery.galleryAdminView;
 
+    var galleryUpload = (function () {
+        // the number of attempts to send a request before giving up
+        var maxAttempts = 5;
+
+        function createId() {
+            var id = "";
+            for (var i = 0; i < 32; i++) {
+                id += Math.floor(Math.random() * 16).toString(16);
+            }
+            return id;
+        }
+
+        // ids of unfinished chunked uploads are kept in the local storage,
+        // so the upload of the same file selected again is resumed
+        function getKey(file) {
+            return "content-gallery-upload:" + [file.name, file.size, file.lastModified].join(":");
+        }
+
+        function getStoredId(key) {
+            try {
+                return window.localStorage.getItem(key);
+            } catch (e) {
+                return null;
+            }
+        }
+
+        function setStoredId(key, id) {
+            try {
+                if (id) {
+                    window.localStorage.setItem(key, id);
+                } else {
+                    window.localStorage.removeItem(key);
+                }
+            } catch (e) {}
+        }
+
+        // sends the file by chunks, the returned promise is resolved with
+        // the pk of the created image and notified with the received size
+        function upload($upload, file) {
+            var deferred = $.Deferred();
+            var url = $upload.attr("data-upload-url");
+            var chunked = file.size > parseInt($upload.attr("data-chunk-threshold"));
+            // small files are sent by a single request
+            var chunkSize = chunked ? parseInt($upload.attr("data-chunk-size")) : file.size;
+            var key = getKey(file);
+            var id = (chunked && getStoredId(key)) || createId();
+            if (chunked) {
+                setStoredId(key, id);
+            }
+
+            function retry(attempt, xhr, next) {
+                // client errors would be repeated
+                if (attempt >= maxAttempts || (xhr.status >= 400 && xhr.status < 500)) {
+                    setStoredId(key, null);
+                    deferred.reject(["The upload has failed"]);
+                    return;
+                }
+                setTimeout(function () {
+                    next(attempt + 1);
+                }, 1000 * attempt);
+            }
+
+            function proceed(response) {
+                if (response.pk || response.errors) {
+                    setStoredId(key, null);
+                    if (response.pk) {
+                        deferred.resolve(response.pk);
+                    } else {
+                        deferred.reject(response.errors);
+                    }
+                    return;
+                }
+                deferred.notify(response.received, file.size);
+                send(response.received, 1);
+            }
+
+            // asks the server for the received size after a failure
+            function resume(attempt) {
+                $.ajax({
+                    url: url,
+                    data: {upload_id: id},
+                    dataType: "json"
+                }).done(proceed).fail(function (xhr) {
+                    retry(attempt, xhr, resume);
+                });
+            }
+
+            function send(offset, attempt) {
+                var data = new FormData();
+                data.append("upload_id", id);
+                data.append("offset", offset);
+                data.append("total", file.size);
+                data.append("name", file.name);
+                data.append("content_type", $upload.attr("data-content-type"));
+                data.append("object_id", $upload.attr("data-object-id"));
+                data.append("chunk", file.slice(offset, offset + chunkSize), file.name);
+                $.ajax({
+                    url: url,
+                    type: "POST",
+                    data: data,
+                    processData: false,
+                    contentType: false,
+                    dataType: "json",
+                    headers: {
+                        "X-CSRFToken": $("input[name=csrfmiddlewaretoken]").val()
+                    }
+                }).done(proceed).fail(function (xhr) {
+                    if (xhr.status === 409) {
+                        // the server has not received previous chunks
+                        proceed(JSON.parse(xhr.responseText));
+                        return;
+                    }
+                    retry(attempt, xhr, resume);
+                });
+            }
+
+            if (chunked) {
+                // the file could be partially uploaded before
+                resume(1);
+            } else {
+                send(0, 1);
+            }
+            return deferred.promise();
+        }
+
+        // sends small files by a single request, the returned promise
+        // is resolved with a list of results of files
+        function bulkUpload($upload, files) {
+            var data = new FormData();
+            data.append("content_type", $upload.attr("data-content-type"));
+            data.append("object_id", $upload.attr("data-object-id"));
+            $.each(files, function (i, file) {
+                data.append("images", file, file.name);
+            });
+            return $.ajax({
+                url: $upload.attr("data-bulk-upload-url"),
+                type: "POST",
+                data: data,
+                processData: false,
+                contentType: false,
+                dataType: "json",
+                headers: {
+                    "X-CSRFToken": $("input[name=csrfmiddlewaretoken]").val()
+                }
+            }).then(function (response) {
+                return response.results;
+            }, function () {
+                return ["The upload has failed"];
+            });
+        }
+
+        return {
+            upload: upload,
+            bulkUpload: bulkUpload
+        };
+    })();
+
     $(function () {
 
         $(".content-gallery-images-container").sortable({
@@ -23,6 +180,66 @@
             }
         });
 
+        $(".content-gallery-upload-input").on("change", function () {
+            var $upload = $(this).closest(".content-gallery-upload");
+            var $status = $upload.find(".content-gallery-upload-status");
+            var threshold = parseInt($upload.attr("data-chunk-threshold"));
+            var small = [];
+            var large = [];
+            var errors = [];
+            $.each(this.files, function (i, file) {
+                (file.size > threshold ? large : small).push(file);
+            });
+            $(this).val("");
+
+            // add created images like images added by the popup
+            function addImage(pk) {
+                $("#id_image").val(pk).trigger("change");
+            }
+
+            // uploads are performed one by one
+            var queue = $.Deferred().resolve();
+            function enqueue(start) {
+                var next = $.Deferred();
+                queue.always(function () {
+                    start().always(function () {
+                        next.resolve();
+                    });
+                });
+                queue = next;
+            }
+
+            if (small.length) {
+                enqueue(function () {
+                    $status.text("Uploading " + small.length + " images");
+                    return galleryUpload.bulkUpload($upload, small).done(function (results) {
+                        $.each(results, function (i, result) {
+                            if (result.pk) {
+                                addImage(result.pk);
+                            } else {
+                                errors.push(result.name + ": " + result.errors.join(" "));
+                            }
+                        });
+                    }).fail(function (messages) {
+                        errors.push(messages.join(" "));
+                    });
+                });
+            }
+            $.each(large, function (i, file) {
+                enqueue(function () {
+                    $status.text(file.name + ": 0%");
+                    return galleryUpload.upload($upload, file).progress(function (received, total) {
+                        $status.text(file.name + ": " + Math.floor(received * 100 / total) + "%");
+                    }).done(addImage).fail(function (messages) {
+                        errors.push(file.name + ": " + messages.join(" "));
+                    });
+                });
+            });
+            queue.always(function () {
+                $status.text(errors.join(" "));
+            });
+        });
+
         $("#id_image").on("change", function () {
             var image_id = this.value;
 
@@ -1 +1 @@
-(function(a){window.ContentGallery=window.ContentGallery||{};galleryAdminView=ContentGallery.galleryAdminView;a(function(){a(".content-gallery-images-container").sortable({cursor:"move",revert:200,tolerance:"pointer",connectWith:".content-gallery-images-container",handle:".content-gallery-image-header",items:"> :not(.content-gallery-add-new-image)",placeholder:"content-gallery-placeholder",update:function(b,c){a("#content-gallery-sorted-images").find(".content-gallery-image-position").each(function(d){a(this).val(d)});a("#content-gallery-sorted-images").find(".content-gallery-image-delete").find("input").removeAttr("value");a("#content-gallery-images-to-delete").find(".content-gallery-image-delete").find("input").val(1)}});a("#id_image").on("change",function(){var c=this.value;var i=a(".content-gallery-images");var j=i.attr("data-inline-formset");var b=JSON.parse(j);var d=b.options.prefix;var h=i.find("#id_"+d+"-TOTAL_FORMS");var g=h.val();var e=parseInt(g)+1;var f=d+"-"+g;h.val(e);i.find("#id_"+d+"-INITIAL_FORMS").val(e);var k=i.attr("data-preview-url-pattern")+c;a.ajax({url:k,dataType:"json",beforeSend:function(l){if(l.overrideMimeType){l.overrideMimeType("application/json")}},success:function(l){a("#content-gallery-sorted-images").find(".content-gallery-add-new-image").before(a("<div></div>").addClass("content-gallery-image-object").append(a("<div></div>").addClass("content-gallery-image-header")).append(a("<div></div>").addClass("content-gallery-image-content").append(a("<span></span>").addClass("content-gallery-image-delete").append(a("<input>").attr("type","hidden").attr("id","id_"+f+"-DELETE").attr("name",f+"-DELETE"))).append(a("<span></span>").addClass("content-gallery-preview-container").append(a("<a></a>").addClass("content-gallery-image-content-link").addClass("content-gallery-open-view").addClass("content-gallery-block-box").addClass("content-gallery-centered-image").attr("href","#").attr("data-image",l.image_data).append(a("<img>").addClass("content-gallery-image-preview").attr("src",l.small_preview_url))).append(a("<img>").addClass("content-gallery-zoom").addClass("content-gallery-inline-preview-zoom").attr("src",l.zoom_url))).append(a("<input>").addClass("content-gallery-image-position").attr("type","hidden").attr("id","id_"+f+"-position").attr("name",f+"-position").val(l.position)).append(a("<input>").attr("type","hidden").attr("id","id_"+f+"-id").attr("name",f+"-id").val(c))))}})})})})(django.jQuery);
\ No newline at end of file
+(function(a){window.ContentGallery=window.ContentGallery||{};galleryAdminView=ContentGallery.galleryAdminView;var m=(function(){var b=5;function c(){var e="";for(var f=0;f<32;f++){e+=Math.floor(Math.random()*16).toString(16)}return e}function d(e){return"content-gallery-upload:"+[e.name,e.size,e.lastModified].join(":")}function g(e){try{return window.localStorage.getItem(e)}catch(f){return null}}function h(e,f){try{if(f){window.localStorage.setItem(e,f)}else{window.localStorage.removeItem(e)}}catch(i){}}function k(e,f){var i=a.Deferred();var j=e.attr("data-upload-url");var l=f.size>parseInt(e.attr("data-chunk-threshold"));var n=l?parseInt(e.attr("data-chunk-size")):f.size;var o=d(f);var p=(l&&g(o))||c();if(l){h(o,p)}function q(t,u,v){if(t>=b||(u.status>=400&&u.status<500)){h(o,null);i.reject(["The upload has failed"]);return}setTimeout(function(){v(t+1)},1000*t)}function r(t){if(t.pk||t.errors){h(o,null);if(t.pk){i.resolve(t.pk)}else{i.reject(t.errors)}return}i.notify(t.received,f.size);w(t.received,1)}function s(t){a.ajax({url:j,data:{upload_id:p},dataType:"json"}).done(r).fail(function(u){q(t,u,s)})}function w(t,u){var v=new FormData();v.append("upload_id",p);v.append("offset",t);v.append("total",f.size);v.append("name",f.name);v.append("content_type",e.attr("data-content-type"));v.append("object_id",e.attr("data-object-id"));v.append("chunk",f.slice(t,t+n),f.name);a.ajax({url:j,type:"POST",data:v,processData:false,contentType:false,dataType:"json",headers:{"X-CSRFToken":a("input[name=csrfmiddlewaretoken]").val()}}).done(r).fail(function(x){if(x.status===409){r(JSON.parse(x.responseText));return}q(u,x,s)})}if(l){s(1)}else{w(0,1)}return i.promise()}function y(e,f){var i=new FormData();i.append("content_type",e.attr("data-content-type"));i.append("object_id",e.attr("data-object-id"));a.each(f,function(j,l){i.append("images",l,l.name)});return a.ajax({url:e.attr("data-bulk-upload-url"),type:"POST",data:i,processData:false,contentType:false,dataType:"json",headers:{"X-CSRFToken":a("input[name=csrfmiddlewaretoken]").val()}}).then(function(j){return j.results},function(){return["The upload has failed"]})}return{upload:k,bulkUpload:y}})();a(function(){a(".content-gallery-images-container").sortable({cursor:"move",revert:200,tolerance:"pointer",connectWith:".content-gallery-images-container",handle:".content-gallery-image-header",items:"> :not(.content-gallery-add-new-image)",placeholder:"content-gallery-placeholder",update:function(b,c){a("#content-gallery-sorted-images").find(".content-gallery-image-position").each(function(d){a(this).val(d)});a("#content-gallery-sorted-images").find(".content-gallery-image-delete").find("input").removeAttr("value");a("#content-gallery-images-to-delete").find(".content-gallery-image-delete").find("input").val(1)}});a(".content-gallery-upload-input").on("change",function(){var b=a(this).closest(".content-gallery-upload");var c=b.find(".content-gallery-upload-status");var d=parseInt(b.attr("data-chunk-threshold"));var e=[];var f=[];var g=[];a.each(this.files,function(l,n){(n.size>d?f:e).push(n)});a(this).val("");function h(l){a("#id_image").val(l).trigger("change")}var i=a.Deferred().resolve();function j(l){var n=a.Deferred();i.always(function(){l().always(function(){n.resolve()})});i=n}if(e.length){j(function(){c.text("Uploading "+e.length+" images");return m.bulkUpload(b,e).done(function(l){a.each(l,function(n,o){if(o.pk){h(o.pk)}else{g.push(o.name+": "+o.errors.join(" "))}})}).fail(function(l){g.push(l.join(" "))})})}a.each(f,function(l,n){j(function(){c.text(n.name+": 0%");return m.upload(b,n).progress(function(o,p){c.text(n.name+": "+Math.floor(o*100/p)+"%")}).done(h).fail(function(o){g.push(n.name+": "+o.join(" "))})})});i.always(function(){c.text(g.join(" "))})});a("#id_image").on("change",function(){var c=this.value;var i=a(".content-gallery-images");var j=i.attr("data-inline-formset");var b=JSON.parse(j);var d=b.options.prefix;var h=i.find("#id_"+d+"-TOTAL_FORMS");var g=h.val();var e=parseInt(g)+1;var f=d+"-"+g;h.val(e);i.find("#id_"+d+"-INITIAL_FORMS").val(e);var k=i.attr("data-preview-url-pattern")+c;a.ajax({url:k,dataType:"json",beforeSend:function(l){if(l.overrideMimeType){l.overrideMimeType("application/json")}},success:function(l){a("#content-gallery-sorted-images").find(".content-gallery-add-new-image").before(a("<div></div>").addClass("content-gallery-image-object").append(a("<div></div>").addClass("content-gallery-image-header")).append(a("<div></div>").addClass("content-gallery-image-content").append(a("<span></span>").addClass("content-gallery-image-delete").append(a("<input>").attr("type","hidden").attr("id","id_"+f+"-DELETE").attr("name",f+"-DELETE"))).append(a("<span></span>").addClass("content-gallery-preview-container").append(a("<a></a>").addClass("content-gallery-image-content-link").addClass("content-gallery-open-view").addClass("content-gallery-block-box").addClass("content-gallery-centered-image").attr("href","#").attr("data-image",l.image_data).append(a("<img>").addClass("content-gallery-image-preview").attr("src",l.small_preview_url))).append(a("<img>").addClass("content-gallery-zoom").addClass("content-gallery-inline-preview-zoom").attr("src",l.zoom_url))).append(a("<input>").addClass("content-gallery-image-position").attr("type","hidden").attr("id","id_"+f+"-position").attr("name",f+"-position").val(l.position)).append(a("<input>").attr("type","hidden").attr("id","id_"+f+"-id").attr("name",f+"-id").val(c))))}})})})})(django.jQuery);
\ No newline at end of file
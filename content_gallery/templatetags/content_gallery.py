@@ -3,7 +3,6 @@ import json
 from django import template
 from django.utils import html
 
-from .. import settings
 from .. import utils
 
 register = template.Library()
@@ -35,17 +34,20 @@ def gallery_image_data(obj):
 
 
 @register.inclusion_tag('content_gallery/templatetags/preview.html')
-def gallery_preview(obj):
+def gallery_preview(obj, variant='preview'):
     """
-    Returns a large preview of the first image related to the object
+    Returns a large preview of the first image related to the object.
+    The 'variant' is the name of the variant used as the preview.
     """
+    spec = utils.get_variant(variant)
     # preview dimensions used in its template
     context = {
-        'image_width': settings.CONF['preview_width'],
-        'image_height': settings.CONF['preview_height'],
-        'div_width': settings.CONF['preview_width'] + 14,
-        'div_height': settings.CONF['preview_height'] + 14,
-        'zoom_left': settings.CONF['preview_width'] - 55
+        'variant': variant,
+        'image_width': spec['width'],
+        'image_height': spec['height'],
+        'div_width': spec['width'] + 14,
+        'div_height': spec['height'] + 14,
+        'zoom_left': spec['width'] - 55
     }
     # get image data
     image_data = gallery_image_data(obj)
@@ -56,17 +58,20 @@ def gallery_preview(obj):
 
 
 @register.inclusion_tag('content_gallery/templatetags/small_preview.html')
-def gallery_small_preview(obj):
+def gallery_small_preview(obj, variant='small_preview'):
     """
-    Returns a small preview of the first image related to the object
+    Returns a small preview of the first image related to the object.
+    The 'variant' is the name of the variant used as the small preview.
     """
+    spec = utils.get_variant(variant)
     # preview dimensions used in its template
     context = {
-        'image_width': settings.CONF['small_preview_width'],
-        'image_height': settings.CONF['small_preview_height'],
-        'div_width': settings.CONF['small_preview_width'] + 14,
-        'div_height': settings.CONF['small_preview_height'] + 14,
-        'zoom_left': settings.CONF['small_preview_width'] - 15
+        'variant': variant,
+        'image_width': spec['width'],
+        'image_height': spec['height'],
+        'div_width': spec['width'] + 14,
+        'div_height': spec['height'] + 14,
+        'zoom_left': spec['width'] - 15
     }
     # get image data
     image_data = gallery_image_data(obj)
@@ -85,6 +90,24 @@ def gallery_data_url_pattern():
     return utils.get_gallery_data_url_pattern()
 
 
+@register.simple_tag
+def gallery_download_url(obj, variant=None):
+    """
+    Returns the URL of the ZIP archive of images related to the object.
+    Files of the variant are added to the archive if it's specified.
+    """
+    return utils.create_download_url(obj, variant)
+
+
+@register.filter
+def gallery_variant_url(image, variant):
+    """
+    Returns the URL to the file of the variant of the image.
+    Could be used with both Image objects and their 'image' fields.
+    """
+    return image.get_variant_url(variant)
+
+
 @register.filter
 def obfuscate(path):
     """
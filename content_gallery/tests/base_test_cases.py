@@ -4,7 +4,7 @@ from django.contrib.contenttypes.models import ContentType
 from .. import models
 from .. import settings
 
-from .utils import get_image_in_memory_data, clean_db
+from .utils import get_image_in_memory_data, clean_db, InMemoryStorage
 from .models import *
 
 class ImageTestCase(TestCase):
@@ -158,6 +158,7 @@ class ViewsTestCase(TestCase):
 class MockImageTestCase(TestCase):
     """
     A base test case with a mock image object
+    using the in-memory storage
     """
 
     def setUp(self):
@@ -167,6 +168,8 @@ class MockImageTestCase(TestCase):
         """
         self.image = mock.MagicMock(spec=models.Image)
         self.image.name = 'gallery/foo.jpg'
+        # image files are saved in the memory
+        self.image.storage = InMemoryStorage()
 
 
 class AjaxRequestMixin:
@@ -38,8 +38,26 @@ class AnotherTestModel(models.ContentGalleryMixin, BaseTestModel):
     gallery_visible = False
 
 
+class ThumbnailTestModel(models.ContentGalleryMixin, BaseTestModel):
+    """
+    A test model whose images require the thumbnail only,
+    files of other variants are not created.
+    """
+    gallery_variants = ['thumbnail']
+
+
 class WrongTestModel(BaseTestModel):
     """
     A test model that does not uses the ContentGalleryMixin.
     It could not be related to the Image objects.
     """
+
+
+class SummaryTestModel(models.ContentGalleryMixin, BaseTestModel):
+    """
+    A test model that keeps denormalized summaries of its images
+    and uses the QuerySet joining them.
+    """
+    gallery_summary = True
+
+    objects = models.ContentGalleryQuerySet.as_manager()
@@ -1,12 +1,17 @@
 import json
+import tempfile
 
 from django.test import mock, TestCase
 from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 from .. import admin
+from .. import models
 from .. import utils
 
-from .base_test_cases import ViewsTestCase, AjaxRequestMixin
+from .base_test_cases import ViewsTestCase, AjaxRequestMixin, ImageTestCase
+from .utils import get_image_data, patch_settings
 
 class TestImageAdminInline(TestCase):
     """
@@ -80,6 +85,15 @@ class TestImageAdminInline(TestCase):
         # check whether the 'preview_url_pattern' of returned object
         # has the correct value
         self.assertEqual(formset.preview_url_pattern, 'url_pattern')
+        # check whether the formset contains the URL of the upload view
+        self.assertEqual(
+            formset.upload_url,
+            reverse('admin:gallery_image_upload')
+        )
+        self.assertEqual(
+            formset.bulk_upload_url,
+            reverse('admin:gallery_image_bulk_upload')
+        )
         
 
 
@@ -165,3 +179,215 @@ class TestImageAdmin(AjaxRequestMixin, ViewsTestCase):
                 "zoom_url": 'foo',
             }
         )
+
+
+class TestImageAdminUpload(AjaxRequestMixin, ImageTestCase):
+    """
+    Tests for the chunked upload view of the Image admin. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def setUp(self):
+        """
+        Logs in the superuser and stores chunked uploads
+        in the temporary directory
+        """
+        super().setUp()
+        self.url = reverse('admin:gallery_image_upload')
+        user = User.objects.create_superuser('admin', '', 'password')
+        self.client.force_login(user)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patcher = patch_settings({'upload_dir': self.tmp.name})
+        self.patcher.__enter__()
+        self.data = get_image_data().read()
+
+    def tearDown(self):
+        """
+        Removes images created by uploads and the temporary directory
+        """
+        for image in models.Image.objects.exclude(pk=self.image.pk):
+            image.delete()
+        super().tearDown()
+        self.patcher.__exit__(None, None, None)
+        self.tmp.cleanup()
+
+    def send_chunk(self, offset, size, upload_id='a' * 32):
+        """
+        Sends the chunk of the image data and returns the response
+        """
+        # the name differs from the name of the existing image,
+        # so its files are not replaced
+        chunk = self.data[offset:offset + size]
+        return self.client.post(
+            self.url,
+            {
+                'upload_id': upload_id,
+                'offset': offset,
+                'total': len(self.data),
+                'name': 'bar.jpg',
+                'content_type': self.image.content_type.pk,
+                'object_id': self.object.pk,
+                'chunk': SimpleUploadedFile('blob', chunk),
+            },
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    @staticmethod
+    def decode(resp):
+        """
+        Returns data of the JSON response
+        """
+        return json.loads(resp.content.decode("utf-8"))
+
+    def test_not_ajax(self):
+        """
+        Checks whether the view returns 403 error in response
+        to non-AJAX requests
+        """
+        resp = self.client.get(self.url, {'upload_id': 'a' * 32})
+        self.assertEqual(resp.status_code, 403)
+
+    def test_invalid_upload_id(self):
+        """
+        Checks whether the view returns 400 error if the id is invalid
+        """
+        resp = self.send_ajax_request(self.url + '?upload_id=foo')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_chunked_upload(self):
+        """
+        Checks whether the image is created when all chunks have been
+        received and the last chunk sent again does not create another
+        image
+        """
+        half = len(self.data) // 2
+        resp = self.send_chunk(0, half)
+        self.assertEqual(self.decode(resp), {'received': half})
+        # the client resumes the upload using the received size
+        resp = self.send_ajax_request(self.url + '?upload_id=' + 'a' * 32)
+        self.assertEqual(self.decode(resp), {'received': half})
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            resp = self.send_chunk(half, len(self.data))
+        result = self.decode(resp)
+        image = models.Image.objects.get(pk=result['pk'])
+        self.assertEqual(image.object_id, self.object.pk)
+        self.assertEqual(image.position, 1)
+        # the retry returns the same result
+        resp = self.send_chunk(half, len(self.data))
+        self.assertEqual(self.decode(resp), result)
+        self.assertEqual(models.Image.objects.count(), 2)
+
+    def test_repeated_chunk(self):
+        """
+        Checks whether the chunk sent again does not change received data
+        """
+        self.send_chunk(0, 100)
+        resp = self.send_chunk(0, 100)
+        self.assertEqual(self.decode(resp), {'received': 100})
+
+    def test_missing_chunk(self):
+        """
+        Checks whether the view returns 409 error and the received size
+        if previous chunks have not been received
+        """
+        resp = self.send_chunk(100, 100)
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(self.decode(resp), {'received': 0})
+
+    def test_invalid_image(self):
+        """
+        Checks whether errors of the form are returned
+        if the received file is not an image
+        """
+        self.data = b'foo'
+        resp = self.send_chunk(0, 3)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(self.decode(resp)['errors'])
+        self.assertEqual(models.Image.objects.count(), 1)
+
+    def test_too_large_upload(self):
+        """
+        Checks whether the upload larger than the limit is rejected
+        before receiving its chunks
+        """
+        with patch_settings({'max_upload_bytes': 100}):
+            resp = self.send_chunk(0, 100)
+        self.assertEqual(resp.status_code, 400)
+
+
+class TestImageAdminBulkUpload(ImageTestCase):
+    """
+    Tests for the bulk upload view of the Image admin. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def setUp(self):
+        """
+        Logs in the superuser
+        """
+        super().setUp()
+        self.url = reverse('admin:gallery_image_bulk_upload')
+        user = User.objects.create_superuser('admin', '', 'password')
+        self.client.force_login(user)
+
+    def tearDown(self):
+        """
+        Removes created images
+        """
+        for image in models.Image.objects.exclude(pk=self.image.pk):
+            image.delete()
+        super().tearDown()
+
+    def send_files(self, files, object_id=None):
+        """
+        Sends files and returns the response
+        """
+        return self.client.post(
+            self.url,
+            {
+                'content_type': self.image.content_type.pk,
+                'object_id': object_id or self.object.pk,
+                'images': files,
+            },
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_bulk_upload(self):
+        """
+        Checks whether images of valid files are created
+        and errors are returned for invalid files
+        """
+        data = get_image_data().read()
+        files = [
+            SimpleUploadedFile('bar.jpg', data),
+            SimpleUploadedFile('baz.txt', b'foo'),
+            SimpleUploadedFile('qux.jpg', data),
+        ]
+        resp = self.send_files(files)
+        results = json.loads(resp.content.decode("utf-8"))['results']
+        self.assertEqual(
+            [result['name'] for result in results],
+            ['bar.jpg', 'baz.txt', 'qux.jpg']
+        )
+        self.assertTrue(results[1]['errors'])
+        images = [
+            models.Image.objects.get(pk=results[i]['pk']) for i in (0, 2)
+        ]
+        self.assertEqual([image.position for image in images], [1, 2])
+
+    def test_unknown_object(self):
+        """
+        Checks whether the view returns 400 error
+        if the related object does not exist
+        """
+        resp = self.send_files([], object_id=self.object.pk + 1)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_get_request(self):
+        """
+        Checks whether the view accepts POST requests only
+        """
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 405)
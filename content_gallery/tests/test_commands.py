@@ -0,0 +1,909 @@
+import os
+import zipfile
+import tempfile
+from io import StringIO
+
+from django.test import mock, TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.contenttypes.models import ContentType
+
+from .. import models
+from .. import utils
+from ..management.base import ChunkedCommand
+from ..management.commands import gallery_regenerate, gallery_fsck
+
+from .base_test_cases import ImageTestCase
+from .models import TestModel, SummaryTestModel
+from .utils import patch_settings, get_image_size, get_image_in_memory_data
+from .utils import get_image_data
+
+class TestGalleryRegenerate(ImageTestCase):
+    """
+    Tests for the gallery_regenerate management command. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def setUp(self):
+        """
+        Removes the thumbnail and the preview files of the image
+        """
+        super().setUp()
+        os.remove(self.image.image.thumbnail.path)
+        os.remove(self.image.image.preview.path)
+
+    def call_command(self, *args, **kwargs):
+        """
+        Calls the command with one worker and returns its output.
+        Variants are regenerated regardless of fingerprints by default.
+        """
+        kwargs.setdefault('force', True)
+        out = StringIO()
+        call_command(
+            'gallery_regenerate',
+            *args,
+            workers=1,
+            stdout=out,
+            stderr=StringIO(),
+            **kwargs
+        )
+        return out.getvalue()
+
+    def test_all_variants(self):
+        """
+        Checks whether all variants are created again
+        """
+        out = self.call_command()
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertTrue(os.path.isfile(self.image.image.preview.path))
+        self.assertIn("Regenerated 1 images (0 up to date, 0 failed)", out)
+
+    def test_file_sizes(self):
+        """
+        Checks whether sizes of regenerated files are stored
+        """
+        with patch_settings({'thumbnail_width': 50}):
+            self.call_command()
+            image = self.get_image()
+            storage = image.image.storage
+            sizes = image.get_file_sizes()
+            self.assertEqual(
+                sizes['thumbnail'],
+                storage.size(image.image.thumbnail.storage_name)
+            )
+            self.assertEqual(image.total_bytes, sum(sizes.values()))
+
+    def test_up_to_date_variants(self):
+        """
+        Checks whether variants created with actual
+        settings are not regenerated
+        """
+        out = self.call_command(force=False)
+        self.assertFalse(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertIn("Regenerated 0 images (1 up to date, 0 failed)", out)
+
+    def test_stale_variants(self):
+        """
+        Checks whether only variants created with outdated settings
+        are regenerated and their fingerprints are updated
+        """
+        with patch_settings({'thumbnail_width': 50}):
+            self.call_command(force=False)
+            image = self.get_image()
+            # the image has no stale variants anymore
+            self.assertEqual(image.get_stale_variants(), [])
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertFalse(os.path.isfile(self.image.image.preview.path))
+
+    def test_selected_variants(self):
+        """
+        Checks whether only selected variants are created again
+        """
+        self.call_command(variants=['thumbnail'])
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertFalse(os.path.isfile(self.image.image.preview.path))
+
+    def test_not_required_variants(self):
+        """
+        Checks whether variants not required by
+        the related object are not created
+        """
+        with mock.patch.object(TestModel, 'gallery_variants', ['thumbnail']):
+            self.call_command()
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertFalse(os.path.isfile(self.image.image.preview.path))
+
+    def test_another_content_type(self):
+        """
+        Checks whether images related to another
+        content type are not processed
+        """
+        self.call_command(content_types=['tests.anothertestmodel'])
+        self.assertFalse(os.path.isfile(self.image.image.thumbnail.path))
+
+    def test_unknown_content_type(self):
+        """
+        Checks whether the CommandError is raised if
+        the content type does not exist
+        """
+        with self.assertRaises(CommandError):
+            self.call_command(content_types=['tests.foo'])
+
+    def test_pk_range(self):
+        """
+        Checks whether images out of the range are not processed
+        """
+        self.call_command(min_pk=self.image.pk + 1)
+        self.assertFalse(os.path.isfile(self.image.image.thumbnail.path))
+
+    def test_checkpoint(self):
+        """
+        Checks whether the last processed pk is stored
+        in the checkpoint file
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint')
+            self.call_command(checkpoint=path)
+            with open(path) as f:
+                self.assertEqual(f.read(), str(self.image.pk))
+
+    def test_resume_from_checkpoint(self):
+        """
+        Checks whether images processed before are skipped
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint')
+            with open(path, 'w') as f:
+                f.write(str(self.image.pk))
+            self.call_command(checkpoint=path)
+        self.assertFalse(os.path.isfile(self.image.image.thumbnail.path))
+
+    def test_regenerate_missing_image(self):
+        """
+        Checks whether the worker function returns an error
+        message if the full-size image does not exist
+        """
+        pk, error, regenerated, obsolete, sizes = \
+            gallery_regenerate.regenerate(
+                (1, 'content_gallery/missing.jpg', ['thumbnail'], {})
+            )
+        self.assertEqual(pk, 1)
+        self.assertIsNotNone(error)
+        self.assertEqual(regenerated, [])
+        self.assertEqual(obsolete, [])
+        self.assertEqual(sizes, {})
+
+    def test_full_size_image_without_original(self):
+        """
+        Checks whether the full-size image is skipped and its
+        fingerprint is kept if the original image does not exist
+        """
+        with patch_settings({'keep_original': True, 'image_width': 100}):
+            self.call_command(variants=['image'])
+            image = self.get_image()
+            self.assertEqual(image.get_stale_variants(), ['image'])
+
+
+class TestGalleryRegenerateOriginal(ImageTestCase):
+    """
+    Tests for the gallery_regenerate management command in the
+    'keep_original' mode. Inherits a TestModel object and an image
+    related to that, the image is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates the image keeping the original file
+        """
+        with patch_settings({'keep_original': True}):
+            super().setUp()
+
+    def test_full_size_image(self):
+        """
+        Checks whether the full-size image is created again
+        using the original image with new settings
+        """
+        with patch_settings({'keep_original': True, 'image_width': 100}):
+            call_command(
+                'gallery_regenerate',
+                workers=1,
+                stdout=StringIO()
+            )
+            image = self.get_image()
+            self.assertEqual(image.get_stale_variants(), [])
+        self.assertEqual(get_image_size(image.image.path), (100, 100))
+
+
+class TestGalleryRelayout(ImageTestCase):
+    """
+    Tests for the gallery_relayout management command. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def call_command(self):
+        """
+        Calls the command and returns its output
+        """
+        out = StringIO()
+        call_command(
+            'gallery_relayout',
+            stdout=out,
+            stderr=StringIO()
+        )
+        return out.getvalue()
+
+    def test_hash_layout(self):
+        """
+        Checks whether files are moved to subdirectories
+        and names of images are updated
+        """
+        with patch_settings({'layout': 'hash'}):
+            out = self.call_command()
+            image = self.get_image()
+            shard = utils.create_shard('foo')
+            self.assertEqual(
+                image.image.name,
+                utils.name_in_db('foo.jpg', shard)
+            )
+            self.assertTrue(os.path.isfile(image.image.path))
+            self.assertTrue(os.path.isfile(image.image.thumbnail.path))
+            self.assertIn("Moved 1 images (0 in place, 0 failed)", out)
+            # the second run does not move files
+            out = self.call_command()
+            self.assertIn("Moved 0 images (1 in place, 0 failed)", out)
+            # move files back to clean them up by the test case
+            self.image = self.get_image()
+            self.image.image.move_files('')
+
+    def test_date_layout(self):
+        """
+        Checks whether files are moved to the subdirectory
+        of the modification date of the full-size image
+        """
+        with patch_settings({'layout': 'date'}):
+            self.call_command()
+            image = self.get_image()
+            self.assertEqual(
+                image.image.image_data.shard,
+                utils.create_shard('foo')
+            )
+            self.assertTrue(os.path.isfile(image.image.preview.path))
+            image.image.move_files('')
+
+    def test_hashed_names(self):
+        """
+        Checks whether files of variants are moved using stored
+        fingerprints when settings of variants have been changed
+        """
+        with patch_settings({'hashed_names': True}):
+            upload = get_image_in_memory_data()
+            upload.name = 'bar.jpg'
+            image = models.Image.objects.create(
+                image=upload,
+                content_object=self.object
+            )
+            image = models.Image.objects.get(pk=image.pk)
+            storage = image.image.storage
+            # the original file is not kept
+            names = [
+                name for name in image.image.get_storage_names()
+                if storage.exists(name)
+            ]
+            with patch_settings({'thumbnail_width': 50, 'layout': 'hash'}):
+                out = self.call_command()
+                image = models.Image.objects.get(pk=image.pk)
+                moved = [
+                    name for name in image.image.get_storage_names()
+                    if storage.exists(name)
+                ]
+                self.assertEqual(len(moved), len(names))
+                # no files are left in the former directory
+                for name in names:
+                    self.assertFalse(storage.exists(name), name)
+                self.assertIn("Moved 2 images (0 in place, 0 failed)", out)
+                image.image.move_files('')
+                self.get_image().image.move_files('')
+            image.delete()
+
+    def test_tracked_files(self):
+        """
+        Checks whether names of tracked files are updated
+        """
+        variants = [
+            {'name': 'thumbnail', 'width': 20, 'height': 20, 'lazy': True},
+        ]
+        with patch_settings({'variants': variants}):
+            field_file = self.get_image().image
+            field_file.create_variant_file('thumbnail')
+            models.CachedVariant.objects.track(field_file.thumbnail)
+            with patch_settings({'layout': 'hash'}):
+                self.call_command()
+                field_file = self.get_image().image
+                tracked = models.CachedVariant.objects.get()
+                self.assertEqual(tracked.name, field_file.thumbnail.location)
+                field_file.move_files('')
+            field_file.thumbnail.delete()
+        tracked.delete()
+
+
+class TestGallerySimilar(ImageTestCase):
+    """
+    Tests for the gallery_similar management command. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates the second image with the same content
+        """
+        super().setUp()
+        # the name of the uploaded file differs from the name of
+        # the first image, so its files are not replaced
+        upload = get_image_in_memory_data()
+        upload.name = 'bar.jpg'
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            self.another_image = models.Image.objects.create(
+                image=upload,
+                content_type=self.image.content_type,
+                object_id=self.object.id
+            )
+
+    def tearDown(self):
+        """
+        Removes both images
+        """
+        super().tearDown()
+        self.another_image.delete()
+
+    def call_command(self, **kwargs):
+        """
+        Calls the command and returns its output
+        """
+        out = StringIO()
+        call_command(
+            'gallery_similar',
+            stdout=out,
+            stderr=StringIO(),
+            **kwargs
+        )
+        return out.getvalue()
+
+    def test_similar_images(self):
+        """
+        Checks whether the pair of similar images is found
+        """
+        out = self.call_command()
+        self.assertIn(
+            "Images #{} and #{} are similar (distance 0)".format(
+                self.image.pk,
+                self.another_image.pk
+            ),
+            out
+        )
+        self.assertIn("Found 1 pairs of similar images", out)
+
+    def test_missing_hashes(self):
+        """
+        Checks whether images without hashes are skipped unless
+        the '--update' option is specified
+        """
+        models.Image.objects.filter(pk=self.image.pk).update(dhash_0=None)
+        out = self.call_command()
+        self.assertIn("Found 0 pairs of similar images", out)
+        out = self.call_command(update=True)
+        self.assertIn("Found 1 pairs of similar images", out)
+        self.assertEqual(
+            models.Image.objects.get(pk=self.image.pk).get_dhash(),
+            self.image.get_dhash()
+        )
+
+
+class TestGalleryImport(ImageTestCase):
+    """
+    Tests for the gallery_import management command. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates the directory containing two image files
+        related to the object and a file of another object
+        """
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'images')
+        os.mkdir(self.source)
+        data = get_image_data().read()
+        self.names = [
+            '{}_a.jpg'.format(self.object.pk),
+            '{}_b.jpg'.format(self.object.pk),
+            'missing.jpg',
+        ]
+        for name in self.names:
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        """
+        Removes imported images and the temporary directory
+        """
+        for image in models.Image.objects.exclude(pk=self.image.pk):
+            image.delete()
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def call_command(self, source=None, **kwargs):
+        """
+        Calls the command with one worker and returns its output.
+        The pk of the object is found in file names by default.
+        """
+        if 'csv' not in kwargs:
+            kwargs.setdefault('pattern', r'^(\d+)_')
+            kwargs.setdefault('model', 'tests.testmodel')
+        out = StringIO()
+        call_command(
+            'gallery_import',
+            source or self.source,
+            workers=1,
+            stdout=out,
+            stderr=StringIO(),
+            **kwargs
+        )
+        return out.getvalue()
+
+    def get_imported(self):
+        """
+        Returns imported images ordered by position
+        """
+        return list(
+            models.Image.objects.exclude(pk=self.image.pk).order_by(
+                'position'
+            )
+        )
+
+    def test_import_directory(self):
+        """
+        Checks whether images get positions after the existing image
+        and unique names, and their files are created
+        """
+        out = self.call_command()
+        self.assertIn("Imported 2 images (1 skipped, 0 failed)", out)
+        images = self.get_imported()
+        self.assertEqual([image.position for image in images], [1, 2])
+        self.assertEqual(
+            [image.image.name for image in images],
+            [
+                self.get_name('testobject.jpg'),
+                self.get_name('testobject-1.jpg')
+            ]
+        )
+        for image in images:
+            self.assertTrue(os.path.isfile(image.image.path))
+            self.assertTrue(os.path.isfile(image.image.thumbnail.path))
+            self.assertEqual(image.get_stale_variants(), [])
+            self.assertEqual(image.get_dhash(), self.image.get_dhash())
+            self.assertEqual(image.total_bytes, self.image.total_bytes)
+
+    def test_import_zip(self):
+        """
+        Checks whether members of the archive are imported
+        using the CSV file
+        """
+        archive = os.path.join(self.tmp.name, 'images.zip')
+        with zipfile.ZipFile(archive, 'w') as f:
+            f.write(os.path.join(self.source, self.names[0]), 'dir/foo.jpg')
+        mapping = os.path.join(self.tmp.name, 'mapping.csv')
+        with open(mapping, 'w') as f:
+            f.write('name,model,pk\n')
+            f.write('dir/foo.jpg,tests.testmodel,{}\n'.format(self.object.pk))
+        out = self.call_command(archive, csv=mapping)
+        self.assertIn("Imported 1 images (0 skipped, 0 failed)", out)
+        image = self.get_imported()[0]
+        self.assertTrue(os.path.isfile(image.image.path))
+
+    def test_broken_file(self):
+        """
+        Checks whether the broken file is reported as failed
+        """
+        with open(os.path.join(self.source, self.names[1]), 'wb') as f:
+            f.write(b'foo')
+        out = self.call_command()
+        self.assertIn("Imported 1 images (1 skipped, 1 failed)", out)
+
+    def test_resume_from_checkpoint(self):
+        """
+        Checks whether the number of processed files is stored
+        and processed files are skipped
+        """
+        path = os.path.join(self.tmp.name, 'checkpoint')
+        with open(path, 'w') as f:
+            f.write('1')
+        out = self.call_command(checkpoint=path)
+        self.assertIn("Imported 1 images", out)
+        with open(path) as f:
+            self.assertEqual(f.read(), '3')
+
+    def test_without_mapping(self):
+        """
+        Checks whether the CommandError is raised
+        if the mapping is not specified
+        """
+        with self.assertRaises(CommandError):
+            call_command('gallery_import', self.source, stdout=StringIO())
+
+
+class TestGalleryEvict(TestCase):
+    """
+    Tests for the gallery_evict management command
+    """
+
+    def test_evict(self):
+        """
+        Checks whether the command evicts files using given limit
+        """
+        with mock.patch.object(
+            models.CachedVariantManager,
+            'evict',
+            return_value=(2, 300)
+        ) as evict:
+            out = StringIO()
+            call_command('gallery_evict', max_bytes=100, stdout=out)
+        evict.assert_called_with(100)
+        self.assertIn("Deleted 2 files (300 bytes)", out.getvalue())
+
+    def test_without_limit(self):
+        """
+        Checks whether the CommandError is raised
+        if the limit is not specified
+        """
+        with self.assertRaises(CommandError):
+            call_command('gallery_evict', stdout=StringIO())
+
+
+class TestGalleryFsck(ImageTestCase):
+    """
+    Tests for the gallery_fsck management command. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates an orphaned file in the subdirectory of the gallery folder
+        """
+        super().setUp()
+        storage = self.image.image.storage
+        self.orphan = utils.name_in_db('orphan.jpg', 'ab/cd')
+        os.makedirs(os.path.dirname(storage.path(self.orphan)), exist_ok=True)
+        with open(storage.path(self.orphan), 'wb') as f:
+            f.write(b'foo')
+
+    def tearDown(self):
+        """
+        Removes the orphaned file
+        """
+        storage = self.image.image.storage
+        storage.delete(self.orphan)
+        super().tearDown()
+
+    def call_command(self, **kwargs):
+        """
+        Calls the command with one worker and returns its output
+        """
+        out = StringIO()
+        call_command(
+            'gallery_fsck',
+            workers=1,
+            stdout=out,
+            stderr=StringIO(),
+            **kwargs
+        )
+        return out.getvalue()
+
+    def test_scan(self):
+        """
+        Checks whether names of files in subdirectories are found
+        """
+        storage = self.image.image.storage
+        root = storage.path(utils.name_in_db(''))
+        names = set(gallery_fsck.scan(root))
+        self.assertIn('ab/cd/orphan.jpg', names)
+        self.assertIn('foo_thumbnail.jpg', names)
+
+    def test_orphans(self):
+        """
+        Checks whether the orphaned file is reported and files
+        of the image are not
+        """
+        out = self.call_command()
+        self.assertIn("Orphaned file '{}'".format(self.orphan), out)
+        self.assertNotIn(self.image.image.name, out)
+        self.assertIn("0 images with missing files", out)
+
+    def test_delete_orphans(self):
+        """
+        Checks whether the orphaned file is deleted
+        unless it's modified recently
+        """
+        path = self.image.image.storage.path(self.orphan)
+        self.call_command(delete_orphans=True)
+        self.assertTrue(os.path.isfile(path))
+        self.call_command(delete_orphans=True, min_age=0)
+        self.assertFalse(os.path.isfile(path))
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+
+    def test_missing_variants(self):
+        """
+        Checks whether missing files of required variants are reported
+        """
+        os.remove(self.image.image.thumbnail.path)
+        out = self.call_command()
+        self.assertIn("Image #{}: missing thumbnail".format(self.image.pk), out)
+        self.assertIn(
+            "1 images with missing files (0 regenerated, 0 failed)",
+            out
+        )
+
+    def test_lazy_variant(self):
+        """
+        Checks whether absent files of lazy variants are not reported
+        """
+        variants = [
+            {'name': 'thumbnail', 'width': 20, 'height': 20, 'lazy': True},
+        ]
+        with patch_settings({'variants': variants}):
+            out = self.call_command()
+        self.assertIn("0 images with missing files", out)
+
+    def test_regenerate(self):
+        """
+        Checks whether missing files of variants are created again
+        """
+        os.remove(self.image.image.thumbnail.path)
+        out = self.call_command(regenerate=True)
+        self.assertIn(
+            "1 images with missing files (1 regenerated, 0 failed)",
+            out
+        )
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        out = self.call_command()
+        self.assertIn("0 images with missing files", out)
+
+    def test_regenerate_failed(self):
+        """
+        Checks whether images whose files could not be created
+        are not counted as regenerated
+        """
+        # the full-size image is not created without the original
+        os.remove(self.image.image.path)
+        out = self.call_command(regenerate=True)
+        self.assertIn(
+            "1 images with missing files (0 regenerated, 0 failed)",
+            out
+        )
+        # the source of the thumbnail is missing
+        os.remove(self.image.image.thumbnail.path)
+        out = self.call_command(regenerate=True)
+        self.assertIn(
+            "1 images with missing files (0 regenerated, 1 failed)",
+            out
+        )
+
+    def test_shared_files(self):
+        """
+        Checks whether files shared by images are not reported as missing
+        """
+        with patch_settings({'deduplicate': True}):
+            duplicate = models.Image.objects.create(
+                image=get_image_in_memory_data(),
+                content_type=self.image.content_type,
+                object_id=self.object.pk
+            )
+        self.assertEqual(
+            models.Image.objects.get(pk=duplicate.pk).image.name,
+            self.image.image.name
+        )
+        out = self.call_command()
+        self.assertIn("0 images with missing files", out)
+        models.Image.objects.filter(pk=duplicate.pk).delete()
+
+
+class TestGalleryUsage(ImageTestCase):
+    """
+    Tests for the gallery_usage management command. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def call_command(self, **kwargs):
+        """
+        Calls the command and returns its output
+        """
+        out = StringIO()
+        call_command('gallery_usage', stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_report(self):
+        """
+        Checks whether content types and objects
+        are listed with sizes of their images
+        """
+        out = self.call_command()
+        size = self.image.total_bytes
+        self.assertIn(
+            "tests.testmodel: {} bytes in 1 images".format(size),
+            out
+        )
+        self.assertIn(
+            "tests.testmodel #{} (TestObject): {} bytes in 1 images".format(
+                self.object.pk,
+                size
+            ),
+            out
+        )
+        self.assertIn(
+            "Total {} bytes in 1 images (0 with unknown sizes), "
+            "{} bytes counting shared files once".format(size, size),
+            out
+        )
+
+    def test_shared_files(self):
+        """
+        Checks whether files shared by images with the same
+        content are counted once in the stored size only
+        """
+        another = TestModel.objects.create(name="Another")
+        upload = get_image_in_memory_data()
+        with patch_settings({'deduplicate': True}):
+            models.Image.objects.create_bulk(another, [upload])
+        size = self.image.total_bytes
+        out = self.call_command()
+        self.assertIn(
+            "Total {} bytes in 2 images (0 with unknown sizes), "
+            "{} bytes counting shared files once".format(size * 2, size),
+            out
+        )
+        another.delete()
+
+    def test_content_type(self):
+        """
+        Checks whether images of given models are counted only
+        """
+        out = self.call_command(content_types=['tests.anothertestmodel'])
+        self.assertIn("Total 0 bytes in 0 images", out)
+        with self.assertRaises(CommandError):
+            self.call_command(content_types=['tests.foo'])
+
+    def test_update(self):
+        """
+        Checks whether unknown sizes are read from the storage
+        """
+        size = self.image.total_bytes
+        models.Image.objects.update(file_sizes='', total_bytes=None)
+        out = self.call_command()
+        self.assertIn("Total 0 bytes in 1 images (1 with unknown sizes)", out)
+        out = self.call_command(update=True)
+        self.assertIn("Updated sizes of 1 images", out)
+        self.assertIn(
+            "Total {} bytes in 1 images (0 with unknown sizes)".format(size),
+            out
+        )
+        self.assertEqual(
+            self.get_image().get_file_sizes(),
+            self.image.get_file_sizes()
+        )
+
+
+class TestGallerySummary(ImageTestCase):
+    """
+    Tests for the gallery_summary management command. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def setUp(self):
+        """
+        Relates the image to the object keeping the summary
+        and removes the summary
+        """
+        super().setUp()
+        self.summary_object = SummaryTestModel.objects.create(name="Summary")
+        models.Image.objects.filter(pk=self.image.pk).update(
+            content_type=ContentType.objects.get_for_model(SummaryTestModel),
+            object_id=self.summary_object.pk
+        )
+
+    def tearDown(self):
+        """
+        Removes the object keeping the summary
+        """
+        super().tearDown()
+        self.summary_object.delete()
+
+    def call_command(self, *args, **kwargs):
+        """
+        Calls the command and returns its output
+        """
+        out = StringIO()
+        call_command('gallery_summary', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_rebuild(self):
+        """
+        Checks whether summaries of objects of models
+        with the 'gallery_summary' flag are rebuilt
+        """
+        out = self.call_command()
+        self.assertIn("tests.summarytestmodel: 1 objects", out)
+        self.assertIn("Rebuilt summaries of 1 objects", out)
+        self.assertNotIn("tests.testmodel", out)
+        summary = models.GallerySummary.objects.get()
+        self.assertEqual(summary.object_id, self.summary_object.pk)
+        self.assertEqual(summary.cover_pk, self.image.pk)
+        self.assertEqual(summary.image_count, 1)
+
+    def test_model(self):
+        """
+        Checks whether only models keeping summaries
+        could be specified
+        """
+        out = self.call_command('--model', 'tests.SummaryTestModel')
+        self.assertIn("tests.summarytestmodel: 1 objects", out)
+        with self.assertRaises(CommandError):
+            self.call_command('--model', 'tests.TestModel')
+        with self.assertRaises(CommandError):
+            self.call_command('--model', 'tests.Unknown')
+
+
+class TestChunkedCommand(TestCase):
+    """
+    Tests for the base class of commands processing images by chunks
+    """
+
+    def test_not_positive_options(self):
+        """
+        Checks whether commands refuse not positive
+        numbers of workers and chunk sizes
+        """
+        commands = [
+            'gallery_fsck',
+            'gallery_regenerate',
+            'gallery_relayout',
+            'gallery_similar',
+            'gallery_usage',
+        ]
+        for name in commands + ['gallery_summary']:
+            with self.assertRaisesMessage(CommandError, "chunk size"):
+                call_command(name, chunk_size=0, stdout=StringIO())
+        for name in commands:
+            with self.assertRaisesMessage(CommandError, "workers"):
+                call_command(name, workers=0, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "workers"):
+            call_command('gallery_import', 'foo', workers=0)
+
+    def test_checkpoint(self):
+        """
+        Checks whether the number stored in the checkpoint file
+        is read and None is returned if there is no file
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint')
+            self.assertIsNone(ChunkedCommand.read_checkpoint(path))
+            ChunkedCommand.write_checkpoint(path, 42)
+            self.assertEqual(ChunkedCommand.read_checkpoint(path), 42)
+            self.assertEqual(os.listdir(tmp), ['checkpoint'])
+
+    def test_broken_checkpoint(self):
+        """
+        Checks whether the command fails if the checkpoint file is broken
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'checkpoint')
+            with open(path, 'w') as f:
+                f.write('foo')
+            with self.assertRaisesMessage(CommandError, "Broken checkpoint"):
+                ChunkedCommand.read_checkpoint(path)
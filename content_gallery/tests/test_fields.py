@@ -1,13 +1,22 @@
 import os
+import re
+from io import BytesIO
+from PIL import Image
 
-from django.test import mock, override_settings
+from django.test import mock
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import InMemoryUploadedFile
 
 from .. import fields
 from .. import models
 from .. import image_data
+from .. import utils
 
 from .base_test_cases import ImageTestCase
-from .utils import patch_settings
+from .models import TestModel
+from .utils import patch_settings, get_image_data, get_image_size
+from .utils import get_image_in_memory_data
+from .utils import InMemoryStorage
 
 class TestGalleryImageFieldFile(ImageTestCase):
     """
@@ -24,7 +33,8 @@ class TestGalleryImageFieldFile(ImageTestCase):
         super().setUp()
         # patch classes used to manipulate with image data
         with mock.patch.object(image_data, 'InMemoryImageData') as m:
-            with mock.patch.object(image_data, 'ImageFile') as f:
+            with mock.patch.object(image_data, 'ImageFile') as f, \
+                    mock.patch.object(image_data, 'OriginalImageFile'):
                 # set known settings
                 with patch_settings(
                     {
@@ -49,6 +59,8 @@ class TestGalleryImageFieldFile(ImageTestCase):
             # save mocks of called classes
             self.image_file = f
             self.in_memory_data = m
+        # variants are created while uploading images
+        self.image_file.return_value.lazy = False
 
     def test_init(self):
         """
@@ -65,77 +77,54 @@ class TestGalleryImageFieldFile(ImageTestCase):
             self.field_file,
             800,
             600,
-            'small'
+            'small',
+            format=None,
+            quality=None,
+            lazy=False,
+            variant='small_image'
         )
         # check whether the preview objects has been created properly
         self.image_file.assert_any_call(
             self.field_file,
             400,
             300,
-            'preview'
+            'preview',
+            format=None,
+            quality=None,
+            lazy=False,
+            variant='preview'
         )
         # check whether the small preview objects has been created properly
         self.image_file.assert_any_call(
             self.field_file,
             200,
             150,
-            'small_preview'
+            'small_preview',
+            format=None,
+            quality=None,
+            lazy=False,
+            variant='small_preview'
         )
         # check whether the thumbnail objects has been created properly
         self.image_file.assert_any_call(
             self.field_file,
             120,
             80,
-            'thumbnail'
+            'thumbnail',
+            format=None,
+            quality=None,
+            lazy=False,
+            variant='thumbnail'
         )
 
-    # set known media root
-    @override_settings(MEDIA_ROOT='/media')
-    @mock.patch('os.mkdir')
-    # emulate an existence of the directory
-    @mock.patch('os.path.isdir', return_value=True)
-    def test_check_dir_exists(self, isdir, mkdir):
-        """
-        Checks whether the mkdir is not called if the directory exists
-        """
-        # create known path
-        path = '/media' + os.sep + 'gallery'
-        # patch settings to set known path
-        with patch_settings({'path': 'gallery'}):
-            self.field_file._check_dir()
-        # check whether isdir has been called with the path
-        isdir.assert_called_with(path)
-        # check whether mkdir has not been called
-        mkdir.assert_not_called()
-
-    # set known media root
-    @override_settings(MEDIA_ROOT='/media')
-    @mock.patch('os.mkdir')
-    # emulate an absence of the directory
-    @mock.patch('os.path.isdir', return_value=False)
-    def test_check_dir_does_not_exist(self, isdir, mkdir):
-        """
-        Checks whether the mkdir is called with the path
-        if the directory does not exist
-        """
-        # create known path
-        path = '/media' + os.sep + 'gallery'
-        # patch settings to set known path
-        with patch_settings({'path': 'gallery'}):
-            self.field_file._check_dir()
-        # check whether isdir has been called with the path
-        isdir.assert_called_with(path)
-        # check whether mkdir has been called with the path
-        mkdir.assert_called_with(path)
-
     def test_save_files_image_data_exists(self):
         """
         Checks whether save methods of image objects are
         called properly and the name has not been changed
         if data exists
         """
-        # replace creation of the directory
-        self.field_file._check_dir = mock.MagicMock()
+        # the image has not been uploaded
+        self.field_file.name = 'gallery/foo.jpg'
         # data exists
         self.field_file.image_data.data = True
         # set known name in the database
@@ -143,37 +132,70 @@ class TestGalleryImageFieldFile(ImageTestCase):
         # call the method with known arguments
         self.field_file.save_files('bar', 'baz')
 
-        # check whether the _check_dir has been called
-        self.field_file._check_dir.assert_called_with()
         # check whether the save methods of all image objects
         # has been called with the arguments passed to tested method
         self.field_file.image_data.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            shard=''
         )
         self.field_file.thumbnail.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
         self.field_file.preview.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
         self.field_file.small_preview.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
         self.field_file.small_image.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
-        # check whether the name equals with the image name
-        self.assertEqual(self.field_file.name, str(self.image))
+        # check whether the name has not been changed
+        self.assertEqual(self.field_file.name, 'gallery/foo.jpg')
+
+    def test_save_files_uploaded_image(self):
+        """
+        Checks whether each image file gets its own file
+        object containing the uploaded data
+        """
+        # the image has been uploaded
+        self.field_file.name = 'foo.jpg'
+        self.field_file.file = BytesIO(b'data')
+        self.field_file.image_data.data = True
+        # sources are closed after saving, so read them while saving
+        sources = []
+        def save(source, *args):
+            sources.append((source, source.name, source.read()))
+        # the thumbnail is the same mock object as other variants,
+        # create the mock method before calling it from threads,
+        # concurrently created mocks would lose calls
+        self.field_file.thumbnail.save.side_effect = save
+        # call the method with known arguments
+        self.field_file.save_files('bar', '')
+        self.assertEqual(len(sources), 4)
+        for source, name, data in sources:
+            self.assertEqual(name, 'foo.jpg')
+            self.assertEqual(data, b'data')
+        # check whether the sources are different objects
+        self.assertEqual(len(set(id(source[0]) for source in sources)), 4)
 
     def test_save_files_image_data_does_not_exist(self):
         """
@@ -181,8 +203,8 @@ class TestGalleryImageFieldFile(ImageTestCase):
         called properly and the name has been set to the
         name in the database
         """
-        # replace creation of the directory
-        self.field_file._check_dir = mock.MagicMock()
+        # the image has not been uploaded
+        self.field_file.name = 'gallery/foo.jpg'
         # data does not exist
         self.field_file.image_data.data = None
         # set known name in the database
@@ -190,34 +212,41 @@ class TestGalleryImageFieldFile(ImageTestCase):
         # call the method with known arguments
         self.field_file.save_files('bar', 'baz')
 
-        # check whether the _check_dir has been called
-        self.field_file._check_dir.assert_called_with()
         # check whether the save methods of all image objects
         # has been called with the arguments passed to tested method
         self.field_file.image_data.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            shard=''
         )
         self.field_file.thumbnail.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
         self.field_file.preview.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
         self.field_file.small_preview.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
         self.field_file.small_image.save.assert_called_with(
             self.field_file,
             'bar',
-            'baz'
+            'baz',
+            True,
+            ''
         )
         # check whether the name has been set to the name in the database
         self.assertEqual(self.field_file.name, 'foo')
@@ -285,3 +314,640 @@ class TestGalleryImageFieldFile(ImageTestCase):
         url = self.field_file.small_preview_url
         # check whether values are equal
         self.assertEqual(url, self.field_file.small_preview.url)
+
+    def test_regenerate_files(self):
+        """
+        Checks whether all variants are created using the full-size
+        image file as the source if the original image does not exist
+        """
+        # the original image does not exist
+        self.field_file.has_original = mock.MagicMock(return_value=False)
+        # set known source file
+        self.field_file.open_source = mock.MagicMock()
+        source = self.field_file.open_source.return_value.__enter__()
+        # call the method
+        regenerated = self.field_file.regenerate_files()
+        # check whether all variants have been created
+        for variant in self.field_file.variants.values():
+            variant._create_image.assert_called_with(source)
+        # check whether the full-size image has not been changed
+        self.field_file.image_data._create_image.assert_not_called()
+        self.assertEqual(regenerated, list(self.field_file.variants))
+
+    def test_regenerate_selected_files(self):
+        """
+        Checks whether only given variants are created
+        """
+        # set known source file
+        self.field_file.open_source = mock.MagicMock()
+        source = self.field_file.open_source.return_value.__enter__()
+        # call the method with the thumbnail only
+        self.field_file.regenerate_files(['thumbnail'])
+        # check whether only the thumbnail has been created
+        # (all variants are the same mock object)
+        self.field_file.thumbnail._create_image.assert_called_once_with(
+            source
+        )
+
+
+class TestGalleryImageFieldFileVariants(ImageTestCase):
+    """
+    Tests for GalleryImageFieldFile using variants specified
+    in the settings. Inherits a TestModel object and an image
+    related to that, The image is unique per test
+    """
+
+    # variants used instead of default ones
+    variants = [
+        {'name': 'retina', 'width': 160, 'height': 160, 'format': 'PNG'},
+        {'name': 'thumbnail', 'width': 20, 'height': 20, 'lazy': True},
+    ]
+
+    def setUp(self):
+        """
+        Creates the image using known variants
+        """
+        with patch_settings({'variants': self.variants}):
+            super().setUp()
+
+    def tearDown(self):
+        """
+        Removes the image using known variants
+        """
+        with patch_settings({'variants': self.variants}):
+            super().tearDown()
+
+    def test_variants(self):
+        """
+        Checks whether only eager variants have been created
+        """
+        with patch_settings({'variants': self.variants}):
+            field_file = self.get_image().image
+        self.assertEqual(list(field_file.variants), ['retina', 'thumbnail'])
+        # the eager variant is created in given format
+        self.assertTrue(field_file.retina.path.endswith('foo_retina.png'))
+        self.assertTrue(os.path.isfile(field_file.retina.path))
+        # the lazy variant is not created
+        self.assertFalse(os.path.isfile(field_file.thumbnail.path))
+
+    def test_get_variant_url(self):
+        """
+        Checks whether URLs of variants and the full-size image are correct
+        """
+        with patch_settings({'variants': self.variants}):
+            field_file = self.get_image().image
+        self.assertEqual(
+            field_file.get_variant_url('retina'),
+            field_file.retina.url
+        )
+        self.assertEqual(
+            field_file.get_variant_url('image'),
+            field_file.image_data.url
+        )
+
+    def test_unknown_attribute(self):
+        """
+        Checks whether the AttributeError is raised
+        if the variant does not exist
+        """
+        with patch_settings({'variants': self.variants}):
+            field_file = self.get_image().image
+        with self.assertRaises(AttributeError):
+            field_file.preview
+
+    def test_lazy_variant_not_stale(self):
+        """
+        Checks whether the lazy variant that has not been
+        created yet is not stale
+        """
+        with patch_settings({'variants': self.variants}):
+            field_file = self.get_image().image
+            stale = field_file.get_stale_variants({})
+        self.assertEqual(stale, ['retina'])
+
+    def test_regenerate_lazy_variant(self):
+        """
+        Checks whether the file of the lazy variant
+        is deleted instead of creating
+        """
+        with patch_settings({'variants': self.variants}):
+            field_file = self.get_image().image
+            field_file.create_variant_file('thumbnail')
+            field_file.regenerate_files(['thumbnail'])
+        self.assertFalse(os.path.isfile(field_file.thumbnail.path))
+
+
+class TestGalleryImageFieldFileOriginal(ImageTestCase):
+    """
+    Tests for GalleryImageFieldFile in the 'keep_original' mode.
+    Inherits a TestModel object and an image related to that,
+    The image is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates the image keeping the original file
+        """
+        with patch_settings({'keep_original': True}):
+            super().setUp()
+
+    def test_original_file(self):
+        """
+        Checks whether the uploaded file is stored without changes
+        """
+        field_file = self.get_image().image
+        self.assertTrue(field_file.original.path.endswith('foo_original.jpg'))
+        with open(field_file.original.path, 'rb') as f:
+            self.assertEqual(f.read(), get_image_data().read())
+
+    def test_open_source(self):
+        """
+        Checks whether the original image is used as the source
+        """
+        field_file = self.get_image().image
+        with field_file.open_source() as f:
+            self.assertEqual(f.name, field_file.original.path)
+        # the full-size image is used if the original one is absent
+        os.remove(field_file.original.path)
+        with field_file.open_source() as f:
+            self.assertEqual(f.name, field_file.image_data.path)
+
+    def test_regenerate_full_size_image(self):
+        """
+        Checks whether the full-size image is created
+        again using the original image
+        """
+        with patch_settings({'image_width': 300, 'image_height': 300}):
+            field_file = self.get_image().image
+            regenerated = field_file.regenerate_files(['image'])
+        self.assertEqual(regenerated, ['image'])
+        # the original image 200x200 is not enlarged
+        size = get_image_size(field_file.image_data.path)
+        self.assertEqual(size, (200, 200))
+
+    def test_regenerate_without_original(self):
+        """
+        Checks whether the full-size image is skipped
+        if the original image does not exist
+        """
+        field_file = self.get_image().image
+        os.remove(field_file.original.path)
+        self.assertEqual(field_file.regenerate_files(['image']), [])
+        with self.assertRaises(FileNotFoundError):
+            field_file.create_variant_file('image')
+
+    def test_rename_original(self):
+        """
+        Checks whether the original file is renamed
+        with other image files
+        """
+        another_object = TestModel.objects.create(name="AnotherObject")
+        image = self.get_image()
+        old_path = image.image.original.path
+        # attach the image to another object to rename files
+        image.object_id = another_object.pk
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            image.save()
+        self.assertFalse(os.path.isfile(old_path))
+        self.assertTrue(
+            image.image.original.path.endswith('bar_original.jpg')
+        )
+        self.assertTrue(os.path.isfile(image.image.original.path))
+        image.delete_files()
+        another_object.delete()
+
+    def test_delete_original(self):
+        """
+        Checks whether the original file is deleted with the image
+        """
+        image = self.get_image()
+        path = image.image.original.path
+        image.delete()
+        self.assertFalse(os.path.isfile(path))
+
+    def test_stale_full_size_image(self):
+        """
+        Checks whether the full-size image is stale only
+        in the 'keep_original' mode
+        """
+        field_file = self.get_image().image
+        with patch_settings({'keep_original': True}):
+            self.assertEqual(field_file.get_stale_variants({})[0], 'image')
+        self.assertNotIn('image', field_file.get_stale_variants({}))
+
+
+class TestGalleryImageFieldFileStorage(ImageTestCase):
+    """
+    Tests for GalleryImageFieldFile saving image files into
+    the in-memory storage. Inherits a TestModel object and
+    an image related to that, The image is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates the image in the in-memory storage
+        """
+        self.storage = InMemoryStorage()
+        field = models.Image._meta.get_field('image')
+        self.storage_patcher = mock.patch.object(
+            field,
+            'storage',
+            self.storage
+        )
+        self.storage_patcher.start()
+        with patch_settings({'keep_original': True}):
+            super().setUp()
+
+    def tearDown(self):
+        """
+        Removes the image and restores the storage
+        """
+        super().tearDown()
+        self.storage_patcher.stop()
+
+    def test_files(self):
+        """
+        Checks whether all image files are saved into the storage
+        """
+        field_file = self.get_image().image
+        names = [field_file.image_data.storage_name]
+        names.append(field_file.original.storage_name)
+        for variant in field_file.variants.values():
+            names.append(variant.storage_name)
+        self.assertEqual(sorted(self.storage.files), sorted(names))
+        self.assertEqual(field_file.thumbnail.url[:9], '/storage/')
+
+    def test_rename_files(self):
+        """
+        Checks whether files are renamed in the storage
+        """
+        another_object = TestModel.objects.create(name="AnotherObject")
+        image = self.get_image()
+        image.object_id = another_object.pk
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            image.save()
+        names = [utils.get_name(name) for name in self.storage.files]
+        self.assertEqual(
+            sorted(names),
+            sorted(utils.name_in_db(name) for name in [
+                'bar', 'bar_original', 'bar_small', 'bar_preview',
+                'bar_small_preview', 'bar_thumbnail'
+            ])
+        )
+        image.delete_files()
+        another_object.delete()
+
+    def test_regenerate_files(self):
+        """
+        Checks whether files are created again using
+        the original image from the storage
+        """
+        field_file = self.get_image().image
+        field_file.thumbnail.delete()
+        with patch_settings({'keep_original': True}):
+            field_file.regenerate_files()
+        self.assertTrue(field_file.thumbnail.exists())
+
+    def test_delete_files(self):
+        """
+        Checks whether all files are deleted from the storage
+        """
+        self.get_image().delete_files()
+        self.assertEqual(self.storage.files, {})
+
+
+class TestGalleryImageFieldFileLayout(ImageTestCase):
+    """
+    Tests for GalleryImageFieldFile using the hashed layout of
+    subdirectories. Inherits a TestModel object and an image
+    related to that, The image is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates the image using the hashed layout
+        """
+        self.settings_patcher = patch_settings({'layout': 'hash'})
+        self.settings_patcher.__enter__()
+        super().setUp()
+
+    def tearDown(self):
+        """
+        Removes the image and restores the settings
+        """
+        super().tearDown()
+        self.settings_patcher.__exit__(None, None, None)
+
+    def test_files(self):
+        """
+        Checks whether all image files are stored
+        in the subdirectory of the gallery folder
+        """
+        image = self.get_image()
+        shard = utils.create_shard('foo')
+        self.assertEqual(image.image.name, utils.name_in_db('foo.jpg', shard))
+        self.assertEqual(image.image.thumbnail.shard, shard)
+        self.assertTrue(os.path.isfile(image.image.thumbnail.path))
+        self.assertIn('/' + shard + '/', image.thumbnail_url)
+
+    def test_rename_files(self):
+        """
+        Checks whether files are moved to the subdirectory
+        of the new name
+        """
+        another_object = TestModel.objects.create(name="AnotherObject")
+        image = self.get_image()
+        old_path = image.image.thumbnail.path
+        image.object_id = another_object.pk
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            image.save()
+        self.assertFalse(os.path.isfile(old_path))
+        shard = utils.create_shard('bar')
+        self.assertEqual(image.image.thumbnail.shard, shard)
+        self.assertTrue(os.path.isfile(image.image.thumbnail.path))
+        image.delete_files()
+        another_object.delete()
+
+    def test_move_files(self):
+        """
+        Checks whether files are moved to another subdirectory
+        and moving could be repeated
+        """
+        field_file = self.get_image().image
+        name = field_file.move_files('')
+        self.assertEqual(name, utils.name_in_db('foo.jpg'))
+        self.assertTrue(os.path.isfile(field_file.preview.path))
+        # the full-size image has been moved already
+        field_file = fields.GalleryImageFieldFile(
+            None,
+            models.Image._meta.get_field('image'),
+            self.image.image.name
+        )
+        self.assertEqual(field_file.move_files(''), name)
+        field_file.delete_files()
+
+
+class TestGalleryImageFieldFileHashedNames(ImageTestCase):
+    """
+    Tests for GalleryImageFieldFile using immutable names containing
+    the hash of the content. Inherits a TestModel object and an image
+    related to that, The image is unique per test. Files are saved into
+    the in-memory storage and callbacks of transactions are called
+    immediately since the test case never commits transactions.
+    """
+
+    def setUp(self):
+        """
+        Creates the image with the content hash in the name
+        """
+        self.storage = InMemoryStorage()
+        field = models.Image._meta.get_field('image')
+        self.patchers = [
+            mock.patch.object(field, 'storage', self.storage),
+            mock.patch.object(
+                utils.transaction,
+                'on_commit',
+                side_effect=lambda func, using=None: func()
+            ),
+            patch_settings({'hashed_names': True}),
+        ]
+        for patcher in self.patchers:
+            patcher.__enter__()
+        super().setUp()
+
+    def tearDown(self):
+        """
+        Removes the image and restores the settings and the storage
+        """
+        super().tearDown()
+        for patcher in reversed(self.patchers):
+            patcher.__exit__(None, None, None)
+
+    @staticmethod
+    def get_another_image():
+        """
+        Returns the uploaded image that differs from the default one
+        """
+        io = BytesIO()
+        Image.new("RGB", (200, 200), (0, 0, 255)).save(io, format='JPEG')
+        io.seek(0)
+        return InMemoryUploadedFile(io, None, 'bar.jpg', 'jpeg', 0, None)
+
+    def test_files(self):
+        """
+        Checks whether names of files contain the hash of the content
+        and names of variants contain fingerprints of settings
+        """
+        field_file = self.get_image().image
+        data = get_image_data().read()
+        slug = 'foo-' + utils.create_content_hash([data])
+        self.assertEqual(field_file.name, utils.name_in_db(slug + '.jpg'))
+        self.assertEqual(
+            field_file.thumbnail.filename,
+            '{}_thumbnail-{}.jpg'.format(
+                slug,
+                field_file.thumbnail.fingerprint
+            )
+        )
+        self.assertEqual(
+            sorted(self.storage.files),
+            sorted(field_file.get_storage_names()[:1] + [
+                v.storage_name for v in field_file.variants.values()
+            ])
+        )
+
+    def test_upload_new_image(self):
+        """
+        Checks whether files of the former image are deleted
+        when the new image has been uploaded
+        """
+        image = self.get_image()
+        former_names = set(self.storage.files)
+        image.image = self.get_another_image()
+        image.save()
+        image = self.get_image()
+        self.assertTrue(re.match(
+            r'^foo-[0-9a-f]{12}$',
+            utils.get_name(os.path.basename(image.image.name))
+        ))
+        self.assertEqual(former_names & set(self.storage.files), set())
+        self.assertTrue(image.image.thumbnail.exists())
+
+    def test_object_changed(self):
+        """
+        Checks whether files are not renamed if the related
+        object has been changed
+        """
+        another_object = TestModel.objects.create(name="AnotherObject")
+        image = self.get_image()
+        names = sorted(self.storage.files)
+        image.object_id = another_object.pk
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            image.save()
+        self.assertEqual(sorted(self.storage.files), names)
+        image.delete_files()
+        another_object.delete()
+
+    def test_regenerate_files(self):
+        """
+        Checks whether files created with new settings get new
+        names and replaced files are deleted
+        """
+        with patch_settings({'hashed_names': True, 'thumbnail_width': 50}):
+            # stored fingerprints are used in names of existing files
+            field_file = self.get_image().image
+            former_name = field_file.thumbnail.storage_name
+            field_file.regenerate_files(['image', 'thumbnail'])
+        self.assertNotEqual(field_file.thumbnail.storage_name, former_name)
+        self.assertNotIn(former_name, self.storage.files)
+        self.assertTrue(field_file.thumbnail.exists())
+
+    def test_from_row(self):
+        """
+        Checks whether the field file built from the name and stored
+        fingerprints in the JSON string or in the dict has the same
+        names of files as the field file of the Image object
+        """
+        image = self.get_image()
+        names = image.image.get_storage_names()
+        field = models.Image._meta.get_field('image')
+        with patch_settings({'hashed_names': True, 'thumbnail_width': 50}):
+            for fingerprints in (image.fingerprints, image.get_fingerprints()):
+                field_file = fields.GalleryImageFieldFile.from_row(
+                    field,
+                    image.image.name,
+                    fingerprints
+                )
+                self.assertEqual(field_file.get_storage_names(), names)
+        # actual settings are used if there are no fingerprints
+        field_file = fields.GalleryImageFieldFile.from_row(
+            field,
+            image.image.name,
+            ''
+        )
+        self.assertEqual(field_file.get_storage_names(), names)
+
+
+class TestGalleryImageFieldFileIdenticalVariants(ImageTestCase):
+    """
+    Tests for GalleryImageFieldFile creating pixel-identical files
+    of variants. The uploaded image (200x200) is smaller than the preview
+    and the small image, so they are the same. Inherits a TestModel
+    object and an image related to that, The image is unique per test
+    """
+
+    def test_hard_link(self):
+        """
+        Checks whether the files are hard linked
+        and the image is encoded once
+        """
+        field_file = self.get_image().image
+        self.assertTrue(os.path.samefile(
+            field_file.preview.path,
+            field_file.small_image.path
+        ))
+        self.assertFalse(os.path.samefile(
+            field_file.preview.path,
+            field_file.thumbnail.path
+        ))
+
+    def test_encoded_once(self):
+        """
+        Checks whether the image is resized once for identical files
+        """
+        image = self.get_image()
+        image.image = get_image_in_memory_data()
+        with mock.patch.object(
+            utils,
+            'image_resize',
+            wraps=utils.image_resize
+        ) as image_resize:
+            image.save()
+        # the full-size image, the thumbnail, the small preview
+        # and the only one for the preview and the small image
+        self.assertEqual(image_resize.call_count, 4)
+
+    def test_delete_linked_file(self):
+        """
+        Checks whether deleting the file keeps the linked one
+        """
+        field_file = self.get_image().image
+        field_file.preview.delete()
+        self.assertTrue(os.path.isfile(field_file.small_image.path))
+
+
+class TestGalleryImageFieldLimits(ImageTestCase):
+    """
+    Tests for limits of uploaded images. Inherits a TestModel
+    object and an image related to that, The image is unique per test
+    """
+
+    def test_validation(self):
+        """
+        Checks whether the image with too many pixels is rejected
+        by the validation and stored images are not checked
+        """
+        image = self.get_image()
+        with patch_settings({'max_upload_pixels': 100}):
+            image.full_clean()
+            image.image = get_image_in_memory_data()
+            with self.assertRaises(ValidationError) as cm:
+                image.full_clean()
+        self.assertIn('image', cm.exception.message_dict)
+
+    def test_save_files(self):
+        """
+        Checks whether the large image is not saved
+        """
+        image = self.get_image()
+        image.image = get_image_in_memory_data()
+        with patch_settings({'max_upload_bytes': 100}), mock.patch.object(
+            utils,
+            'image_resize'
+        ) as image_resize:
+            with self.assertRaises(ValidationError):
+                image.save()
+        image_resize.assert_not_called()
+
+    def test_spooled_upload(self):
+        """
+        Checks whether files are created using the spooled upload
+        """
+        with patch_settings({'spool_max_memory_size': 0}), \
+                mock.patch.object(
+                    utils.SpooledUpload,
+                    'close',
+                    autospec=True,
+                    side_effect=utils.SpooledUpload.close
+                ) as close:
+            image = self.get_image()
+            image.image = get_image_in_memory_data()
+            image.save()
+        self.assertTrue(os.path.isfile(image.image.thumbnail.path))
+        upload = close.call_args[0][0]
+        self.assertIsNone(upload.data)
+        self.assertFalse(os.path.exists(upload.path))
+
+    def test_upload_spooled_once(self):
+        """
+        Checks whether the upload is read once to hash
+        the content and to create files
+        """
+        image = self.get_image()
+        image.image = get_image_in_memory_data()
+        with mock.patch.object(
+            utils,
+            'SpooledUpload',
+            wraps=utils.SpooledUpload
+        ) as spooled_upload, mock.patch.object(
+            utils,
+            'create_content_hash',
+            wraps=utils.create_content_hash
+        ) as create_content_hash:
+            image.save()
+        self.assertEqual(spooled_upload.call_count, 1)
+        # the hash calculated while spooling is used
+        create_content_hash.assert_not_called()
+        image = self.get_image()
+        self.assertEqual(len(image.content_hash), 64)
+        self.assertTrue(os.path.isfile(image.image.thumbnail.path))
@@ -5,12 +5,13 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django import forms as django_forms
 from django.conf import settings as django_settings
+from django.contrib.contenttypes.forms import generic_inlineformset_factory
 
 from .. import forms
 from .. import models
 
-from .models import TestModel
-from .utils import get_image_in_memory_data, create_image_file
+from .models import TestModel, SummaryTestModel
+from .utils import get_image_in_memory_data, create_image_file, clean_db
 
 class TestImageAdminForm(TestCase):
     """
@@ -299,3 +300,66 @@ class TestImageAdminForm(TestCase):
             self.form.fields['object_id'].widget.model_class,
             TestModel
         )
+
+
+class TestImageAdminInlineFormSet(TestCase):
+    """
+    Tests the formset of the Image admin inline
+    """
+
+    def setUp(self):
+        """
+        Creates the object with two images
+        """
+        self.object = SummaryTestModel.objects.create(name="Summary")
+        self.images = []
+        for name in ('bar.jpg', 'baz.jpg'):
+            upload = get_image_in_memory_data()
+            upload.name = name
+            self.images.append(models.Image.objects.create(
+                image=upload,
+                content_object=self.object
+            ))
+
+    def tearDown(self):
+        """
+        Removes images and the object
+        """
+        models.Image.objects.all().delete()
+        clean_db()
+
+    def test_reorder(self):
+        """
+        Checks whether images are reordered refreshing
+        the summary of the object once
+        """
+        FormSet = generic_inlineformset_factory(
+            models.Image,
+            form=forms.ImageAdminInlineForm,
+            formset=forms.ImageAdminInlineFormSet,
+            fields=('position',),
+            extra=0
+        )
+        prefix = FormSet.get_default_prefix()
+        data = {
+            prefix + '-TOTAL_FORMS': '2',
+            prefix + '-INITIAL_FORMS': '2',
+        }
+        # swap positions of images
+        for i, image in enumerate(self.images):
+            data['{}-{}-id'.format(prefix, i)] = str(image.pk)
+            data['{}-{}-position'.format(prefix, i)] = str(1 - i)
+        formset = FormSet(data, instance=self.object)
+        self.assertTrue(formset.is_valid())
+        refresh = models.GallerySummary.objects.refresh
+        with mock.patch.object(
+            models.GallerySummary.objects,
+            'refresh',
+            side_effect=refresh
+        ) as mock_refresh:
+            formset.save()
+        ctype = ContentType.objects.get_for_model(SummaryTestModel)
+        mock_refresh.assert_called_once_with([(ctype.pk, self.object.pk)])
+        summary = models.GallerySummary.objects.get()
+        self.assertEqual(summary.cover_pk, self.images[1].pk)
+        self.assertEqual(summary.image_count, 2)
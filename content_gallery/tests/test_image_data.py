@@ -1,4 +1,7 @@
+from io import BytesIO
+
 from django.test import mock, TestCase
+from django.core.files.base import File
 
 from .. import image_data
 from .. import utils
@@ -18,6 +21,11 @@ class TestImageFile(MockImageTestCase):
         """
         super().setUp()
         self.image_file = mock.MagicMock(spec=image_data.ImageFile)
+        # use the format of uploaded image and create it immediately
+        self.image_file.format = None
+        self.image_file.quality = None
+        self.image_file.lazy = False
+        self.image_file.version = None
 
     def test_init(self):
         """
@@ -119,6 +127,7 @@ class TestImageFile(MockImageTestCase):
         """
         # set a name
         self.image_file.filename = 'bar'
+        self.image_file.shard = ''
         # patch the helper function
         with mock.patch.object(
             utils,
@@ -133,31 +142,46 @@ class TestImageFile(MockImageTestCase):
             )
             # check whether the helper function has been called
             # with the name as an argument
-            create_path.assert_called_with('bar')
+            create_path.assert_called_with('bar', '')
 
     def test_url_property(self):
         """
-        Checks whether the url property returns a result of
-        the utils.create_url helper function called with
-        the name as an argument
+        Checks whether the url property returns the URL
+        of the file in the storage
+        """
+        # set a name and the storage
+        self.image_file.storage_name = 'gallery/bar.jpg'
+        self.image_file.storage = self.image.storage
+        # check whether the property returns the URL from the storage
+        self.assertEqual(
+            image_data.ImageFile.url.fget(self.image_file),
+            '/storage/gallery/bar.jpg'
+        )
+
+    def test_storage_name_property(self):
+        """
+        Checks whether the storage_name property returns a result
+        of the utils.name_in_db helper function called with
+        the file name as an argument
         """
         # set a name
-        self.image_file.filename = 'bar'
+        self.image_file.filename = 'bar.jpg'
+        self.image_file.shard = ''
         # patch the helper function
         with mock.patch.object(
             utils,
-            'create_url',
-            return_value='foo'
-        ) as create_url:
-            # check whether the property returns a result of 
+            'name_in_db',
+            return_value='gallery/bar.jpg'
+        ) as name_in_db:
+            # check whether the property returns a result of
             # the helper function
             self.assertEqual(
-                image_data.ImageFile.url.fget(self.image_file),
-                'foo'
+                image_data.ImageFile.storage_name.fget(self.image_file),
+                'gallery/bar.jpg'
             )
             # check whether the helper function has been called
-            # with the name as an argument
-            create_url.assert_called_with('bar')
+            # with the file name as an argument
+            name_in_db.assert_called_with('bar.jpg', '')
 
     def test_change_ext(self):
         """
@@ -289,8 +313,8 @@ class TestImageFile(MockImageTestCase):
         # and the old ext
         self.assertEqual(self.image_file.name, 'bar.jpg')
         # check whether the _rename_files method has been called
-        # with the new name
-        self.image_file._rename_file.assert_called_with('bar.jpg')
+        # with the new name and the subdirectory
+        self.image_file._rename_file.assert_called_with('bar.jpg', '')
         # check whether the delete, _change+_ext and _create_image methods
         # have not been called
         self.image_file.delete.assert_not_called()
@@ -343,84 +367,162 @@ class TestImageFile(MockImageTestCase):
         self.image_file._rename_file.assert_not_called()
         self.image_file._change_ext.assert_not_called()
 
-    @mock.patch('os.rename')
-    def test_rename_file(self, rename):
+    def test_rename_file(self):
         """
-        Checks whether the _rename_file method calls the os.rename
-        function with proper arguments
+        Checks whether the _rename_file method moves
+        the file to the new name in the storage
         """
-        # a mock function to replace the _create_filename method
-        mock_func = mock.MagicMock(return_value='baz_bar.jpg')
-        self.image_file._create_filename = mock_func
-        # set original path
-        self.image_file.path = 'gallery/foo_bar.jpg'
-        # patch the create_path helper function to return a new path
-        with mock.patch.object(
-            utils,
-            'create_path', 
-            return_value='gallery/baz_bar.jpg'
-        ) as create_path:
-            # call the _rename_files method with a new file name
-            image_data.ImageFile._rename_file(self.image_file, 'baz.jpg')
-            # check whether the helper function has been called
-            # with the result of the _create_filename method
-            create_path.assert_called_with('baz_bar.jpg')
-        # check whether the mock _create_filename method has been called
-        # with the new file name
-        mock_func.assert_called_with('baz.jpg')
-        # check whether the os.rename function has been called
-        # with the original and the new paths
-        rename.assert_called_with(
-            'gallery/foo_bar.jpg',
-            'gallery/baz_bar.jpg'
+        image_file = image_data.ImageFile(self.image, 100, 50, 'bar')
+        storage = self.image.storage
+        storage.files[utils.name_in_db('foo_bar.jpg')] = b'data'
+        # call the _rename_files method with a new file name
+        image_file._rename_file('baz.jpg')
+        # check whether the file has been moved
+        self.assertEqual(
+            storage.files,
+            {utils.name_in_db('baz_bar.jpg'): b'data'}
         )
 
-    @mock.patch('os.remove')
-    def test_delete_existing_file(self, remove):
+    def test_delete_existing_file(self):
         """
-        Checks whether the delete method calls the os.remove
-        function with proper argument
+        Checks whether the delete method deletes
+        the file from the storage
         """
-        # set image path
-        self.image_file.path = 'foo.jpg'
+        image_file = image_data.ImageFile(self.image, 100, 50, 'bar')
+        self.image.storage.files[utils.name_in_db('foo_bar.jpg')] = b'data'
         # call the delete method
-        image_data.ImageFile.delete(self.image_file)
-        # check whether the os.remove function has been
-        # called with the image path
-        remove.assert_called_with('foo.jpg')
+        image_file.delete()
+        # check whether the file has been deleted
+        self.assertEqual(self.image.storage.files, {})
 
-    @mock.patch('os.remove', side_effect=FileNotFoundError)
-    def test_delete_not_existing_file(self, remove):
+    def test_delete_not_existing_file(self):
         """
-        Checks whether the delete method calls the os.remove
-        function with proper argument and does not raises an
-        exception if the file does not exist (os.remove raises
-        the FileNotFoundError exception)
+        Checks whether the delete method does not raises
+        an exception if the file does not exist
         """
-        # set image path
-        self.image_file.path = 'foo.jpg'
+        image_file = image_data.ImageFile(self.image, 100, 50, 'bar')
         # call the delete method
-        image_data.ImageFile.delete(self.image_file)
-        # check whether the os.remove function has been
-        # called with the image path and no exception
-        # has been raised
-        remove.assert_called_with('foo.jpg')
+        image_file.delete()
 
     def test_create_image(self):
         """
         Checks whether the _create_image method calls the utils.image_resize
-        helper function with proper arguments
+        helper function with proper arguments and saves the resized image
+        into the storage
         """
-        # set a path and size of the image
-        self.image_file.path = 'foo.jpg'
+        # set a name and size of the image
+        self.image_file.storage = self.image.storage
+        self.image_file.storage_name = 'gallery/foo.jpg'
         self.image_file.size = (100, 50)
+        self.image_file._render.side_effect = (
+            lambda image: image_data.ImageFile._render(self.image_file, image)
+        )
+        # the helper function writes the resized image data
+        def image_resize(src, dst, *args):
+            dst.write(b'data')
         # patch the helper function
-        with mock.patch.object(utils, 'image_resize') as image_resize:
+        with mock.patch.object(
+            utils,
+            'image_resize',
+            side_effect=image_resize
+        ) as image_resize:
             # call the _create_image method with the image
             image_data.ImageFile._create_image(self.image_file, self.image)
             # check whether the helper function has been called
-            # with the image and its path and size
-            image_resize.assert_called_with(self.image, 'foo.jpg', (100, 50))
+            # with the image and its size
+            image_resize.assert_called_with(
+                self.image,
+                mock.ANY,
+                (100, 50),
+                None,
+                None
+            )
+        # check whether the data has been saved into the storage
+        self.assertEqual(
+            self.image.storage.files,
+            {'gallery/foo.jpg': b'data'}
+        )
+
+    def test_render_key(self):
+        """
+        Checks whether the key contains the size of the source
+        if the source is not resized and the size of the image otherwise
+        """
+        self.image_file.size = (100, 50)
+        self.assertEqual(
+            image_data.ImageFile.get_render_key(
+                self.image_file,
+                (80, 40),
+                'JPEG'
+            ),
+            ((80, 40), 'JPEG', None)
+        )
+        self.image_file.format = 'WEBP'
+        self.assertEqual(
+            image_data.ImageFile.get_render_key(
+                self.image_file,
+                (80, 60),
+                'JPEG'
+            ),
+            ((100, 50), 'WEBP', None)
+        )
+
+    def test_create_filename_with_format(self):
+        """
+        Checks whether the _create_filename method replaces the ext
+        if the format of the image is specified
+        """
+        # set a suffix and a format
+        self.image_file.suffix = 'bar'
+        self.image_file.format = 'WEBP'
+        # call _create_filename
+        name = image_data.ImageFile._create_filename(
+            self.image_file,
+            'foo.jpg'
+        )
+        # check whether the ext matches the format
+        self.assertEqual(name, 'foo_bar.webp')
+
+    def test_save_lazy_image(self):
+        """
+        Checks whether the save method does not create
+        the image if it's created later
+        """
+        # set a name of uploaded image (the image has been uploaded)
+        self.image.name = 'foo.jpg'
+        self.image_file.name = self.image.name
+        self.image_file.lazy = True
+        # call the save method with a slug and without old name
+        image_data.ImageFile.save(self.image_file, self.image, 'bar', '')
+        # check whether the image has not been created
+        self.image_file._create_image.assert_not_called()
+
+    def test_rename_missing_file(self):
+        """
+        Checks whether the _rename_file method does not raise
+        an exception if the file of the variant does not exist
+        """
+        image_file = image_data.ImageFile(self.image, 100, 50, 'bar')
+        image_file._rename_file('baz.jpg')
+
+    def test_save_not_required_image(self):
+        """
+        Checks whether the save method does not create
+        the image if it's not required
+        """
+        # set a name of uploaded image (the image has been uploaded)
+        self.image.name = 'foo.jpg'
+        self.image_file.name = self.image.name
+        # call the save method with a slug and without old name
+        image_data.ImageFile.save(
+            self.image_file,
+            self.image,
+            'bar',
+            '',
+            False
+        )
+        # check whether the image has not been created
+        self.image_file._create_image.assert_not_called()
 
 
 class TestInMemoryImageData(MockImageTestCase):
@@ -517,6 +619,7 @@ class TestInMemoryImageData(MockImageTestCase):
         """
         # set a name
         self.memory_data.name = 'foo.jpg'
+        self.memory_data.shard = ''
         # patch the helper function
         with mock.patch.object(
             utils,
@@ -528,7 +631,36 @@ class TestInMemoryImageData(MockImageTestCase):
                 self.memory_data
             )
             # check whether the helper function has been called with the name
-            name_in_db.assert_called_with('foo.jpg')
+            name_in_db.assert_called_with('foo.jpg', '')
         # check whether the result equels with returned value
         # of the helper function
         self.assertEqual(name, 'gallery/foo.jpg')
+
+    def test_rename_missing_file(self):
+        """
+        Checks whether the _rename_file method raises an exception
+        if the full-size image file does not exist
+        """
+        memory_data = image_data.InMemoryImageData(self.image, 100, 50)
+        with self.assertRaises(FileNotFoundError):
+            memory_data._rename_file('baz.jpg')
+
+
+class TestOriginalImageFile(MockImageTestCase):
+    """
+    Tests for the OriginalImageFile. Inherited methods from the BaseImageData
+    are tested in the TestImageFile class.
+    """
+
+    def test_create_image(self):
+        """
+        Checks whether the uploaded data is saved
+        into the storage without changes
+        """
+        original = image_data.OriginalImageFile(self.image)
+        uploaded = File(BytesIO(b'data'), 'foo.jpg')
+        original._create_image(uploaded)
+        self.assertEqual(
+            self.image.storage.files,
+            {utils.name_in_db('foo_original.jpg'): b'data'}
+        )
@@ -1,12 +1,24 @@
+import os
+import datetime
+from io import BytesIO
+
 from django.test import mock, TestCase
+from django.db import transaction
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.utils import timezone
 
 from .. import models
 from .. import utils
 
 from .models import *
 from .base_test_cases import *
-from .utils import get_image_in_memory_data
+from .utils import (
+    get_image_in_memory_data,
+    patch_settings,
+    clean_db,
+    create_image_file
+)
 
 
 class TestUniqueSlugCheck(ImageTestCase):
@@ -34,7 +46,7 @@ class TestUniqueSlugCheck(ImageTestCase):
             self.assertFalse(result)
             # check whether the helper function has been called
             # with first argument passed into the _unique_slug_check
-            name_in_db.assert_called_once_with("foo.jpg")
+            name_in_db.assert_called_once_with("foo.jpg", "")
 
     def test_name_does_not_exisit(self):
         """
@@ -51,7 +63,208 @@ class TestUniqueSlugCheck(ImageTestCase):
         ) as name_in_db:
             result = models._unique_slug_check("bar.jpg", [])
             self.assertTrue(result)
-            name_in_db.assert_called_once_with("bar.jpg")
+            name_in_db.assert_called_once_with("bar.jpg", "")
+
+
+class TestCreateUniqueSlugs(ImageTestCase):
+    """
+    Tests for the create_unique_slugs function. Inherits
+    a TestModel object and the 'foo.jpg' image related to that
+    """
+
+    def test_taken_slug(self):
+        """
+        Checks whether slugs of existing images are skipped
+        and returned slugs differ from each other
+        """
+        self.assertEqual(
+            models.create_unique_slugs('Foo', 3),
+            ['foo-1', 'foo-2', 'foo-3']
+        )
+
+    def test_free_slug(self):
+        """
+        Checks whether the slug without the number is returned first
+        """
+        self.assertEqual(
+            models.create_unique_slugs('Bar', 2),
+            ['bar', 'bar-1']
+        )
+
+
+class TestImageBulkCreate(ImageTestCase):
+    """
+    Tests for creating images of many uploads at once. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def tearDown(self):
+        """
+        Removes created images
+        """
+        for image in models.Image.objects.exclude(pk=self.image.pk):
+            image.delete()
+        super().tearDown()
+
+    def get_upload(self, name):
+        """
+        Returns the uploaded image with given name
+        """
+        upload = get_image_in_memory_data()
+        upload.name = name
+        return upload
+
+    def test_create_bulk(self):
+        """
+        Checks whether images get successive positions and unique
+        slugs, and files of variants are created
+        """
+        uploads = [self.get_upload('bar.jpg'), self.get_upload('baz.jpg')]
+        results = models.Image.objects.create_bulk(self.object, uploads)
+        images = [image for image, error in results]
+        self.assertEqual([error for image, error in results], [None, None])
+        self.assertEqual([image.position for image in images], [1, 2])
+        self.assertEqual(
+            [image.image.name for image in images],
+            [
+                self.get_name('testobject.jpg'),
+                self.get_name('testobject-1.jpg')
+            ]
+        )
+        for image in images:
+            image = models.Image.objects.get(pk=image.pk)
+            self.assertTrue(os.path.isfile(image.image.thumbnail.path))
+            self.assertEqual(image.get_stale_variants(), [])
+
+    def test_broken_upload(self):
+        """
+        Checks whether the error is returned for the broken file
+        and other images are created without gaps between positions
+        """
+        broken = self.get_upload('bar.jpg')
+        broken.file = BytesIO(b'foo')
+        uploads = [broken, self.get_upload('baz.jpg')]
+        with patch_settings({'bulk_upload_workers': 1}):
+            results = models.Image.objects.create_bulk(self.object, uploads)
+        self.assertIsNone(results[0][0])
+        self.assertTrue(results[0][1])
+        self.assertEqual(results[1][0].position, 1)
+        self.assertEqual(models.Image.objects.count(), 2)
+
+
+class TestGalleryObjectDelete(TestCase):
+    """
+    Tests for removing files of images when the related object is
+    deleted. Callbacks of transactions are collected and called after
+    the deletion since the test case never commits transactions.
+    """
+
+    def setUp(self):
+        """
+        Creates the object with many images
+        """
+        clean_db()
+        self.object = TestModel.objects.create(name="Deleted")
+        uploads = []
+        for i in range(10):
+            upload = get_image_in_memory_data()
+            upload.name = 'bar{}.jpg'.format(i)
+            uploads.append(upload)
+        results = models.Image.objects.create_bulk(self.object, uploads)
+        self.images = [
+            models.Image.objects.get(pk=image.pk) for image, error in results
+        ]
+        self.callbacks = []
+
+    def tearDown(self):
+        """
+        Removes remaining images and objects
+        """
+        # images are deleted first since callbacks
+        # of the deleted objects are never called
+        models.Image.objects.all().delete()
+        clean_db()
+
+    def get_files(self):
+        """
+        Returns paths to files of all images
+        """
+        storage = self.images[0].image.storage
+        return [
+            storage.path(name)
+            for image in self.images
+            for name in image.image.get_storage_names()
+        ]
+
+    def delete_object(self, obj):
+        """
+        Deletes the object collecting callbacks of the transaction
+        """
+        with mock.patch.object(
+            models.transaction,
+            'on_commit',
+            side_effect=lambda func, using=None: self.callbacks.append(func)
+        ):
+            obj.delete()
+
+    def commit(self):
+        """
+        Calls collected callbacks like the commit does
+        """
+        for callback in self.callbacks:
+            callback()
+
+    def test_files_removed(self):
+        """
+        Checks whether files of all images are removed after the commit
+        """
+        files = [path for path in self.get_files() if os.path.isfile(path)]
+        self.assertEqual(len(files), 50)
+        self.delete_object(self.object)
+        self.assertFalse(models.Image.objects.exists())
+        # files are kept until the deletion is committed
+        self.assertEqual(len(self.callbacks), 1)
+        self.assertTrue(all(os.path.isfile(path) for path in files))
+        self.commit()
+        self.assertFalse(any(os.path.isfile(path) for path in files))
+
+    def test_shared_files_kept(self):
+        """
+        Checks whether files shared with an image
+        of another object are not removed
+        """
+        another = TestModel.objects.create(name="Another")
+        upload = get_image_in_memory_data()
+        upload.name = 'baz.jpg'
+        with patch_settings({'deduplicate': True}):
+            results = models.Image.objects.create_bulk(another, [upload])
+        shared = models.Image.objects.get(pk=results[0][0].pk)
+        self.assertEqual(shared.image.name, self.images[0].image.name)
+        self.delete_object(self.object)
+        self.commit()
+        self.assertTrue(os.path.isfile(shared.image.path))
+        self.assertTrue(os.path.isfile(shared.image.thumbnail.path))
+        self.assertFalse(os.path.isfile(self.images[1].image.path))
+
+    def test_no_images(self):
+        """
+        Checks whether nothing is scheduled for the object without images
+        """
+        obj = TestModel.objects.create(name="Empty")
+        self.delete_object(obj)
+        self.assertEqual(self.callbacks, [])
+
+    def test_connected_models(self):
+        """
+        Checks whether the handler is connected to models using
+        the ContentGalleryMixin only, so images are still fast deleted
+        """
+        pre_delete = models.models.signals.pre_delete
+        self.assertTrue(pre_delete.has_listeners(TestModel))
+        self.assertTrue(pre_delete.has_listeners(ThumbnailTestModel))
+        self.assertFalse(pre_delete.has_listeners(WrongTestModel))
+        self.assertFalse(pre_delete.has_listeners(models.Image))
 
 
 class TestImage(MultipleObjectsImageTestCase):
@@ -226,7 +439,11 @@ class TestImage(MultipleObjectsImageTestCase):
         image._get_position.assert_called_once_with()
         # check whether the save_files method of the image field
         # has been called with the slug and the name of the image
-        image.image.save_files.assert_called_once_with('foo', 'foo.jpg')
+        image.image.save_files.assert_called_once_with(
+            'foo',
+            'foo.jpg',
+            image.get_variant_names()
+        )
 
     def test_save_data_unchanged_image(self):
         """
@@ -248,7 +465,11 @@ class TestImage(MultipleObjectsImageTestCase):
         name = self.get_name('foo.jpg')
         # check whether the save_files method of the image field
         # has been called with empty slug and the name of the image
-        self.image.image.save_files.assert_called_once_with('', name)
+        self.image.image.save_files.assert_called_once_with(
+            '',
+            name,
+            self.image.get_variant_names()
+        )
 
     def test_save_data_changed_image(self):
         """
@@ -271,7 +492,11 @@ class TestImage(MultipleObjectsImageTestCase):
         name = self.get_name('foo.jpg')
         # check whether the save_files method of the image field
         # has been called with a new slug and the name of the image
-        self.image.image.save_files.assert_called_once_with('foo', name)
+        self.image.image.save_files.assert_called_once_with(
+            'foo',
+            name,
+            self.image.get_variant_names()
+        )
 
     def test_delete_files_image(self):
         """
@@ -364,23 +589,909 @@ class TestImageQuerySet(TestCase):
 
     def test_delete(self):
         """
-        Tests whether the delete method calls the delete_files
-        methods of all contained objects
+        Tests whether the delete method deletes images by chunks
+        and returns the result in the format of the parent's method
         """
-        # create two mock objects
-        obj1 = mock.MagicMock()
-        obj2 = mock.MagicMock()
         # create a mock query set object
         query_set = mock.MagicMock(spec=models.ImageQuerySet)
-        # the query set iteration yields objects created before
-        query_set.__iter__.return_value = [obj1, obj2]
-        # patch the delete method of the parent class
-        with mock.patch('django.db.models.QuerySet.delete') as delete:
-            # call the delete method
-            models.ImageQuerySet.delete(query_set)
-            # check whether the parent's delete method has been called
-            delete.assert_called_with()
-        # check whether the delete_files methods
-        # of both objects have been called
-        obj1.delete_files.assert_called_with()
-        obj2.delete_files.assert_called_with()
+        query_set.model = models.Image
+        # two images and their ten files have been deleted
+        query_set.delete_chunked.return_value = (2, 10)
+        result = models.ImageQuerySet.delete(query_set)
+        query_set.delete_chunked.assert_called_once_with()
+        self.assertEqual(result, (2, {'content_gallery.Image': 2}))
+
+
+class TestImageQuerySetDeleteChunked(ImageTestCase):
+    """
+    Tests for the delete_chunked method of ImageQuerySet.
+    Inherits a TestModel object and an image related to that,
+    the second image is created for each test
+    """
+
+    def setUp(self):
+        """
+        Creates the second image
+        """
+        super().setUp()
+        upload = get_image_in_memory_data()
+        # the upload with the name of the first image replaces its files
+        upload.name = 'bar.jpg'
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            self.another = models.Image.objects.create(
+                image=upload,
+                content_type=ContentType.objects.get_for_model(TestModel),
+                object_id=self.object.id
+            )
+        self.another = models.Image.objects.get(pk=self.another.pk)
+
+    def tearDown(self):
+        """
+        Removes remaining images
+        """
+        models.Image.objects.all().delete()
+
+    def get_existing_files(self, image):
+        """
+        Returns names of existing files of the image in the storage
+        """
+        storage = image.image.storage
+        return [
+            name for name in image.image.get_storage_names()
+            if storage.exists(name)
+        ]
+
+    def test_delete_all(self):
+        """
+        Checks whether all images and their files are deleted
+        by chunks and the number of removed files is returned
+        """
+        files = self.get_existing_files(self.image)
+        files += self.get_existing_files(self.another)
+        result = models.Image.objects.all().delete_chunked(chunk_size=1)
+        self.assertEqual(result, (2, len(files)))
+        self.assertFalse(models.Image.objects.exists())
+        storage = self.image.image.storage
+        for name in files:
+            self.assertFalse(storage.exists(name))
+
+    def test_delete_filtered(self):
+        """
+        Checks whether files of images out of the queryset are kept
+        """
+        result = models.Image.objects.filter(
+            pk=self.another.pk
+        ).delete_chunked()
+        self.assertEqual(result[0], 1)
+        self.assertTrue(models.Image.objects.filter(pk=self.image.pk))
+        self.assertTrue(os.path.isfile(self.image.image.path))
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertFalse(os.path.isfile(self.another.image.path))
+
+    def test_no_instances(self):
+        """
+        Checks whether Image instances are not created while deleting
+        """
+        with mock.patch.object(models.Image, '__init__') as init:
+            models.Image.objects.all().delete_chunked()
+        init.assert_not_called()
+
+    def test_missing_files(self):
+        """
+        Checks whether missing files are not counted
+        """
+        files = self.get_existing_files(self.another)
+        self.image.image.delete_files()
+        result = models.Image.objects.all().delete_chunked()
+        self.assertEqual(result, (2, len(files)))
+
+    def test_empty(self):
+        """
+        Checks whether nothing is deleted if the queryset is empty
+        """
+        result = models.Image.objects.none().delete_chunked()
+        self.assertEqual(result, (0, 0))
+        self.assertEqual(models.Image.objects.count(), 2)
+
+
+class TestImageFingerprints(ImageTestCase):
+    """
+    Tests for fingerprints of settings used to create image files.
+    Inherits a TestModel object and an image related to that,
+    the image is unique per test
+    """
+
+    def test_fingerprints_saved(self):
+        """
+        Checks whether fingerprints are stored while creating the image
+        """
+        self.assertEqual(
+            self.image.get_fingerprints(),
+            self.image.image.get_fingerprints()
+        )
+
+    def test_no_stale_variants(self):
+        """
+        Checks whether there are no stale variants if
+        settings have not been changed
+        """
+        self.assertEqual(self.image.get_stale_variants(), [])
+
+    def test_stale_variants(self):
+        """
+        Checks whether the variant is stale if its size has been changed
+        """
+        with patch_settings({'thumbnail_width': 50}):
+            # load the image again to use patched settings
+            image = self.get_image()
+            self.assertEqual(image.get_stale_variants(), ['thumbnail'])
+
+    def test_unknown_fingerprints(self):
+        """
+        Checks whether all variants are stale if
+        fingerprints are unknown
+        """
+        self.image.fingerprints = ''
+        self.assertEqual(
+            self.image.get_stale_variants(),
+            list(self.image.image.variants)
+        )
+
+
+class TestImageFileSizes(ImageTestCase):
+    """
+    Tests for sizes of image files stored in the database.
+    Inherits a TestModel object and an image related to that,
+    the image is unique per test
+    """
+
+    def get_sizes(self, image):
+        """
+        Returns a dict of sizes of existing files of the image
+        """
+        field_file = image.image
+        image_files = [('image', field_file.image_data)]
+        image_files.extend(field_file.variants.items())
+        return {
+            name: os.path.getsize(image_file.path)
+            for name, image_file in image_files
+        }
+
+    def test_sizes_saved(self):
+        """
+        Checks whether sizes of all files are stored while creating
+        the image and the total size is their sum
+        """
+        sizes = self.get_sizes(self.image)
+        self.assertEqual(self.image.get_file_sizes(), sizes)
+        self.assertEqual(self.image.total_bytes, sum(sizes.values()))
+
+    def test_lazy_variant(self):
+        """
+        Checks whether files of lazy variants are not counted
+        """
+        variants = [
+            {'name': 'thumbnail', 'width': 20, 'height': 20, 'lazy': True},
+        ]
+        with patch_settings({'variants': variants}):
+            self.image.image = get_image_in_memory_data()
+            self.image.save()
+            self.assertEqual(
+                list(self.image.get_file_sizes()),
+                ['image']
+            )
+
+    def test_shared_files(self):
+        """
+        Checks whether the image sharing files gets their sizes
+        """
+        with patch_settings({'deduplicate': True}):
+            duplicate = models.Image.objects.create(
+                image=get_image_in_memory_data(),
+                content_type=self.image.content_type,
+                object_id=self.object.pk
+            )
+        self.assertEqual(duplicate.total_bytes, self.image.total_bytes)
+        models.Image.objects.filter(pk=duplicate.pk).delete()
+
+    def test_unknown_sizes(self):
+        """
+        Checks whether the dict of sizes is empty if sizes are unknown
+        """
+        self.image.file_sizes = ''
+        self.assertEqual(self.image.get_file_sizes(), {})
+
+
+class TestContentGalleryQuerySet(ImageTestCase):
+    """
+    Tests for the disk usage accounting of objects.
+    Inherits a TestModel object and an image related to that,
+    the image is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates another object without images
+        """
+        super().setUp()
+        self.another = TestModel.objects.create(name="Another")
+        self.queryset = models.ContentGalleryQuerySet(TestModel)
+
+    def tearDown(self):
+        """
+        Removes another object
+        """
+        self.another.delete()
+        super().tearDown()
+
+    def test_with_gallery_bytes(self):
+        """
+        Checks whether objects are annotated with
+        the total size of files of their images
+        """
+        objects = self.queryset.with_gallery_bytes().in_bulk()
+        self.assertEqual(
+            objects[self.object.pk].gallery_bytes,
+            self.image.total_bytes
+        )
+        self.assertEqual(objects[self.another.pk].gallery_bytes, 0)
+
+    def test_get_gallery_bytes(self):
+        """
+        Checks whether the total size of files of images
+        of all objects is returned
+        """
+        self.assertEqual(
+            self.queryset.get_gallery_bytes(),
+            self.image.total_bytes
+        )
+        self.assertEqual(
+            self.queryset.filter(pk=self.another.pk).get_gallery_bytes(),
+            0
+        )
+
+
+class TestGallerySummary(TestCase):
+    """
+    Tests for denormalized summaries of images of objects
+    of models with the 'gallery_summary' flag
+    """
+
+    def setUp(self):
+        """
+        Creates the object with three images
+        """
+        clean_db()
+        self.object = SummaryTestModel.objects.create(name="Summary")
+        self.ctype = ContentType.objects.get_for_model(SummaryTestModel)
+        uploads = []
+        for i in range(3):
+            upload = get_image_in_memory_data()
+            upload.name = 'bar{}.jpg'.format(i)
+            uploads.append(upload)
+        results = models.Image.objects.create_bulk(self.object, uploads)
+        self.images = [
+            models.Image.objects.get(pk=image.pk) for image, error in results
+        ]
+
+    def tearDown(self):
+        """
+        Removes remaining images and objects
+        """
+        models.Image.objects.all().delete()
+        clean_db()
+
+    def get_summary(self, obj=None):
+        """
+        Returns the summary of the object or None
+        """
+        return models.GallerySummary.objects.filter(
+            content_type=self.ctype,
+            object_id=(obj or self.object).pk
+        ).first()
+
+    def assert_summary(self, count, cover, obj=None):
+        """
+        Checks the number of images and the cover in the summary
+        """
+        summary = self.get_summary(obj)
+        self.assertEqual(summary.image_count, count)
+        self.assertEqual(summary.cover_pk, cover.pk)
+        self.assertEqual(summary.cover_name, cover.image.name)
+        self.assertEqual(summary.cover_fingerprints, cover.fingerprints)
+
+    def test_create_bulk(self):
+        """
+        Checks whether the summary is refreshed once
+        when all images have been created
+        """
+        self.assert_summary(3, self.images[0])
+        upload = get_image_in_memory_data()
+        upload.name = 'baz.jpg'
+        with mock.patch.object(
+            models.GallerySummary.objects,
+            'refresh'
+        ) as refresh:
+            models.Image.objects.create_bulk(self.object, [upload])
+        refresh.assert_called_once_with([(self.ctype.pk, self.object.pk)])
+
+    def test_refresh_queries(self):
+        """
+        Checks whether summaries of many objects are refreshed
+        by the same number of queries as the summary of one object
+        """
+        objects = [self.object]
+        for i in range(3):
+            obj = SummaryTestModel.objects.create(name="Summary")
+            objects.append(obj)
+            models.Image.objects.filter(pk=self.images[i].pk).update(
+                object_id=obj.pk
+            )
+        related = [(self.ctype.pk, obj.pk) for obj in objects]
+        # reading images and covers, deleting and inserting summaries
+        # and creating and releasing savepoints of the transaction
+        # and of the insertion
+        with self.assertNumQueries(8):
+            models.GallerySummary.objects.refresh(related)
+        self.assertIsNone(self.get_summary())
+        for obj, image in zip(objects[1:], self.images):
+            self.assert_summary(1, image, obj)
+
+    def test_refresh_twice(self):
+        """
+        Checks whether summaries could be refreshed twice
+        in the same transaction
+        """
+        related = [(self.ctype.pk, self.object.pk)]
+        with transaction.atomic():
+            models.GallerySummary.objects.refresh(related)
+            models.GallerySummary.objects.refresh(related)
+        self.assert_summary(3, self.images[0])
+        self.assertEqual(models.GallerySummary.objects.count(), 1)
+
+    def test_refresh_concurrent_insert(self):
+        """
+        Checks whether the summary inserted by another process
+        after former summaries have been deleted is updated
+        """
+        bulk_create = models.GallerySummaryManager.bulk_create
+
+        def insert_summary(manager, objs):
+            # another process inserts the outdated summary meanwhile
+            models.GallerySummary.objects.create(
+                content_type=self.ctype,
+                object_id=self.object.pk,
+                image_count=100
+            )
+            return bulk_create(manager, objs)
+
+        with mock.patch.object(
+            models.GallerySummaryManager,
+            'bulk_create',
+            autospec=True,
+            side_effect=insert_summary
+        ):
+            models.GallerySummary.objects.refresh(
+                [(self.ctype.pk, self.object.pk)]
+            )
+        self.assert_summary(3, self.images[0])
+        self.assertEqual(models.GallerySummary.objects.count(), 1)
+
+    def test_reorder(self):
+        """
+        Checks whether the moved image becomes the cover
+        """
+        image = self.images[2]
+        image.position = -1
+        image.save()
+        self.assert_summary(3, image)
+
+    def test_delete(self):
+        """
+        Checks whether the next image becomes the cover
+        when the cover is deleted
+        """
+        self.images[0].delete()
+        self.assert_summary(2, self.images[1])
+
+    def test_delete_queryset(self):
+        """
+        Checks whether summaries are refreshed when images
+        are deleted by chunks and removed when there are
+        no images anymore
+        """
+        models.Image.objects.filter(pk=self.images[1].pk).delete()
+        self.assert_summary(2, self.images[0])
+        models.Image.objects.all().delete()
+        self.assertIsNone(self.get_summary())
+
+    def test_move(self):
+        """
+        Checks whether summaries of both objects are refreshed
+        when the image is related to another object
+        """
+        another = SummaryTestModel.objects.create(name="Another")
+        image = self.images[0]
+        image.object_id = another.pk
+        image.save()
+        self.assert_summary(2, self.images[1])
+        self.assert_summary(1, image, another)
+
+    def test_disabled(self):
+        """
+        Checks whether summaries are not kept for models
+        without the 'gallery_summary' flag
+        """
+        obj = TestModel.objects.create(name="Plain")
+        upload = get_image_in_memory_data()
+        upload.name = 'baz.jpg'
+        models.Image.objects.create_bulk(obj, [upload])
+        self.assertFalse(models.GallerySummary.objects.exclude(
+            content_type=self.ctype
+        ).exists())
+        self.assertFalse(models.has_gallery_summary(
+            ContentType.objects.get_for_model(TestModel)
+        ))
+
+    def test_with_gallery_summary(self):
+        """
+        Checks whether covers and numbers of images are got
+        by a single query for all objects
+        """
+        another = SummaryTestModel.objects.create(name="Another")
+        with self.assertNumQueries(1):
+            objects = list(
+                SummaryTestModel.objects.with_gallery_summary().order_by('pk')
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(objects[0].get_gallery_count(), 3)
+            cover = objects[0].get_gallery_cover()
+            self.assertEqual(cover.pk, self.images[0].pk)
+            self.assertEqual(
+                cover.thumbnail_url,
+                self.images[0].thumbnail_url
+            )
+            self.assertEqual(str(cover), 'Summary photo #1')
+            self.assertEqual(objects[1].get_gallery_count(), 0)
+            self.assertIsNone(objects[1].get_gallery_cover())
+        self.assertEqual(objects[1], another)
+
+    def test_get_gallery_cover(self):
+        """
+        Checks whether the cover is read from the summary
+        of the object that is not annotated
+        """
+        obj = SummaryTestModel.objects.get(pk=self.object.pk)
+        self.assertEqual(obj.get_gallery_count(), 3)
+        self.assertEqual(obj.get_gallery_cover().pk, self.images[0].pk)
+        self.assertEqual(utils.get_first_image(obj).pk, self.images[0].pk)
+
+    def test_refresh_covers(self):
+        """
+        Checks whether summaries get actual fingerprints
+        of covers updated without saving images
+        """
+        models.Image.objects.update(fingerprints='{"image": "foo"}')
+        models.GallerySummary.objects.refresh_covers(
+            [image.pk for image in self.images]
+        )
+        summary = self.get_summary()
+        self.assertEqual(summary.cover_fingerprints, '{"image": "foo"}')
+
+    def test_rebuild(self):
+        """
+        Checks whether summaries of all objects of the model are created
+        """
+        models.GallerySummary.objects.all().delete()
+        count = models.GallerySummary.objects.rebuild(SummaryTestModel)
+        self.assertEqual(count, 1)
+        self.assert_summary(3, self.images[0])
+
+    def test_object_deleted(self):
+        """
+        Checks whether the summary is deleted with the object
+        """
+        self.assertIsNotNone(self.get_summary())
+        # files are removed when the deletion is committed
+        with mock.patch.object(
+            models.transaction,
+            'on_commit',
+            lambda func, using=None: func()
+        ):
+            self.object.delete()
+        self.assertFalse(models.GallerySummary.objects.exists())
+
+
+class TestImageDeduplication(ImageTestCase):
+    """
+    Tests for sharing files of images with the same content.
+    Inherits a TestModel object and an image related to that,
+    the image is unique per test
+    """
+
+    def setUp(self):
+        """
+        Creates the second image with the same content
+        """
+        super().setUp()
+        self.settings_patcher = patch_settings({'deduplicate': True})
+        self.settings_patcher.__enter__()
+        self.duplicate = self.create_image('bar')
+
+    def tearDown(self):
+        """
+        Removes both images and restores the settings
+        """
+        models.Image.objects.all().delete()
+        self.settings_patcher.__exit__(None, None, None)
+
+    def create_image(self, slug):
+        """
+        Creates the image with the same content using given slug
+        """
+        with mock.patch.object(models, 'slugify_unique', return_value=slug):
+            return models.Image.objects.create(
+                image=get_image_in_memory_data(),
+                content_type=ContentType.objects.get_for_model(TestModel),
+                object_id=self.object.id
+            )
+
+    def test_shared_files(self):
+        """
+        Checks whether the duplicate uses files of the image
+        and no files are created for it
+        """
+        duplicate = models.Image.objects.get(pk=self.duplicate.pk)
+        self.assertEqual(duplicate.image.name, self.image.image.name)
+        self.assertEqual(duplicate.content_hash, self.image.content_hash)
+        self.assertEqual(
+            duplicate.get_fingerprints(),
+            self.image.get_fingerprints()
+        )
+        storage = self.image.image.storage
+        self.assertFalse(storage.exists(self.get_name('bar.jpg')))
+
+    def test_delete_shared_files(self):
+        """
+        Checks whether shared files are deleted with the last image only
+        """
+        self.duplicate.delete()
+        self.assertTrue(os.path.isfile(self.image.image.path))
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.image.delete()
+        self.assertFalse(os.path.isfile(self.image.image.path))
+
+    def test_delete_queryset(self):
+        """
+        Checks whether shared files are deleted if all
+        images using them are deleted at once
+        """
+        models.Image.objects.all().delete()
+        self.assertFalse(os.path.isfile(self.image.image.path))
+
+    def test_delete_queryset_partially(self):
+        """
+        Checks whether shared files are kept if another
+        image using them is not deleted
+        """
+        models.Image.objects.filter(pk=self.duplicate.pk).delete()
+        self.assertTrue(os.path.isfile(self.image.image.path))
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+
+    def test_upload_new_image(self):
+        """
+        Checks whether a new upload does not overwrite shared files
+        """
+        duplicate = models.Image.objects.get(pk=self.duplicate.pk)
+        duplicate.image = get_image_in_memory_data()
+        with patch_settings({'deduplicate': False}), mock.patch.object(
+            models,
+            'slugify_unique',
+            return_value='bar'
+        ):
+            duplicate.save()
+        self.assertEqual(duplicate.image.name, self.get_name('bar.jpg'))
+        self.assertTrue(os.path.isfile(self.image.image.path))
+
+    def test_object_changed(self):
+        """
+        Checks whether shared files are not renamed
+        """
+        another_object = TestModel.objects.create(name="AnotherObject")
+        duplicate = models.Image.objects.get(pk=self.duplicate.pk)
+        duplicate.object_id = another_object.pk
+        with mock.patch.object(models, 'slugify_unique', return_value='baz'):
+            duplicate.save()
+        self.assertEqual(duplicate.image.name, self.image.image.name)
+        self.assertTrue(os.path.isfile(self.image.image.path))
+        another_object.delete()
+
+    def test_missing_file(self):
+        """
+        Checks whether files are created if files of
+        the image with the same content are lost
+        """
+        os.remove(self.image.image.path)
+        image = self.create_image('baz')
+        self.assertEqual(image.image.name, self.get_name('baz.jpg'))
+        self.assertTrue(os.path.isfile(image.image.path))
+
+
+class TestImageSimilar(ImageTestCase):
+    """
+    Tests for searching similar images using perceptual hashes.
+    Inherits a TestModel object and an image related to that,
+    the image is unique per test
+    """
+
+    def test_dhash_saved(self):
+        """
+        Checks whether the hash is stored while creating the image
+        """
+        self.assertEqual(
+            self.image.get_dhash(),
+            self.image.image.get_dhash()
+        )
+
+    def test_get_similar(self):
+        """
+        Checks whether the image with the same content is
+        similar and the image itself is excluded
+        """
+        self.assertEqual(self.image.get_similar(), [])
+        # keep files of the image using another name of the upload
+        upload = get_image_in_memory_data()
+        upload.name = 'bar.jpg'
+        with mock.patch.object(models, 'slugify_unique', return_value='bar'):
+            another_image = models.Image.objects.create(
+                image=upload,
+                content_type=ContentType.objects.get_for_model(TestModel),
+                object_id=self.object.id
+            )
+        self.assertEqual(self.image.get_similar(), [(another_image, 0)])
+        another_image.delete()
+
+    def test_find_similar(self):
+        """
+        Checks whether images are found within the distance only
+        """
+        value = self.image.get_dhash()
+        # change the bit in each chunk
+        changed = value ^ utils.join_dhash([1] * utils.DHASH_CHUNKS)
+        self.assertEqual(
+            models.Image.objects.find_similar(changed, 4),
+            [(self.image, 4)]
+        )
+        self.assertEqual(models.Image.objects.find_similar(changed, 3), [])
+
+    def test_unknown_dhash(self):
+        """
+        Checks whether there are no similar images
+        if the hash is unknown
+        """
+        self.image.set_dhash(None)
+        self.assertIsNone(self.image.get_dhash())
+        self.assertEqual(self.image.get_similar(), [])
+
+
+class TestImageVariantSet(TestCase):
+    """
+    Tests for images related to the model that requires
+    the thumbnail only
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Creates a content object requiring the thumbnail only
+        """
+        clean_db()  # delete all objets created by another tests
+        cls.object = ThumbnailTestModel.objects.create(name="TestObject")
+
+    def setUp(self):
+        """
+        Creates the image attached to the content object for each test
+        """
+        self.image = models.Image.objects.create(
+            image=get_image_in_memory_data(),
+            content_type=ContentType.objects.get_for_model(ThumbnailTestModel),
+            object_id=self.object.id
+        )
+        # load created image from the database
+        self.image = models.Image.objects.get(pk=self.image.pk)
+
+    def tearDown(self):
+        """
+        Removes the image after each test
+        """
+        self.image.delete()
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Removes the content object
+        """
+        cls.object.delete()
+
+    def test_get_variant_names(self):
+        """
+        Checks whether the image requires the thumbnail only
+        """
+        self.assertEqual(self.image.get_variant_names(), ['thumbnail'])
+
+    def test_files(self):
+        """
+        Checks whether files of not required variants are not created
+        """
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertFalse(os.path.isfile(self.image.image.preview.path))
+
+    def test_fingerprints(self):
+        """
+        Checks whether fingerprints are stored for created files only
+        and there are no stale variants
+        """
+        self.assertEqual(
+            sorted(self.image.get_fingerprints()),
+            ['image', 'thumbnail']
+        )
+        self.assertEqual(self.image.get_stale_variants(), [])
+
+    def test_get_variant_names_without_object(self):
+        """
+        Checks whether all variants are required if
+        the related object is not specified
+        """
+        self.assertEqual(
+            models.Image().get_variant_names(),
+            list(self.image.image.variants)
+        )
+
+
+class TestCachedVariant(ImageTestCase):
+    """
+    Tests for tracking and eviction of files created on demand.
+    Inherits a TestModel object and an image related to that,
+    the image is unique per test. The preview is a lazy variant
+    in these tests.
+    """
+
+    def setUp(self):
+        """
+        Makes the preview lazy and creates two tracked files
+        with known sizes and access times
+        """
+        variants = [
+            dict(variant, lazy=variant['name'] == 'preview')
+            for variant in utils.get_variants()
+        ]
+        self.settings_patcher = patch_settings({'variants': variants})
+        self.settings_patcher.__enter__()
+        super().setUp()
+        cache.clear()
+        now = timezone.now()
+        self.old_path = utils.create_path('old_preview.jpg')
+        self.new_path = utils.create_path('new_preview.jpg')
+        for path in (self.old_path, self.new_path):
+            create_image_file(path)
+        models.CachedVariant.objects.create(
+            name='old_preview.jpg',
+            size=100,
+            accessed=now - datetime.timedelta(days=1)
+        )
+        models.CachedVariant.objects.create(
+            name='new_preview.jpg',
+            size=100,
+            accessed=now
+        )
+
+    def tearDown(self):
+        """
+        Removes tracked files and restores the settings
+        """
+        super().tearDown()
+        models.CachedVariant.objects.all().delete()
+        for path in (self.old_path, self.new_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        self.settings_patcher.__exit__(None, None, None)
+
+    def test_track(self):
+        """
+        Checks whether the created file is tracked with its size
+        """
+        self.image.image.create_variant_file('preview')
+        image_file = self.image.image.preview
+        models.CachedVariant.objects.track(image_file)
+        entry = models.CachedVariant.objects.get(name='foo_preview.jpg')
+        self.assertEqual(entry.size, os.path.getsize(image_file.path))
+
+    def test_touch(self):
+        """
+        Checks whether the access time is updated once in the interval
+        """
+        entry = models.CachedVariant.objects.get(name='old_preview.jpg')
+        # the size of tracked files is not read
+        image_file = mock.MagicMock(location='old_preview.jpg')
+        models.CachedVariant.objects.touch(image_file)
+        touched = models.CachedVariant.objects.get(name='old_preview.jpg')
+        self.assertGreater(touched.accessed, entry.accessed)
+        # the second access does not update the database
+        with mock.patch.object(
+            models.CachedVariantManager,
+            'filter'
+        ) as filter_method:
+            models.CachedVariant.objects.touch(image_file)
+        filter_method.assert_not_called()
+
+    def test_touch_untracked_file(self):
+        """
+        Checks whether the file is tracked on the first access
+        """
+        self.image.image.create_variant_file('preview')
+        image_file = self.image.image.preview
+        models.CachedVariant.objects.touch(image_file)
+        entry = models.CachedVariant.objects.get(name='foo_preview.jpg')
+        self.assertEqual(entry.size, os.path.getsize(image_file.path))
+        entry.delete()
+
+    def test_evict(self):
+        """
+        Checks whether least recently used files are deleted
+        """
+        result = models.CachedVariant.objects.evict(150)
+        self.assertEqual(result, (1, 100))
+        self.assertFalse(os.path.isfile(self.old_path))
+        self.assertTrue(os.path.isfile(self.new_path))
+        self.assertEqual(models.CachedVariant.objects.count(), 1)
+
+    def test_evict_under_limit(self):
+        """
+        Checks whether files are not deleted if their
+        total size does not exceed the limit
+        """
+        result = models.CachedVariant.objects.evict(200)
+        self.assertEqual(result, (0, 0))
+        self.assertTrue(os.path.isfile(self.old_path))
+
+    def test_never_evict_full_size_image(self):
+        """
+        Checks whether the full-size image is not deleted
+        even if it has been tracked
+        """
+        models.CachedVariant.objects.create(
+            name='foo.jpg',
+            size=100,
+            accessed=timezone.now() - datetime.timedelta(days=2)
+        )
+        models.CachedVariant.objects.evict(0)
+        self.assertTrue(os.path.isfile(self.image.image.image_data.path))
+        self.assertFalse(os.path.isfile(self.new_path))
+
+    def test_never_track_eager_file(self):
+        """
+        Checks whether files of eager variants are not tracked
+        """
+        image_file = self.image.image.thumbnail
+        models.CachedVariant.objects.track(image_file)
+        models.CachedVariant.objects.touch(image_file)
+        self.assertFalse(
+            models.CachedVariant.objects.filter(
+                name='foo_thumbnail.jpg'
+            ).exists()
+        )
+
+    def test_never_evict_eager_file(self):
+        """
+        Checks whether the file of the eager variant is not deleted
+        even if it has been tracked
+        """
+        models.CachedVariant.objects.create(
+            name='foo_thumbnail.jpg',
+            size=100,
+            accessed=timezone.now() - datetime.timedelta(days=2)
+        )
+        models.CachedVariant.objects.evict(0)
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertFalse(os.path.isfile(self.new_path))
+        self.assertFalse(models.CachedVariant.objects.exists())
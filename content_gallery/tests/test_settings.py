@@ -10,6 +10,13 @@ class TestSettings(TestCase):
     Tests for settings module
     """
 
+    def tearDown(self):
+        """
+        Restores the settings from the project settings
+        after each test
+        """
+        imp.reload(settings)
+
     @override_settings(MEDIA_ROOT=None)
     def test_without_media_root(self):
         """
@@ -126,3 +133,89 @@ class TestSettings(TestCase):
         """
         imp.reload(settings)
         self.assertEqual(settings.CONF['path'], 'custom_path')
+
+    @override_settings(
+        CONTENT_GALLERY={
+            'variants': [
+                {'name': 'retina', 'width': 1600, 'height': 1200},
+                {'name': 'small_image', 'width': 564, 'height': 456},
+                {'name': 'preview', 'width': 376, 'height': 304},
+                {'name': 'small_preview', 'width': 141, 'height': 114},
+                {'name': 'thumbnail', 'width': 94, 'height': 76},
+            ]
+        }
+    )
+    def test_variants_setting(self):
+        """
+        Checks whether the settings module gets the list
+        of variants from the project settings
+        """
+        imp.reload(settings)
+        self.assertEqual(settings.CONF['variants'][0]['name'], 'retina')
+
+    @override_settings(
+        CONTENT_GALLERY={
+            'variants': [
+                {'name': 'thumbnail', 'width': 94, 'height': 76},
+                {'name': 'retina', 'width': 1600, 'height': 1200,
+                 'lazy': True},
+            ]
+        }
+    )
+    def test_required_variants_missing(self):
+        """
+        Checks whether the ImproperlyConfigured exception is rised
+        if variants used by views and template tags are missing
+        and the message suggests to declare them lazy
+        """
+        with self.assertRaisesMessage(ImproperlyConfigured, "'lazy': True"):
+            imp.reload(settings)
+
+    @override_settings(
+        CONTENT_GALLERY={'variants': [{'name': 'retina', 'width': 1600}]}
+    )
+    def test_variant_without_size(self):
+        """
+        Checks whether the ImproperlyConfigured exception
+        is rised if the variant has no size
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            imp.reload(settings)
+
+    @override_settings(
+        CONTENT_GALLERY={
+            'variants': [{'name': 'image', 'width': 1600, 'height': 1200}]
+        }
+    )
+    def test_variant_with_reserved_name(self):
+        """
+        Checks whether the ImproperlyConfigured exception
+        is rised if the variant has the name of the full-size image
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            imp.reload(settings)
+
+    @override_settings(
+        CONTENT_GALLERY={
+            'variants': [
+                {'name': 'large', 'width': 1600, 'height': 1200,
+                 'suffix': 'original'}
+            ]
+        }
+    )
+    def test_variant_with_reserved_suffix(self):
+        """
+        Checks whether the ImproperlyConfigured exception is rised
+        if the variant has the suffix of original images
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            imp.reload(settings)
+
+    @override_settings(CONTENT_GALLERY={'layout': 'foo'})
+    def test_unknown_layout(self):
+        """
+        Checks whether the ImproperlyConfigured exception
+        is rised if the layout is unknown
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            imp.reload(settings)
@@ -138,6 +138,8 @@ class TestGalleryPreview(ViewsTestCase):
             {
                 # values returned by the gallery_image_data
                 'foo': 'bar',
+                # the variant used as the preview
+                'variant': 'preview',
                 # the preview size
                 'image_width': 400,
                 'image_height': 300,
@@ -187,6 +189,8 @@ class TestGallerySmallPreview(ViewsTestCase):
             {
                 # values returned by the gallery_image_data
                 'foo': 'bar',
+                # the variant used as the small preview
+                'variant': 'small_preview',
                 # the small preview size
                 'image_width': 200,
                 'image_height': 150,
@@ -226,6 +230,44 @@ class TestGalleryDataUrlPattern(TestCase):
         self.assertEqual(result, 'url_pattern')
 
 
+class TestGalleryDownloadUrl(TestCase):
+    """
+    Tests for the template tag returning the URL of the ZIP archive
+    of images related to the object
+    """
+
+    def test_get_download_url(self):
+        """
+        Checks whether the tag returns a result
+        of the create_download_url helper function
+        """
+        with mock.patch.object(
+            utils,
+            'create_download_url',
+            return_value='url'
+        ) as create_url:
+            result = content_gallery.gallery_download_url('obj', 'thumbnail')
+            create_url.assert_called_with('obj', 'thumbnail')
+        self.assertEqual(result, 'url')
+
+
+class TestGalleryVariantUrlFilter(TestCase):
+    """
+    Tests for the filter returning the URL of the variant of the image
+    """
+
+    def test_gallery_variant_url(self):
+        """
+        Checks whether the filter returns a result
+        of the get_variant_url method of the image
+        """
+        image = mock.MagicMock()
+        image.get_variant_url.return_value = 'url'
+        result = content_gallery.gallery_variant_url(image, 'foo')
+        image.get_variant_url.assert_called_with('foo')
+        self.assertEqual(result, 'url')
+
+
 class TestObfuscateFilter(TestCase):
     """
     Tests for the filter adding .min suffix to given path
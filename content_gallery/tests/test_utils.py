@@ -1,11 +1,25 @@
 import os
+import zipfile
+import tempfile
+import tracemalloc
+from io import BytesIO
+from PIL import Image
 
 from django.test import TestCase, mock, override_settings
 from django.conf import settings as django_settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
+from django.contrib.contenttypes.models import ContentType
 
 from .. import utils
 
 from .utils import create_image_file, get_image_size, patch_settings
+from .utils import get_image_data
+from .utils import InMemoryStorage
+from .models import TestModel
 from .base_test_cases import ViewsTestCase
 
 class TestPatterns(TestCase):
@@ -313,6 +327,549 @@ class TestFilenameUtils(TestCase):
         self.assertEqual(name, 'foo')
 
 
+class TestShards(TestCase):
+    """
+    Tests for helper functions creating subdirectories of the gallery folder
+    """
+
+    def test_without_layout(self):
+        """
+        Checks whether files are stored in the gallery folder directly
+        """
+        with patch_settings({'layout': None}):
+            self.assertEqual(utils.create_shard('foo'), '')
+
+    def test_hash_layout(self):
+        """
+        Checks whether the subdirectory is the same for
+        the slug and the name of the full-size image
+        """
+        with patch_settings({'layout': 'hash'}):
+            shard = utils.create_shard('foo')
+            self.assertRegex(shard, r'^[0-9a-f]{2}/[0-9a-f]{2}$')
+            self.assertEqual(utils.create_shard('gallery/foo.jpg'), shard)
+
+    def test_date_layout(self):
+        """
+        Checks whether the subdirectory is the current date
+        """
+        with patch_settings({'layout': 'date'}):
+            shard = utils.create_shard('foo')
+        self.assertRegex(shard, r'^\d{4}/\d{2}/\d{2}$')
+
+    def test_get_shard(self):
+        """
+        Checks whether the subdirectory is extracted
+        from the name in the database
+        """
+        with patch_settings({'path': 'gallery'}):
+            self.assertEqual(utils.get_shard('gallery/ab/cd/foo.jpg'), 'ab/cd')
+            self.assertEqual(utils.get_shard('gallery/foo.jpg'), '')
+            self.assertEqual(utils.get_shard('foo.jpg'), '')
+
+    @override_settings(MEDIA_URL='/media/')
+    def test_create_url_with_shard(self):
+        """
+        Checks whether the subdirectory is included in the URL
+        """
+        with patch_settings({'path': 'gallery'}):
+            url = utils.create_url('foo.jpg', 'ab/cd')
+        self.assertEqual(url, '/media/gallery/ab/cd/foo.jpg')
+
+    def test_name_in_db_with_shard(self):
+        """
+        Checks whether the subdirectory is included in the name
+        """
+        with patch_settings({'path': 'gallery'}):
+            name = utils.name_in_db('foo.jpg', 'ab/cd')
+        self.assertEqual(name, os.path.join('gallery', 'ab', 'cd', 'foo.jpg'))
+
+
+class TestPerceptualHash(TestCase):
+    """
+    Tests for helper functions computing and comparing perceptual hashes
+    """
+
+    @staticmethod
+    def create_dhash(img):
+        """
+        Saves the image into the JPEG file in memory and returns its hash
+        """
+        io = BytesIO()
+        img.convert('RGB').save(io, format='JPEG')
+        io.seek(0)
+        return utils.create_dhash(io)
+
+    def test_resized_image(self):
+        """
+        Checks whether hashes of the image and its resized copy are close
+        """
+        img = Image.linear_gradient('L').rotate(30)
+        value = self.create_dhash(img)
+        resized = self.create_dhash(img.resize((100, 100)))
+        self.assertLessEqual(utils.hamming_distance(value, resized), 2)
+
+    def test_different_images(self):
+        """
+        Checks whether hashes of different images are far
+        """
+        img = Image.linear_gradient('L').rotate(30)
+        value = self.create_dhash(img)
+        rotated = self.create_dhash(img.rotate(180))
+        self.assertGreater(utils.hamming_distance(value, rotated), 16)
+
+    def test_split_dhash(self):
+        """
+        Checks whether the hash is split into chunks and joined back
+        """
+        value = 0x0123456789abcdef
+        chunks = utils.split_dhash(value)
+        self.assertEqual(len(chunks), utils.DHASH_CHUNKS)
+        self.assertEqual(utils.join_dhash(chunks), value)
+
+    def test_chunk_neighbours(self):
+        """
+        Checks whether neighbours of the chunk differ
+        in the radius bits at most
+        """
+        neighbours = utils.get_chunk_neighbours(5, 1)
+        self.assertEqual(len(neighbours), utils.DHASH_CHUNK_BITS + 1)
+        for neighbour in neighbours:
+            self.assertLessEqual(utils.hamming_distance(5, neighbour), 1)
+
+
+class TestVariants(TestCase):
+    """
+    Tests for helper functions returning variants of images
+    """
+
+    def test_default_variants(self):
+        """
+        Checks whether default variants are created
+        using sizes from the settings
+        """
+        with patch_settings({'thumbnail_width': 120, 'variants': None}):
+            variants = utils.get_variants()
+        # check whether all default variants are in the list
+        self.assertEqual(
+            [variant['name'] for variant in variants],
+            ['small_image', 'preview', 'small_preview', 'thumbnail']
+        )
+        # check whether the variant has a correct size and suffix
+        self.assertEqual(variants[3]['width'], 120)
+        self.assertEqual(variants[0]['suffix'], 'small')
+
+    def test_custom_variants(self):
+        """
+        Checks whether variants from the settings are filled
+        with default values of optional items
+        """
+        variant = {'name': 'retina', 'width': 1600, 'height': 1200}
+        with patch_settings({'variants': [variant]}):
+            variants = utils.get_variants()
+        self.assertEqual(
+            variants,
+            [
+                {
+                    'name': 'retina',
+                    'suffix': 'retina',
+                    'width': 1600,
+                    'height': 1200,
+                    'format': None,
+                    'quality': None,
+                    'lazy': False,
+                }
+            ]
+        )
+
+    def test_format_upper_case(self):
+        """
+        Checks whether the format of the variant is converted
+        to upper case used by Pillow
+        """
+        variant = {
+            'name': 'retina',
+            'width': 1600,
+            'height': 1200,
+            'format': 'jpeg'
+        }
+        with patch_settings({'variants': [variant]}):
+            variants = utils.get_variants()
+        self.assertEqual(variants[0]['format'], 'JPEG')
+        # the settings are not changed
+        self.assertEqual(variant['format'], 'jpeg')
+
+    def test_get_variant(self):
+        """
+        Checks whether the get_variant function
+        returns the variant with given name
+        """
+        variant = utils.get_variant('preview')
+        self.assertEqual(variant['suffix'], 'preview')
+
+    def test_get_unknown_variant(self):
+        """
+        Checks whether the get_variant function raises KeyError
+        if there is no variant with given name
+        """
+        with self.assertRaises(KeyError):
+            utils.get_variant('foo')
+
+    def test_get_format_ext(self):
+        """
+        Checks whether the get_format_ext function
+        returns correct extensions of formats
+        """
+        self.assertEqual(utils.get_format_ext('JPEG'), '.jpg')
+        self.assertEqual(utils.get_format_ext('WEBP'), '.webp')
+
+
+class TestSpooledUpload(TestCase):
+    """
+    Tests for the SpooledUpload class keeping data of uploaded files
+    """
+
+    def test_small_file(self):
+        """
+        Checks whether the data of the small file is kept in the memory
+        """
+        upload = utils.SpooledUpload(BytesIO(b'data'), 'foo.jpg', 4)
+        self.assertEqual(upload.data, b'data')
+        self.assertIsNone(upload.path)
+        self.assertEqual(
+            upload.content_hash,
+            utils.create_content_hash([b'data'], None)
+        )
+        with upload.open() as f:
+            self.assertEqual(f.name, 'foo.jpg')
+            self.assertEqual(f.read(), b'data')
+
+    def test_large_file(self):
+        """
+        Checks whether the large file is spooled to the temporary
+        file which is deleted when the upload is closed
+        """
+        src = BytesIO(b'data' * 10)
+        upload = utils.SpooledUpload(src, 'foo.jpg', 4)
+        self.assertIsNone(upload.data)
+        self.assertEqual(src.tell(), 0)
+        with upload.open() as f:
+            self.assertEqual(f.read(), b'data' * 10)
+        self.assertEqual(
+            upload.content_hash,
+            utils.create_content_hash([b'data' * 10], None)
+        )
+        upload.close()
+        self.assertFalse(os.path.exists(upload.path))
+
+    def test_temporary_uploaded_file(self):
+        """
+        Checks whether the temporary file of the upload is used
+        """
+        src = TemporaryUploadedFile('foo.jpg', 'image/jpeg', 4, None)
+        src.write(b'data')
+        upload = utils.SpooledUpload(src, 'foo.jpg', 0)
+        self.assertEqual(upload.path, src.temporary_file_path())
+        upload.close()
+        # the file of the upload is not deleted
+        self.assertTrue(os.path.exists(upload.path))
+        src.close()
+
+
+class TestChunkedUpload(TestCase):
+    """
+    Tests for the ChunkedUpload class assembling files from chunks
+    """
+
+    def setUp(self):
+        """
+        Stores chunked uploads in the temporary directory
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patcher = patch_settings({'upload_dir': self.tmp.name})
+        self.patcher.__enter__()
+        self.upload = utils.ChunkedUpload('0' * 32)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory
+        """
+        self.patcher.__exit__(None, None, None)
+        self.tmp.cleanup()
+
+    def test_invalid_id(self):
+        """
+        Checks whether ids that are not hex strings are rejected
+        """
+        with self.assertRaises(ValueError):
+            utils.ChunkedUpload('../foo')
+
+    def test_write(self):
+        """
+        Checks whether chunks are written at their offsets and
+        the chunk written again does not change the data
+        """
+        self.assertEqual(self.upload.received, 0)
+        self.assertEqual(self.upload.write(0, [b'foo']), 3)
+        self.assertEqual(self.upload.write(3, [b'bar']), 6)
+        # the retry of the first chunk
+        self.assertEqual(self.upload.write(0, [b'foo']), 6)
+        with self.upload.open('foo.jpg') as f:
+            self.assertEqual(f.read(), b'foobar')
+            self.assertEqual(f.size, 6)
+            self.assertEqual(f.temporary_file_path(), self.upload.path)
+
+    def test_missing_chunk(self):
+        """
+        Checks whether the chunk after the gap is rejected
+        """
+        with self.assertRaises(ValueError):
+            self.upload.write(3, [b'bar'])
+        self.assertEqual(self.upload.received, 0)
+
+    def test_result(self):
+        """
+        Checks whether the result is kept instead of received data
+        """
+        self.assertIsNone(self.upload.get_result())
+        self.upload.write(0, [b'foo'])
+        self.upload.set_result({'pk': 1})
+        self.assertEqual(self.upload.get_result(), {'pk': 1})
+        self.assertFalse(os.path.exists(self.upload.path))
+
+    def test_delete_expired_uploads(self):
+        """
+        Checks whether only files of expired uploads are deleted
+        """
+        self.upload.write(0, [b'foo'])
+        another = utils.ChunkedUpload('1' * 32)
+        another.write(0, [b'bar'])
+        expired = os.path.getmtime(self.upload.path) - utils.UPLOAD_EXPIRE
+        os.utime(self.upload.path, (expired - 1, expired - 1))
+        utils.delete_expired_uploads()
+        self.assertFalse(os.path.exists(self.upload.path))
+        self.assertTrue(os.path.exists(another.path))
+
+
+class TestCreateZipChunks(TestCase):
+    """
+    Tests for the create_zip_chunks function streaming ZIP archives
+    """
+
+    def test_chunks(self):
+        """
+        Checks whether the archive is yielded by chunks of files
+        """
+        image_file = mock.MagicMock()
+        image_file.open.return_value = ContentFile(b'foo' * 100)
+        with mock.patch.object(File, 'DEFAULT_CHUNK_SIZE', 100):
+            chunks = list(
+                utils.create_zip_chunks([('foo.jpg', image_file)])
+            )
+        self.assertGreater(len(chunks), 3)
+        archive = zipfile.ZipFile(BytesIO(b''.join(chunks)))
+        self.assertEqual(archive.read('foo.jpg'), b'foo' * 100)
+
+    def test_missing_file(self):
+        """
+        Checks whether missing files are skipped
+        """
+        image_file = mock.MagicMock()
+        image_file.open.side_effect = FileNotFoundError
+        data = b''.join(utils.create_zip_chunks([('foo.jpg', image_file)]))
+        self.assertEqual(zipfile.ZipFile(BytesIO(data)).namelist(), [])
+
+
+class TestCheckImageLimits(TestCase):
+    """
+    Tests for the check_image_limits function
+    """
+
+    def setUp(self):
+        """
+        Creates the 200x200 image file
+        """
+        self.image = get_image_data()
+
+    def test_without_limits(self):
+        """
+        Checks whether any image is accepted by default
+        """
+        utils.check_image_limits(self.image)
+
+    def test_too_many_bytes(self):
+        """
+        Checks whether the large file is rejected
+        """
+        with patch_settings({'max_upload_bytes': 10}):
+            with self.assertRaises(ValidationError):
+                utils.check_image_limits(self.image)
+
+    def test_too_many_pixels(self):
+        """
+        Checks whether the image is rejected without decoding
+        if it has too many pixels
+        """
+        with patch_settings({'max_upload_pixels': 200 * 200 - 1}), \
+                mock.patch.object(Image.Image, 'load') as load:
+            with self.assertRaises(ValidationError):
+                utils.check_image_limits(self.image)
+        load.assert_not_called()
+
+    def test_under_limits(self):
+        """
+        Checks whether the image within limits is accepted
+        """
+        with patch_settings({
+            'max_upload_bytes': 10 ** 6,
+            'max_upload_pixels': 200 * 200
+        }):
+            utils.check_image_limits(self.image)
+        self.assertEqual(self.image.tell(), 0)
+
+
+class TestLockFile(TestCase):
+    """
+    Tests for the lock_file context manager
+    """
+
+    def test_lock_file(self):
+        """
+        Checks whether the lock file is created in the lock directory
+        and the lock could be acquired again after releasing
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch_settings({'lock_dir': tmp}):
+                with utils.lock_file('foo.jpg'):
+                    self.assertEqual(len(os.listdir(tmp)), 1)
+                with utils.lock_file('foo.jpg'):
+                    pass
+
+
+class TestStorageUtils(TestCase):
+    """
+    Tests for helper functions manipulating with files in storages
+    """
+
+    def setUp(self):
+        """
+        Creates a storage containing a file for each test
+        """
+        self.storage = InMemoryStorage()
+        self.storage.files['foo.jpg'] = b'foo'
+
+    def test_storage_save_overwrite(self):
+        """
+        Checks whether the existing file is replaced
+        """
+        utils.storage_save(self.storage, 'foo.jpg', BytesIO(b'bar'))
+        self.assertEqual(self.storage.files, {'foo.jpg': b'bar'})
+
+    def test_storage_save_local_file(self):
+        """
+        Checks whether the existing local file is replaced by renaming
+        the new file, so the old file is never deleted before that
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileSystemStorage(tmp, file_permissions_mode=0o640)
+            storage.save('bar/foo.jpg', BytesIO(b'foo'))
+            with mock.patch.object(storage, 'delete') as delete:
+                utils.storage_save(storage, 'bar/foo.jpg', BytesIO(b'bar'))
+            delete.assert_not_called()
+            path = storage.path('bar/foo.jpg')
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'bar')
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+            # no temporary files are left
+            self.assertEqual(os.listdir(os.path.dirname(path)), ['foo.jpg'])
+
+    def test_storage_rename(self):
+        """
+        Checks whether the file is copied in the storage
+        not supporting paths and the old file is deleted
+        """
+        utils.storage_rename(self.storage, 'foo.jpg', 'bar.jpg')
+        self.assertEqual(self.storage.files, {'bar.jpg': b'foo'})
+
+    def test_storage_rename_missing_file(self):
+        """
+        Checks whether the FileNotFoundError is raised
+        if the file does not exist
+        """
+        with self.assertRaises(FileNotFoundError):
+            utils.storage_rename(self.storage, 'bar.jpg', 'baz.jpg')
+
+    def test_storage_rename_local_file(self):
+        """
+        Checks whether the local file is moved
+        to the directory which does not exist
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileSystemStorage(tmp)
+            storage.save('foo.jpg', ContentFile(b'foo'))
+            utils.storage_rename(storage, 'foo.jpg', 'bar/foo.jpg')
+            self.assertFalse(storage.exists('foo.jpg'))
+            with storage.open('bar/foo.jpg') as f:
+                self.assertEqual(f.read(), b'foo')
+
+    def test_storage_link(self):
+        """
+        Checks whether the data is copied in the storage
+        not supporting paths
+        """
+        utils.storage_link(self.storage, 'foo.jpg', 'bar.jpg', BytesIO(b'foo'))
+        self.assertEqual(self.storage.files['bar.jpg'], b'foo')
+
+    def test_storage_link_local_file(self):
+        """
+        Checks whether the local file is hard linked
+        replacing the existing file
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileSystemStorage(tmp)
+            storage.save('foo.jpg', ContentFile(b'foo'))
+            storage.save('bar.jpg', ContentFile(b'bar'))
+            utils.storage_link(storage, 'foo.jpg', 'bar.jpg', BytesIO(b'foo'))
+            self.assertTrue(os.path.samefile(
+                storage.path('foo.jpg'),
+                storage.path('bar.jpg')
+            ))
+
+    def test_storage_delete(self):
+        """
+        Checks whether the file is deleted from the storage
+        not supporting paths and the result shows whether it has existed
+        """
+        self.assertTrue(utils.storage_delete(self.storage, 'foo.jpg'))
+        self.assertEqual(self.storage.files, {})
+        self.assertFalse(utils.storage_delete(self.storage, 'foo.jpg'))
+
+    def test_storage_delete_local_file(self):
+        """
+        Checks whether the local file is removed
+        and the missing file is not counted
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileSystemStorage(tmp)
+            storage.save('foo.jpg', ContentFile(b'foo'))
+            self.assertTrue(utils.storage_delete(storage, 'foo.jpg'))
+            self.assertFalse(storage.exists('foo.jpg'))
+            self.assertFalse(utils.storage_delete(storage, 'foo.jpg'))
+
+    def test_storage_delete_many(self):
+        """
+        Checks whether files are deleted by the pool of threads
+        and the number of removed files is returned
+        """
+        self.storage.files['bar.jpg'] = b'bar'
+        removed = utils.storage_delete_many(
+            self.storage,
+            ['foo.jpg', 'bar.jpg', 'baz.jpg']
+        )
+        self.assertEqual(removed, 2)
+        self.assertEqual(self.storage.files, {})
+
+
 class TestImageUtils(TestCase):
     """
     Tests for functions manipulating with image data
@@ -385,6 +942,17 @@ class TestImageUtils(TestCase):
         self.assertEqual(size[0], 50)  # 100 -> 50
         self.assertEqual(size[1], 50)  # 100 -> 50
 
+    def test_resize_image_format(self):
+        """
+        Checks whether the image_resize function saves
+        the image in given format
+        """
+        path = os.path.join(django_settings.MEDIA_ROOT, 'foo.png')
+        utils.image_resize(self.image_path, path, (50, 50), 'PNG')
+        with Image.open(path) as img:
+            self.assertEqual(img.format, 'PNG')
+        os.remove(path)
+
     def test_create_in_memory_image(self):
         """
         Checks whether the create_in_memory_image function resizes the image
@@ -398,6 +966,61 @@ class TestImageUtils(TestCase):
         # check whether the result size if correct
         self.assertEqual(size[0], 50)  # 100 -> 50
         self.assertEqual(size[1], 50)  # 100 -> 50
+        # the MIME type and the size of the data are known
+        self.assertEqual(img.content_type, 'image/jpeg')
+        img.seek(0)
+        self.assertEqual(img.size, len(img.read()))
+
+    def test_save_in_memory_image(self):
+        """
+        Checks whether the storage writes the data of the in-memory image
+        without copying it. The peak of memory allocated while saving
+        is measured by tracemalloc.
+        """
+        src = BytesIO()
+        Image.effect_noise((1000, 1000), 64).convert('RGB').save(
+            src,
+            'JPEG',
+            quality=95
+        )
+        src.seek(0)
+        img = utils.create_in_memory_image(src, 'foo.jpg', (1000, 1000))
+        self.assertEqual(img.size, len(img.data))
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileSystemStorage(tmp)
+            tracemalloc.start()
+            try:
+                storage.save('foo.jpg', img)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            with storage.open('foo.jpg') as f:
+                self.assertEqual(f.read(), img.data)
+        # a copy of the data would take the same size
+        self.assertLess(peak, img.size / 2)
+
+    def test_get_mime_type(self):
+        """
+        Checks whether the MIME type is taken from the registry of Pillow
+        without reading the data
+        """
+        with mock.patch.object(utils, 'magic') as magic:
+            self.assertEqual(utils.get_mime_type('PNG', b'data'), 'image/png')
+        magic.from_buffer.assert_not_called()
+
+    def test_get_mime_type_unknown_format(self):
+        """
+        Checks whether the data of the unknown format is sniffed by
+        python-magic if it's installed
+        """
+        with mock.patch.object(utils, 'magic') as magic:
+            magic.from_buffer.return_value = 'image/foo'
+            self.assertEqual(utils.get_mime_type('FOO', b'data'), 'image/foo')
+        with mock.patch.object(utils, 'magic', None):
+            self.assertEqual(
+                utils.get_mime_type('FOO', b'data'),
+                'application/octet-stream'
+            )
 
 
 
@@ -485,6 +1108,30 @@ class TestGetFirstImage(ViewsTestCase):
         self.assertIsNone(img)
 
 
+class TestGetContentType(TestCase):
+    """
+    Tests for the get_content_type function
+    """
+
+    def test_get_content_type(self):
+        """
+        Checks whether the content type is found by its label
+        """
+        self.assertEqual(
+            utils.get_content_type('tests.TestModel'),
+            ContentType.objects.get_for_model(TestModel)
+        )
+
+    def test_unknown_content_type(self):
+        """
+        Checks whether the CommandError is raised
+        for unknown and malformed labels
+        """
+        for label in ('tests.Unknown', 'testmodel'):
+            with self.assertRaises(CommandError):
+                utils.get_content_type(label)
+
+
 class TestGetObfuscatedFile(TestCase):
     """
     Tests for the get_obfuscated_file function. It should return
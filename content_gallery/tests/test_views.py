@@ -1,4 +1,7 @@
+import os
+import io
 import json
+import zipfile
 
 from django.test import TestCase, mock
 from django.contrib.contenttypes.models import ContentType
@@ -312,3 +315,311 @@ class TestGalleryData(AjaxRequestMixin, ViewsTestCase):
         data = json.loads(resp.content.decode("utf-8"))
         # check whether the list is empty, i.e. all images have been skipped
         self.assertListEqual(data['images'], [])
+
+
+class TestVariant(ImageTestCase):
+    """
+    Tests for the view returning files of variants created on demand.
+    Inherits a TestModel object and an image related to that, the image
+    is unique per test. The thumbnail is a lazy variant in these tests.
+    """
+
+    def setUp(self):
+        """
+        Makes the thumbnail lazy and creates the image
+        """
+        variants = [
+            {'name': 'thumbnail', 'width': 20, 'height': 20, 'lazy': True},
+            {'name': 'preview', 'width': 100, 'height': 100},
+        ]
+        self.settings_patcher = patch_settings({'variants': variants})
+        self.settings_patcher.__enter__()
+        super().setUp()
+        self.thumbnail = self.image.image.thumbnail
+
+    def tearDown(self):
+        """
+        Removes the image and restores the settings
+        """
+        super().tearDown()
+        models.CachedVariant.objects.all().delete()
+        self.settings_patcher.__exit__(None, None, None)
+
+    def test_url(self):
+        """
+        Checks whether the URL of the lazy variant is the URL of the view
+        """
+        url = reverse(
+            'content_gallery:variant',
+            args=('thumbnail', 'foo_thumbnail.jpg')
+        )
+        self.assertEqual(self.image.thumbnail_url, url)
+
+    def test_create_file(self):
+        """
+        Checks whether the file is created on the first request
+        and its fingerprint is stored
+        """
+        self.assertFalse(os.path.isfile(self.thumbnail.path))
+        resp = self.client.get(self.image.thumbnail_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'image/jpeg')
+        self.assertTrue(os.path.isfile(self.thumbnail.path))
+        self.assertIn('thumbnail', self.get_image().get_fingerprints())
+        # check whether the file is tracked
+        self.assertTrue(
+            models.CachedVariant.objects.filter(
+                name='foo_thumbnail.jpg'
+            ).exists()
+        )
+
+    def test_evict_on_create(self):
+        """
+        Checks whether least recently used files are evicted
+        after creating the file if the limit is specified
+        """
+        with patch_settings({'cache_max_bytes': 1000}), mock.patch.object(
+            models.CachedVariantManager,
+            'evict'
+        ) as evict:
+            self.client.get(self.image.thumbnail_url)
+        evict.assert_called_with(1000)
+
+    def test_existing_file(self):
+        """
+        Checks whether existing file is not created again
+        """
+        self.image.image.create_variant_file('thumbnail')
+        with mock.patch.object(
+            fields.GalleryImageFieldFile,
+            'create_variant_file'
+        ) as create_variant_file:
+            resp = self.client.get(self.image.thumbnail_url)
+        self.assertEqual(resp.status_code, 200)
+        create_variant_file.assert_not_called()
+
+    def test_lock(self):
+        """
+        Checks whether the file is created holding the lock
+        """
+        with mock.patch.object(utils, 'lock_file') as lock_file:
+            self.client.get(self.image.thumbnail_url)
+        lock_file.assert_called_with('foo_thumbnail.jpg')
+
+    def test_immutable_file(self):
+        """
+        Checks whether the file with the version in the name is found
+        and could be cached forever if file names are immutable
+        """
+        with patch_settings({'hashed_names': True}):
+            thumbnail = self.get_image().image.thumbnail
+            self.assertTrue(thumbnail.filename.startswith('foo_thumbnail-'))
+            resp = self.client.get(thumbnail.url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('immutable', resp['Cache-Control'])
+            self.assertTrue(os.path.isfile(thumbnail.path))
+            thumbnail.delete()
+
+    def test_x_accel_redirect(self):
+        """
+        Checks whether the file is sent by nginx
+        """
+        with patch_settings({'sendfile': 'x-accel-redirect'}):
+            resp = self.client.get(self.image.thumbnail_url)
+        self.assertEqual(
+            resp['X-Accel-Redirect'],
+            utils.create_url('foo_thumbnail.jpg')
+        )
+
+    def test_x_sendfile(self):
+        """
+        Checks whether the file is sent by the web server
+        """
+        with patch_settings({'sendfile': 'x-sendfile'}):
+            resp = self.client.get(self.image.thumbnail_url)
+        self.assertEqual(resp['X-Sendfile'], self.thumbnail.path)
+
+    def test_unknown_variant(self):
+        """
+        Checks whether the view returns 404 error
+        if the variant does not exist
+        """
+        url = reverse('content_gallery:variant', args=('foo', 'foo_foo.jpg'))
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_unknown_file(self):
+        """
+        Checks whether the view returns 404 error
+        if the image does not exist
+        """
+        url = reverse(
+            'content_gallery:variant',
+            args=('thumbnail', 'bar_thumbnail.jpg')
+        )
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_not_required_variant(self):
+        """
+        Checks whether the view returns 404 error if the
+        variant is not required by the related object
+        """
+        with mock.patch.object(TestModel, 'gallery_variants', ['preview']):
+            resp = self.client.get(self.image.thumbnail_url)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_eager_variant(self):
+        """
+        Checks whether the view returns 404 error for the file
+        of the eager variant and does not create it again
+        """
+        preview = self.image.image.preview
+        os.remove(preview.path)
+        url = reverse(
+            'content_gallery:variant',
+            args=('preview', 'foo_preview.jpg')
+        )
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(os.path.isfile(preview.path))
+        self.assertFalse(models.CachedVariant.objects.exists())
+
+    def test_eager_file_not_evicted(self):
+        """
+        Checks whether the file of the eager variant requested
+        through the view survives the eviction
+        """
+        preview = self.image.image.preview
+        url = reverse(
+            'content_gallery:variant',
+            args=('preview', 'foo_preview.jpg')
+        )
+        self.client.get(url)
+        models.CachedVariant.objects.evict(0)
+        self.assertTrue(os.path.isfile(preview.path))
+
+
+class TestVariantLayout(ImageTestCase):
+    """
+    Tests for the view returning files of variants created on demand
+    using the hashed layout of subdirectories. Inherits a TestModel
+    object and an image related to that, the image is unique per test.
+    """
+
+    def setUp(self):
+        """
+        Makes the thumbnail lazy and creates the image
+        """
+        variants = [
+            {'name': 'thumbnail', 'width': 20, 'height': 20, 'lazy': True},
+        ]
+        self.settings_patcher = patch_settings(
+            {'variants': variants, 'layout': 'hash'}
+        )
+        self.settings_patcher.__enter__()
+        super().setUp()
+
+    def tearDown(self):
+        """
+        Removes the image and restores the settings
+        """
+        super().tearDown()
+        models.CachedVariant.objects.all().delete()
+        self.settings_patcher.__exit__(None, None, None)
+
+    def test_create_file(self):
+        """
+        Checks whether the file is created in the subdirectory
+        and tracked with the subdirectory in the name
+        """
+        location = utils.create_shard('foo') + '/foo_thumbnail.jpg'
+        url = reverse('content_gallery:variant', args=('thumbnail', location))
+        self.assertEqual(self.image.thumbnail_url, url)
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(os.path.isfile(self.image.image.thumbnail.path))
+        self.assertTrue(
+            models.CachedVariant.objects.filter(name=location).exists()
+        )
+
+    def test_wrong_subdirectory(self):
+        """
+        Checks whether the file is not found in another subdirectory
+        """
+        url = reverse(
+            'content_gallery:variant',
+            args=('thumbnail', 'ab/cd/foo_thumbnail.jpg')
+        )
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
+
+class TestDownload(ImageTestCase):
+    """
+    Tests for the view returning the ZIP archive of images. Inherits
+    a TestModel object and an image related to that, the image
+    is unique per test
+    """
+
+    def get_archive(self, variant=None):
+        """
+        Sends the request and returns the ZipFile of the response
+        """
+        resp = self.client.get(utils.create_download_url(self.object, variant))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'application/zip')
+        self.assertIn('testobject.zip', resp['Content-Disposition'])
+        data = b''.join(resp.streaming_content)
+        return zipfile.ZipFile(io.BytesIO(data))
+
+    def test_full_size_images(self):
+        """
+        Checks whether the archive contains full-size
+        images stored without compression
+        """
+        archive = self.get_archive()
+        self.assertEqual(archive.namelist(), ['1-foo.jpg'])
+        info = archive.getinfo('1-foo.jpg')
+        self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        with open(self.image.image.path, 'rb') as f:
+            self.assertEqual(archive.read('1-foo.jpg'), f.read())
+
+    def test_variant(self):
+        """
+        Checks whether files of the variant are added
+        """
+        archive = self.get_archive('thumbnail')
+        self.assertEqual(
+            archive.namelist(),
+            ['1-foo.jpg', 'thumbnail/1-foo_thumbnail.jpg']
+        )
+
+    def test_missing_file(self):
+        """
+        Checks whether missing files are skipped
+        """
+        os.remove(self.image.image.thumbnail.path)
+        archive = self.get_archive('thumbnail')
+        self.assertEqual(archive.namelist(), ['1-foo.jpg'])
+
+    def test_unknown_variant(self):
+        """
+        Checks whether the view returns 404 error
+        if the variant does not exist
+        """
+        url = utils.create_download_url(self.object) + '?variant=foo'
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_unknown_object(self):
+        """
+        Checks whether the view returns 404 error
+        if the object does not exist
+        """
+        url = reverse(
+            'content_gallery:download',
+            args=('tests', 'testmodel', self.object.pk + 1)
+        )
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
@@ -3,6 +3,8 @@ from io import BytesIO
 from contextlib import contextmanager
 from PIL import Image
 
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
 from django.core.files.uploadedfile import InMemoryUploadedFile
 
 from .. import settings
@@ -75,5 +77,39 @@ def clean_db():
     """
     TestModel.objects.all().delete()
     AnotherTestModel.objects.all().delete()
+    ThumbnailTestModel.objects.all().delete()
     WrongTestModel.objects.all().delete()
+    SummaryTestModel.objects.all().delete()
     models.Image.objects.all().delete()
+
+
+class InMemoryStorage(Storage):
+    """
+    A storage keeping files in a dict. Used as a stand-in
+    for remote storages which do not support paths.
+    """
+
+    def __init__(self):
+        self.files = {}
+
+    def _open(self, name, mode='rb'):
+        try:
+            return ContentFile(self.files[name], name)
+        except KeyError:
+            raise FileNotFoundError(name)
+
+    def _save(self, name, content):
+        self.files[name] = b''.join(content.chunks())
+        return name
+
+    def delete(self, name):
+        self.files.pop(name, None)
+
+    def exists(self, name):
+        return name in self.files
+
+    def size(self, name):
+        return len(self.files[name])
+
+    def url(self, name):
+        return '/storage/' + name
@@ -18,4 +18,17 @@ urlpatterns = [
         views.gallery_data,
         name='gallery_data'
     ),
+    # a URL of the ZIP archive of all images related to the object
+    url(
+        r'^download/(?P<app_label>\w+)/'
+        '(?P<content_type>\w+)/(?P<object_id>\d+)/$',
+        views.download,
+        name='download'
+    ),
+    # a URL of files of variants created on the first request
+    url(
+        r'^variants/(?P<variant>\w+)/(?P<filename>(?:[\w-]+/)*[\w.-]+)$',
+        views.variant,
+        name='variant'
+    ),
 ]
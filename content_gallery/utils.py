@@ -1,16 +1,73 @@
-import sys
 import os
 import re
 import io
+import sys
+import json
+import time
+import uuid
+import zipfile
+import hashlib
+import itertools
+import tempfile
+import functools
+import contextlib
+from concurrent import futures
 from PIL import Image
-import magic
+
+try:
+    import magic
+except ImportError:
+    # python-magic is optional, MIME types are taken from Pillow
+    magic = None
 
 from django.core import urlresolvers
+from django.db import transaction
+from django.core.files import locks
 from django.core.files import uploadedfile
+from django.core.files.base import File
+from django.core.exceptions import ValidationError
+from django.core.management.base import CommandError
 from django.conf import settings as django_settings
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
 
 from . import settings
 
+# names and suffixes of variants created if the list
+# of variants is not specified in the settings
+DEFAULT_VARIANTS = (
+    ('small_image', 'small'),
+    ('preview', 'preview'),
+    ('small_preview', 'small_preview'),
+    ('thumbnail', 'thumbnail'),
+)
+
+# the number of lock files shared between all locked names
+LOCK_STRIPES = 256
+
+# the content hash in the end of immutable file names
+CONTENT_HASH_RE = re.compile(r'-[0-9a-f]{12}$')
+
+# ids of chunked uploads generated by the inline admin
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# the time in seconds unfinished chunked uploads are kept
+UPLOAD_EXPIRE = 24 * 3600
+
+# the difference hash is computed using the grayscale image of
+# (DHASH_SIZE + 1) x DHASH_SIZE pixels, so it contains DHASH_SIZE ** 2 bits
+DHASH_SIZE = 8
+
+# the difference hash is split into chunks stored in indexed fields,
+# hashes within the distance of DHASH_CHUNKS - 1 have an equal chunk
+DHASH_CHUNKS = 4
+DHASH_CHUNK_BITS = DHASH_SIZE ** 2 // DHASH_CHUNKS
+
+# file extensions of image formats that differ from the format name
+FORMAT_EXTS = {
+    'JPEG': '.jpg',
+}
+
 def get_choices_url_pattern():
     """
     Returns the pattern of URL for getting product choices
@@ -54,6 +111,20 @@ def get_admin_new_image_preview_url_pattern():
     # remove argument (last digits in the URL with '/' optionally)
     return re.sub(r'\d+/?$', '', preview_url)
 
+def create_download_url(obj, variant=None):
+    """
+    Returns the URL of the ZIP archive of full-size images related
+    to the object, files of the variant are added if it's specified
+    """
+    ctype = ContentType.objects.get_for_model(obj)
+    url = urlresolvers.reverse(
+        'content_gallery:download',
+        args=(ctype.app_label, ctype.model, obj.pk)
+    )
+    if variant:
+        url += '?variant=' + variant
+    return url
+
 def calculate_image_size(size, target_size):
     """
     Returns the size of the image after resizing.
@@ -88,60 +159,763 @@ def get_name(filename):
     name, ext = os.path.splitext(filename)
     return name
 
-def create_path(filename):
+def get_format_ext(format):
+    """
+    Returns the ext with prefix dot used for files of the image format
+    """
+    return FORMAT_EXTS.get(format.upper(), '.' + format.lower())
+
+def get_variants():
+    """
+    Returns a list of dicts describing variants of images.
+    Optional items absent in the settings are filled with defaults.
+    """
+    variants = settings.CONF['variants']
+    if variants is None:
+        # create default variants using the sizes from the settings
+        variants = [
+            {
+                'name': name,
+                'suffix': suffix,
+                'width': settings.CONF[name + '_width'],
+                'height': settings.CONF[name + '_height'],
+            }
+            for name, suffix in DEFAULT_VARIANTS
+        ]
+    result = []
+    for variant in variants:
+        spec = {
+            'suffix': variant['name'],
+            'format': None,
+            'quality': None,
+            'lazy': False,
+        }
+        spec.update(variant)
+        # Pillow names formats in upper case, e.g. 'jpeg' is 'JPEG'
+        if spec['format']:
+            spec['format'] = spec['format'].upper()
+        result.append(spec)
+    return result
+
+def get_variant(name):
+    """
+    Returns a dict describing the variant with given name
+    """
+    for variant in get_variants():
+        if variant['name'] == name:
+            return variant
+    raise KeyError("Unknown variant '{}'".format(name))
+
+def is_lazy_file(location):
+    """
+    Returns True if the file with given name is a file of the lazy
+    variant according to the suffix, probably followed by the version
+    """
+    name = get_name(os.path.basename(location))
+    for variant in get_variants():
+        if not variant['lazy']:
+            continue
+        pattern = r'_{}(-[0-9a-f]{{8}})?$'.format(re.escape(variant['suffix']))
+        if re.search(pattern, name):
+            return True
+    return False
+
+def create_shard(name):
+    """
+    Returns the subdirectory of the gallery folder for files of the image
+    with given name (or slug) according to the 'layout' setting. Returns
+    an empty string if files are stored in the gallery folder directly.
+    """
+    layout = settings.CONF['layout']
+    if layout == 'hash':
+        # the name of the full-size image without the ext is used,
+        # so all files of the image are stored in the same directory
+        name = get_name(os.path.basename(name))
+        digest = hashlib.md5(name.encode()).hexdigest()
+        return '/'.join([digest[:2], digest[2:4]])
+    if layout == 'date':
+        return timezone.now().strftime('%Y/%m/%d')
+    return ''
+
+def get_shard(name):
+    """
+    Returns the subdirectory of the gallery folder
+    containing the file with given name in the database
+    """
+    directory = os.path.dirname(name)
+    gallery_path = settings.CONF['path'].strip('/')
+    if not directory.startswith(gallery_path + '/'):
+        return ''
+    return directory[len(gallery_path) + 1:]
+
+def create_path(filename, shard=''):
     """
     Returns the path to the file located in the gallery folder
+    or in its subdirectory specified by 'shard'
     """
     return os.path.join(
         django_settings.MEDIA_ROOT,
         settings.CONF['path'],
+        shard,
         filename
     )
 
-def create_url(filename):
+def create_url(filename, shard=''):
     """
     Returns the URL of the file located in the gallery folder
+    or in its subdirectory specified by 'shard'
     """
     # remove slashes to avoid double slashes in the URL
     # keep the first slash in the MEDIA_URL
     media_url = django_settings.MEDIA_URL.rstrip('/')
     gallery_path = settings.CONF['path'].strip('/')
+    if shard:
+        return '/'.join([media_url, gallery_path, shard, filename])
     return '/'.join([media_url, gallery_path, filename])
 
-def name_in_db(name):
+def create_variant_url(variant, filename):
+    """
+    Returns the URL of the view that creates the file
+    of the variant on the first request
+    """
+    return urlresolvers.reverse(
+        'content_gallery:variant',
+        args=(variant, filename)
+    )
+
+def name_in_db(name, shard=''):
     """
     Returns the name of the file after saving data to the database
-    Adds the gallery folder to the file name
+    Adds the gallery folder and its subdirectory to the file name
     """
-    return os.path.join(settings.CONF['path'], name)
+    return os.path.join(settings.CONF['path'], shard, name)
 
-def image_resize(src, dst, size):
+def create_content_hash(chunks, length=12):
     """
-    Resizes the image and saves it to the 'dst' (filename of io object)
+    Returns a hash of the file content given as an iterable of chunks.
+    The short hash is used in immutable file names, the whole hash
+    ('length' is None) identifies identical uploads.
+    """
+    hasher = hashlib.sha256()
+    for chunk in chunks:
+        hasher.update(chunk)
+    return hasher.hexdigest()[:length]
+
+def get_slug(name):
+    """
+    Returns the slug of the image with given name excluding
+    the ext and the content hash of immutable file names
+    """
+    name = get_name(os.path.basename(name))
+    return CONTENT_HASH_RE.sub('', name)
+
+def delete_on_commit(storage, names):
+    """
+    Deletes files with given names from the storage when the current
+    transaction is committed or immediately if there is no transaction
+    """
+    names = list(names)
+    if not names:
+        return
+
+    def delete():
+        for name in names:
+            storage.delete(name)
+    transaction.on_commit(delete)
+
+def create_dhash(src):
+    """
+    Returns the perceptual difference hash (dHash) of the image as an int.
+    Each bit shows whether the pixel of the small grayscale image is
+    brighter than its right neighbour, so resized, re-saved or slightly
+    cropped copies of the image have close hashes.
+    """
+    width = DHASH_SIZE + 1
+    with Image.open(src) as img:
+        # decode JPEG images in the reduced size which is much faster
+        img.draft('L', (width * 4, DHASH_SIZE * 4))
+        img = img.convert('L').resize((width, DHASH_SIZE), Image.BILINEAR)
+        pixels = list(img.getdata())
+    value = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            left = pixels[row * width + col]
+            value = value << 1 | (left > pixels[row * width + col + 1])
+    return value
+
+def split_dhash(value):
+    """
+    Returns a list of DHASH_CHUNKS chunks of the difference hash
+    """
+    mask = (1 << DHASH_CHUNK_BITS) - 1
+    return [
+        value >> (DHASH_CHUNK_BITS * i) & mask
+        for i in range(DHASH_CHUNKS)
+    ]
+
+def join_dhash(chunks):
+    """
+    Returns the difference hash composed of its chunks
+    """
+    value = 0
+    for i, chunk in enumerate(chunks):
+        value |= chunk << (DHASH_CHUNK_BITS * i)
+    return value
+
+def get_chunk_neighbours(chunk, radius):
+    """
+    Returns a list of chunks that differ from given one
+    in 'radius' bits at most, including the chunk itself
+    """
+    neighbours = [chunk]
+    for count in range(1, radius + 1):
+        for bits in itertools.combinations(range(DHASH_CHUNK_BITS), count):
+            value = chunk
+            for bit in bits:
+                value ^= 1 << bit
+            neighbours.append(value)
+    return neighbours
+
+def hamming_distance(a, b):
+    """
+    Returns the number of different bits of two hashes
+    """
+    return bin(a ^ b).count('1')
+
+def create_fingerprint(*args):
+    """
+    Returns a short hash of given values. Used to detect changes
+    in settings the image files have been created with.
+    """
+    data = json.dumps(args, sort_keys=True)
+    return hashlib.md5(data.encode()).hexdigest()[:8]
+
+def image_resize(src, dst, size, format=None, quality=None):
+    """
+    Resizes the image and saves it to the 'dst' (filename of io object).
+    The image is saved in its original format if 'format' is not specified.
+    Returns the format the image has been saved in.
     """
     with Image.open(src) as img:
         img.thumbnail(size)  # use 'thumbnail' to keep aspect ratio
-        img.save(dst, img.format)
+        format = format or img.format
+        params = {}
+        if quality:
+            params['quality'] = quality
+        # JPEG does not support transparency and palettes
+        if format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(dst, format, **params)
+    return format
+
+def get_mime_type(format, data=None):
+    """
+    Returns the MIME type of the image format using the registry of
+    Pillow. The 'data' of the image is sniffed by python-magic if it's
+    installed and Pillow does not know the MIME type of the format.
+    """
+    mime = Image.MIME.get(format)
+    if mime is None and magic is not None and data is not None:
+        mime = magic.from_buffer(data, mime=True)
+    return mime or 'application/octet-stream'
+
+def get_image_info(src):
+    """
+    Returns the size and the format of the image. Only the header
+    of the image is read, the image data is not decoded.
+    """
+    with Image.open(src) as img:
+        return img.size, img.format
+
+def check_image_limits(f):
+    """
+    Checks whether the image file does not exceed limits of the size
+    in bytes and the number of pixels specified in the settings. Only
+    the header of the image is read, so huge images are rejected before
+    decoding. Raises the ValidationError if the limit is exceeded.
+    """
+    max_bytes = settings.CONF['max_upload_bytes']
+    max_pixels = settings.CONF['max_upload_pixels']
+    if max_bytes is not None:
+        f.seek(0, io.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        if size > max_bytes:
+            raise ValidationError(
+                "The image file is too large ({} bytes, {} at most)".format(
+                    size,
+                    max_bytes
+                ),
+                code='file_too_large'
+            )
+    if max_pixels is not None:
+        f.seek(0)
+        try:
+            (width, height), format = get_image_info(f)
+        except OSError:
+            # the broken image is reported by the image validation
+            return
+        finally:
+            f.seek(0)
+        if width * height > max_pixels:
+            raise ValidationError(
+                "The image is too large ({}x{} pixels, {} at most)".format(
+                    width,
+                    height,
+                    max_pixels
+                ),
+                code='too_many_pixels'
+            )
+
+def storage_save(storage, name, content):
+    """
+    Saves the content (a file object) to the storage with given name
+    replacing the existing file. Local files are written under temporary
+    names and renamed, so partially written files are never exposed by
+    their names and the existing file is replaced atomically. Files of
+    remote storages are deleted and saved again since storages never
+    overwrite files.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        pass
+    else:
+        _replace_local_file(storage, path, File(content, name))
+        return
+    storage.delete(name)
+    saved_name = storage.save(name, File(content, name))
+    if saved_name != name:
+        # the file has been created concurrently with the same name
+        storage.delete(saved_name)
+        raise FileExistsError("The file '{}' already exists".format(name))
+
+def _replace_local_file(storage, path, content):
+    """
+    Writes the content to the temporary file in the directory of the
+    path and renames it to the path. The file gets permissions of files
+    created by the storage.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    # the mode is limited by the umask like modes of files of the storage
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        mode = getattr(storage, 'file_permissions_mode', None)
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+def storage_rename(storage, old_name, new_name):
+    """
+    Renames the file in the storage. Raises the FileNotFoundError
+    if the file does not exist.
+    """
+    try:
+        old_path = storage.path(old_name)
+        new_path = storage.path(new_name)
+    except NotImplementedError:
+        # remote storages can't rename files, so copy the file
+        if not storage.exists(old_name):
+            raise FileNotFoundError(
+                "The file '{}' does not exist".format(old_name)
+            )
+        with storage.open(old_name, 'rb') as f:
+            storage_save(storage, new_name, f)
+        storage.delete(old_name)
+    else:
+        # local files are just moved
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.rename(old_path, new_path)
+
+def storage_link(storage, name, new_name, content):
+    """
+    Creates the file with new name containing the same data as the
+    existing file. Local files are hard linked, so the data is stored
+    once. Otherwise the 'content' (a file object containing the data
+    of the existing file) is saved again without re-encoding.
+    """
+    try:
+        path = storage.path(name)
+        new_path = storage.path(new_name)
+    except NotImplementedError:
+        # remote storages do not support links
+        path = None
+    if path is not None:
+        storage.delete(new_name)
+        try:
+            os.link(path, new_path)
+            return
+        except OSError:
+            # the file system does not support hard links
+            pass
+    content.seek(0)
+    storage_save(storage, new_name, content)
+
+def storage_delete(storage, name):
+    """
+    Deletes the file from the storage. Returns True if the file has
+    existed. Local files are removed by a single system call.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # remote storages do not report whether the file has existed
+        if not storage.exists(name):
+            return False
+        storage.delete(name)
+        return True
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def storage_delete_many(storage, names):
+    """
+    Deletes files with given names from the storage using a pool of
+    'storage_workers' threads. Returns the number of removed files.
+    """
+    names = list(names)
+    if not names:
+        return 0
+    workers = settings.CONF['storage_workers']
+    with futures.ThreadPoolExecutor(workers) as executor:
+        return sum(executor.map(
+            functools.partial(storage_delete, storage),
+            names
+        ))
+
+@contextlib.contextmanager
+def lock_file(name):
+    """
+    Acquires an exclusive lock associated with the file name, the lock
+    works across threads and processes. A limited number of lock files
+    is used, so different names could share the same lock.
+    """
+    lock_dir = settings.CONF['lock_dir'] or os.path.join(
+        tempfile.gettempdir(),
+        'content_gallery_locks'
+    )
+    os.makedirs(lock_dir, exist_ok=True)
+    stripe = int(hashlib.md5(name.encode()).hexdigest(), 16) % LOCK_STRIPES
+    path = os.path.join(lock_dir, '{}.lock'.format(stripe))
+    with open(path, 'ab') as f:
+        locks.lock(f, locks.LOCK_EX)
+        try:
+            yield
+        finally:
+            locks.unlock(f)
+
+class SpooledUpload:
+    """
+    The data of the uploaded file shared by threads creating image files.
+    Files not larger than 'max_memory_size' are kept in the memory, larger
+    files are spooled to a temporary file (the temporary file of the upload
+    is used if it exists), so each upload takes limited memory. The hash
+    of the content is calculated while reading the data.
+    """
+
+    # the size of chunks copied to the temporary file
+    chunk_size = 64 * 2 ** 10
+
+    def __init__(self, upload, name, max_memory_size):
+        self.name = name
+        self.data = None
+        self.path = None
+        self._temporary = False
+        hasher = hashlib.sha256()
+        upload.seek(0)
+        if hasattr(upload, 'temporary_file_path'):
+            # the upload has been saved to the disk by Django
+            self.path = upload.temporary_file_path()
+            for chunk in iter(lambda: upload.read(self.chunk_size), b''):
+                hasher.update(chunk)
+        else:
+            data = upload.read(max_memory_size + 1)
+            if len(data) <= max_memory_size:
+                self.data = data
+                hasher.update(data)
+            else:
+                fd, self.path = tempfile.mkstemp(prefix='content_gallery_')
+                self._temporary = True
+                with open(fd, 'wb') as f:
+                    while data:
+                        hasher.update(data)
+                        f.write(data)
+                        data = upload.read(self.chunk_size)
+        upload.seek(0)
+        self.content_hash = hasher.hexdigest()
+
+    def open(self):
+        """
+        Returns a new file object containing the uploaded data
+        """
+        if self.path is None:
+            return File(io.BytesIO(self.data), self.name)
+        return File(open(self.path, 'rb'), self.name)
+
+    def close(self):
+        """
+        Deletes the temporary file if it has been created
+        """
+        if self._temporary:
+            os.remove(self.path)
+            self._temporary = False
+
+
+def get_upload_dir():
+    """
+    Returns the directory of files of chunked uploads creating it if needed
+    """
+    upload_dir = settings.CONF['upload_dir'] or os.path.join(
+        tempfile.gettempdir(),
+        'content_gallery_uploads'
+    )
+    os.makedirs(upload_dir, exist_ok=True)
+    return upload_dir
+
+def delete_expired_uploads():
+    """
+    Deletes files of chunked uploads that have not been
+    changed for UPLOAD_EXPIRE seconds
+    """
+    upload_dir = get_upload_dir()
+    expired = timezone.now().timestamp() - UPLOAD_EXPIRE
+    for name in os.listdir(upload_dir):
+        path = os.path.join(upload_dir, name)
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+        except FileNotFoundError:
+            # the file has been deleted by another process
+            pass
+
+
+class ChunkedUpload:
+    """
+    The file uploaded by chunks in separate requests. Each chunk is written
+    at its offset, so the chunk sent again after a failed request replaces
+    the same bytes and the upload could be resumed from the received size.
+    The result of the completed upload is kept instead of the data, so the
+    final chunk sent again gets the same result.
+    """
+
+    def __init__(self, upload_id):
+        if not UPLOAD_ID_RE.match(upload_id):
+            raise ValueError("Invalid upload id '{}'".format(upload_id))
+        self.upload_id = upload_id
+        upload_dir = get_upload_dir()
+        self.path = os.path.join(upload_dir, upload_id + '.part')
+        self.result_path = os.path.join(upload_dir, upload_id + '.json')
+
+    @property
+    def received(self):
+        """
+        Returns the number of received bytes
+        """
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def write(self, offset, chunks):
+        """
+        Writes chunks of data at the offset. Raises the ValueError
+        if there is a gap between received data and the offset.
+        Returns the number of received bytes.
+        """
+        if offset > self.received:
+            raise ValueError("Bytes before {} are missing".format(offset))
+        # the file is opened without truncating received data
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600)
+        with open(fd, 'wb') as f:
+            f.seek(offset)
+            for chunk in chunks:
+                f.write(chunk)
+        return self.received
+
+    def get_result(self):
+        """
+        Returns the result of the completed upload or None
+        """
+        try:
+            with open(self.result_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set_result(self, result):
+        """
+        Stores the result of the completed upload and deletes its data
+        """
+        tmp_path = self.result_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self.result_path)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+    def open(self, name):
+        """
+        Returns the uploaded file containing received data
+        """
+        return ChunkedUploadedFile(self.path, name)
+
+
+class ChunkedUploadedFile(uploadedfile.UploadedFile):
+    """
+    The file assembled from chunks. It's treated like the temporary file
+    of a usual upload, so the data is not copied while validating the
+    image and creating its files.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        super().__init__(open(path, 'rb'), name, None,
+            os.path.getsize(path), None)
+
+    def temporary_file_path(self):
+        """
+        Returns the path of the file
+        """
+        return self.path
+
+
+class InMemoryImageFile(uploadedfile.InMemoryUploadedFile):
+    """
+    An uploaded file containing encoded image data in the memory.
+    The data is never copied: the io object shares the bytes object
+    and the storage gets the whole data as a single chunk.
+    """
+
+    def __init__(self, data, name, content_type):
+        self.data = data
+        # the io object created with bytes does not copy them
+        # until the data is changed
+        super().__init__(io.BytesIO(data), 'ImageField', name,
+            content_type, len(data), None)
+
+    def chunks(self, chunk_size=None):
+        """
+        Yields the whole data at once, so the storage writes it
+        by a single call. The bytes object is passed instead of
+        a memoryview since storages choose the mode of files
+        checking whether chunks are bytes.
+        """
+        self.file.seek(0, io.SEEK_END)
+        yield self.data
+
+    def multiple_chunks(self, chunk_size=None):
+        """
+        The data is always written as a single chunk
+        """
+        return False
+
+    def getbuffer(self):
+        """
+        Returns a read-only memoryview of the data
+        """
+        return memoryview(self.data)
+
+class ZipStream:
+    """
+    A write-only file object collecting data written by the ZipFile,
+    so the archive could be sent by chunks while it's being created.
+    It is not seekable, so the ZipFile writes sizes of files after
+    their data.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        """
+        Stores the chunk of data written by the ZipFile
+        """
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        """
+        Returns the number of written bytes, the ZipFile
+        stores offsets of files in the archive
+        """
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """
+        Returns the data written since the last call
+        """
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def create_zip_chunks(image_files):
+    """
+    Yields chunks of the ZIP archive containing image files. The
+    'image_files' is an iterable of (name in the archive, image file)
+    tuples. Each file is copied to the archive by chunks which are
+    yielded right away, so neither the archive nor a whole file is kept
+    in the memory. Files are stored without compression since images
+    are compressed already. Missing files are skipped.
+    """
+    stream = ZipStream()
+    date_time = time.localtime()[:6]
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for name, image_file in image_files:
+            try:
+                source = image_file.open()
+            except OSError:
+                continue
+            info = zipfile.ZipInfo(name, date_time)
+            with source:
+                if sys.version_info < (3, 6):
+                    # files could be written by chunks since Python 3.6
+                    archive.writestr(info, source.read())
+                else:
+                    with archive.open(info, 'w') as dest:
+                        for chunk in source.chunks():
+                            dest.write(chunk)
+                            yield stream.pop()
+            yield stream.pop()
+    # the central directory
+    yield stream.pop()
 
 def create_in_memory_image(image, name, size):
     """
-    Resizes the image and saves it as InMemoryUploadedFile object
-    Returns the InMemoryUploadedFile object with the image data
+    Resizes the image and saves it as InMemoryImageFile object
+    Returns the InMemoryImageFile object with the image data
     """
     output = io.BytesIO()  # create an io object
     # resize the image and save it to the io object
-    image_resize(image, output, size)
-    # get MIME type of the image
-    mime = magic.from_buffer(output.getvalue(), mime=True)
-    # create InMemoryUploadedFile using data from the io
-    return uploadedfile.InMemoryUploadedFile(output, 'ImageField', name,
-        mime, sys.getsizeof(output), None)
+    format = image_resize(image, output, size)
+    # the io object gives its buffer away without copying
+    # if there are no other references to the buffer
+    data = output.getvalue()
+    del output
+    # get MIME type of the image from the format written by Pillow
+    mime = get_mime_type(format, data)
+    return InMemoryImageFile(data, name, mime)
 
 def create_image_data(image):
     """
     Returns a dict with the full-size image
     and the small image URLs with sizes
     """
+    small_image = get_variant('small_image')
     return {
         "image": {
             "url": image.image_url,
@@ -150,8 +924,8 @@ def create_image_data(image):
         },
         "small_image":  {
             "url": image.small_image_url,
-            "width": settings.CONF['small_image_width'],
-            "height": settings.CONF['small_image_height']
+            "width": small_image['width'],
+            "height": small_image['height']
         }
     }
 
@@ -165,12 +939,27 @@ def create_static_url(url):
     # use obfuscated file in non-DEBUG mode
     return get_obfuscated_file(path)
 
+def get_content_type(label):
+    """
+    Returns the ContentType object using its 'app_label.model' label.
+    Used by management commands, so the CommandError is raised
+    if the content type does not exist.
+    """
+    try:
+        app_label, model = label.lower().split('.')
+        return ContentType.objects.get_by_natural_key(app_label, model)
+    except (ValueError, ContentType.DoesNotExist):
+        raise CommandError("Unknown content type '{}'".format(label))
+
 def get_first_image(obj):
     """
     Returns the first image related to the object or None
     if there is no images. The first image is the image
     with the smallest value of the 'position' field. 
     """
+    if getattr(obj, 'gallery_summary', False):
+        # the cover is built from the summary without reading images
+        return obj.get_gallery_cover()
     # get one image ordered by 'position'
     images = obj.content_gallery.all().order_by('position')[:1]
     # return None if result is empty
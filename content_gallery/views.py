@@ -1,6 +1,10 @@
+import os
+import re
 import json
+import mimetypes
 
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, FileResponse, Http404
+from django.http import StreamingHttpResponse
 from django.contrib.contenttypes.models import ContentType
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import PermissionDenied
@@ -48,6 +52,8 @@ def gallery_data(request, app_label, content_type, object_id):
     # allow only AJAX requests
     if not request.is_ajax():
         raise PermissionDenied
+    small_image = utils.get_variant('small_image')
+    thumbnail = utils.get_variant('thumbnail')
     # the maximum size of full-size images
     image_size = {
         "width": settings.CONF['image_width'],
@@ -55,13 +61,13 @@ def gallery_data(request, app_label, content_type, object_id):
     }
     # the maximum size of small images
     small_image_size = {
-        "width": settings.CONF['small_image_width'],
-        "height": settings.CONF['small_image_height']
+        "width": small_image['width'],
+        "height": small_image['height']
     }
     # the maximum size of thumbnails
     thumbnail_size = {
-        "width": settings.CONF['thumbnail_width'],
-        "height": settings.CONF['thumbnail_height']
+        "width": thumbnail['width'],
+        "height": thumbnail['height']
     }
     # get the ContentType object or raise 404
     ctype = get_object_or_404(
@@ -74,10 +80,7 @@ def gallery_data(request, app_label, content_type, object_id):
     # order images by 'position'
     qs = obj.content_gallery.order_by('position')
     # the target size of the small image from the settings
-    max_size = (
-        settings.CONF['small_image_width'],
-        settings.CONF['small_image_height']
-    )
+    max_size = (small_image['width'], small_image['height'])
 
     # Since there is the resizing effect when user switches to another
     # image, the JavaScript code requires actual sizes of images. But
@@ -132,3 +135,147 @@ def gallery_data(request, app_label, content_type, object_id):
     }
     # send the response in JSON format
     return HttpResponse(json.dumps(response), content_type='application/json')
+
+
+def _get_download_files(images, variant):
+    """
+    Yields (name in the archive, image file) tuples of full-size images
+    and files of the variant if it's specified. Names are numbered in the
+    order of images since images sharing files have the same file names.
+    """
+    for number, image in enumerate(images, 1):
+        image_data = image.image.image_data
+        yield '{}-{}'.format(number, image_data.filename), image_data
+        if variant and variant in image.get_variant_names():
+            image_file = image.image.variants[variant]
+            yield '{}/{}-{}'.format(
+                variant,
+                number,
+                image_file.filename
+            ), image_file
+
+
+def download(request, app_label, content_type, object_id):
+    """
+    Returns the ZIP archive of full-size images attached to the object.
+    Files of the variant specified by the 'variant' parameter are added
+    to the subdirectory of the archive. The archive is created while
+    it's being sent, so the memory does not depend on the number of
+    images.
+    """
+    variant = request.GET.get('variant')
+    if variant:
+        try:
+            utils.get_variant(variant)
+        except KeyError:
+            raise Http404
+    # get the ContentType object or raise 404
+    ctype = get_object_or_404(
+        ContentType,
+        app_label=app_label,
+        model=content_type
+    )
+    # get the object of the model or raise 404
+    obj = get_object_or_404(ctype.model_class(), pk=object_id)
+    # the model does not use the ContentGalleryMixin
+    if not hasattr(obj, 'content_gallery'):
+        raise Http404
+    # images are not cached by the queryset
+    images = obj.content_gallery.order_by('position').iterator()
+    response = StreamingHttpResponse(
+        utils.create_zip_chunks(_get_download_files(images, variant)),
+        content_type='application/zip'
+    )
+    filename = models.slugify(str(obj)) or 'gallery'
+    response['Content-Disposition'] = 'attachment; filename="{}.zip"'.format(
+        filename
+    )
+    return response
+
+
+def _find_image(variant, location):
+    """
+    Returns the image whose file of the variant has given name
+    including the subdirectory of the gallery folder or None
+    if there is no such image.
+    """
+    shard, filename = os.path.split(location)
+    # the file name of the variant is the name of the full-size
+    # image with the suffix of the variant, probably the version
+    # and another ext
+    match = re.match(
+        r'^(.+)_{}(-[0-9a-f]{{8}})?$'.format(re.escape(variant['suffix'])),
+        utils.get_name(filename)
+    )
+    if match is None:
+        return None
+    prefix = utils.name_in_db(match.group(1) + '.', shard)
+    for image in models.Image.objects.filter(image__startswith=prefix):
+        if image.image.variants[variant['name']].location == location:
+            return image
+    return None
+
+
+def _send_file(image_file):
+    """
+    Returns a response sending the image file. The file is sent
+    by the web server if it's specified in the settings.
+    """
+    content_type = mimetypes.guess_type(image_file.filename)[0]
+    sendfile = settings.CONF['sendfile']
+    if sendfile == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = utils.create_url(
+            image_file.filename,
+            image_file.shard
+        )
+    elif sendfile == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = image_file.storage.path(
+            image_file.storage_name
+        )
+    else:
+        response = FileResponse(image_file.open(), content_type=content_type)
+    if settings.CONF['hashed_names']:
+        # the content of immutable files is never changed
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def variant(request, variant, filename):
+    """
+    Returns the file of the lazy variant of the image. The file
+    is created using the full-size image on the first request.
+    """
+    try:
+        spec = utils.get_variant(variant)
+    except KeyError:
+        raise Http404
+    image = _find_image(spec, filename)
+    # the file could be requested only if the related object requires it
+    if image is None or variant not in image.get_variant_names():
+        raise Http404
+    image_file = image.image.variants[variant]
+    # files of eager variants are served from the MEDIA_URL and
+    # should never be created again or tracked by the view
+    if not image_file.lazy:
+        raise Http404
+    if image_file.exists():
+        models.CachedVariant.objects.touch(image_file)
+    else:
+        # only one request creates the file, others wait for it
+        with utils.lock_file(image_file.location):
+            # the file could be created while waiting for the lock
+            if not image_file.exists():
+                try:
+                    image.image.create_variant_file(variant)
+                except (OSError, ValueError):
+                    # the full-size image is missing or broken
+                    raise Http404
+                image.update_fingerprints([variant])
+                models.CachedVariant.objects.track(image_file)
+        # delete least recently used files if the new file exceeds the limit
+        max_bytes = settings.CONF['cache_max_bytes']
+        if max_bytes is not None:
+            models.CachedVariant.objects.evict(max_bytes)
+    return _send_file(image_file)
@@ -11,7 +11,6 @@ from django.contrib.admin import widgets
 from django.utils import html
 
 from . import utils
-from . import settings
 from . import fields
 
 class ContentTypeSelect(forms.Select):
@@ -149,15 +148,16 @@ class ImageWidget(widgets.AdminFileWidget):
             # get image data
             data = utils.create_image_data(value)
             # fill the template and replace the default one
+            preview = utils.get_variant('preview')
             self.template_with_initial = self.template.format(
-                settings.CONF['preview_width'] + 14,
-                settings.CONF['preview_height'] + 14,
-                settings.CONF['preview_width'],
-                settings.CONF['preview_height'],
-                settings.CONF['preview_height'],
+                preview['width'] + 14,
+                preview['height'] + 14,
+                preview['width'],
+                preview['height'],
+                preview['height'],
                 html.escape(json.dumps(data)),
                 utils.create_static_url("content_gallery/img/zoom.png"),
-                settings.CONF['preview_width'] - 55
+                preview['width'] - 55
             )
         # render the widget
         return super().render(name, value, attrs)
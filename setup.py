@@ -45,10 +45,12 @@ setup(
     install_requires=[
         'Django>=1.10',
         'Pillow>=3.0.0',
-        'python-magic>=0.4.2',
         'awesome-slugify>=1.6',
         'django-admin-jqueryui112',
     ],
+    extras_require={
+        'magic': ['python-magic>=0.4.2'],
+    },
     classifiers=[
         'Framework :: Django :: 1.10',
         'Framework :: Django :: 1.11',